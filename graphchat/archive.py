@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any
+
+from .graph_cache import graph_cache
+from .metrics import metrics
+
+if TYPE_CHECKING:
+    from .db import ConnectionPool
+
+CODEC = "zlib"
+PAYLOAD_VERSION = 1
+COMPRESS_LEVEL = 6
+
+# Rows moved into an archive, each selected by a WHERE clause on the session id. Prefetched
+# suggestions are dropped instead: they only follow up the latest answer and are long stale.
+_ARCHIVED_TABLES = (
+    ("nodes", "session_id = ?"),
+    ("edges", "session_id = ?"),
+    ("node_summaries", "node_id IN (SELECT id FROM nodes WHERE session_id = ?)"),
+)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _begin(conn: sqlite3.Connection) -> bool:
+    """Take the write lock up front so two workers never archive or restore the same session."""
+    if conn.in_transaction:
+        return False
+    conn.execute("BEGIN IMMEDIATE")
+    return True
+
+
+def archive_session(conn: sqlite3.Connection, session_id: str) -> bool:
+    """Move the session's graph rows into one compressed `session_archives` row.
+
+    Sessions with nothing to archive, already archived, or with review states (their queue
+    must keep finding the nodes) are left alone; returns whether the session was archived.
+    """
+    own_txn = _begin(conn)
+    try:
+        sizes = _archive_rows(conn, session_id)
+    except BaseException:
+        if own_txn:
+            conn.rollback()
+        raise
+    if own_txn:
+        conn.commit()
+    if sizes is None:
+        return False
+    graph_cache.invalidate(session_id)
+    metrics.incr("archive.archived")
+    metrics.incr("archive.raw_bytes", sizes[0])
+    metrics.incr("archive.stored_bytes", sizes[1])
+    return True
+
+
+def _archive_rows(conn: sqlite3.Connection, session_id: str) -> tuple[int, int] | None:
+    if conn.execute("SELECT 1 FROM session_archives WHERE session_id = ?", (session_id,)).fetchone():
+        return None
+    if conn.execute("SELECT 1 FROM review_states WHERE session_id = ? LIMIT 1", (session_id,)).fetchone():
+        return None
+    tables: dict[str, dict[str, Any]] = {}
+    for table, where in _ARCHIVED_TABLES:
+        cur = conn.execute(f"SELECT * FROM {table} WHERE {where}", (session_id,))
+        # Whatever columns the table has, so DBs with legacy extra columns restore intact.
+        tables[table] = {"columns": [d[0] for d in cur.description], "rows": [list(r) for r in cur.fetchall()]}
+    if not tables["nodes"]["rows"]:
+        return None
+    raw = json.dumps({"version": PAYLOAD_VERSION, "tables": tables}, ensure_ascii=False).encode("utf-8")
+    payload = zlib.compress(raw, COMPRESS_LEVEL)
+    conn.execute(
+        """
+        INSERT INTO session_archives(session_id, codec, payload, raw_bytes, node_count, edge_count, archived_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (session_id, CODEC, payload, len(raw), len(tables["nodes"]["rows"]), len(tables["edges"]["rows"]), _now_iso()),
+    )
+    # Reverse order: summaries are found through the session's nodes.
+    for table, where in reversed(_ARCHIVED_TABLES):
+        conn.execute(f"DELETE FROM {table} WHERE {where}", (session_id,))
+    conn.execute("DELETE FROM prefetch_suggestions WHERE session_id = ?", (session_id,))
+    return len(raw), len(payload)
+
+
+def _decode(codec: str, payload: bytes) -> dict[str, Any]:
+    if codec != CODEC:
+        raise ValueError(f"unknown archive codec {codec!r}")
+    data = json.loads(zlib.decompress(payload))
+    if data.get("version") != PAYLOAD_VERSION:
+        raise ValueError(f"unsupported archive payload version {data.get('version')!r}")
+    return data
+
+
+def archived_rows(conn: sqlite3.Connection, session_id: str, table: str) -> list[dict[str, Any]] | None:
+    """The archived rows of one table as dicts, or None when the session is not archived."""
+    row = conn.execute("SELECT codec, payload FROM session_archives WHERE session_id = ?", (session_id,)).fetchone()
+    if row is None:
+        return None
+    entry = _decode(row[0], row[1])["tables"].get(table, {"columns": [], "rows": []})
+    return [dict(zip(entry["columns"], values)) for values in entry["rows"]]
+
+
+def restore_session(conn: sqlite3.Connection, session_id: str) -> bool:
+    """Move an archived session's rows back into the hot tables; False if it was not archived.
+
+    The check is a primary-key lookup, cheap enough for `Repository` to run on first access of
+    every session. Inside a caller's open transaction the restore joins it instead.
+    """
+    if conn.execute("SELECT 1 FROM session_archives WHERE session_id = ?", (session_id,)).fetchone() is None:
+        return False
+    own_txn = _begin(conn)
+    try:
+        row = conn.execute(
+            "SELECT codec, payload FROM session_archives WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            # Restored by another worker while this one waited for the lock.
+            if own_txn:
+                conn.commit()
+            return False
+        for table, entry in _decode(row[0], row[1])["tables"].items():
+            columns = entry["columns"]
+            if entry["rows"]:
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO {table}({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                    entry["rows"],
+                )
+        conn.execute("DELETE FROM session_archives WHERE session_id = ?", (session_id,))
+        # A restored session counts as active again, so it is not archived straight back.
+        conn.execute("UPDATE sessions SET active_at = ? WHERE id = ?", (_now_iso(), session_id))
+        if own_txn:
+            conn.commit()
+    except BaseException:
+        if own_txn:
+            conn.rollback()
+        raise
+    metrics.incr("archive.restored")
+    return True
+
+
+class SessionArchiver:
+    """Background thread that moves sessions inactive for `inactive_days` into the archive tier."""
+
+    def __init__(self) -> None:
+        self.inactive_days = 90.0
+        self.interval_seconds = 3600.0
+        self.batch_size = 100
+        self._pool: ConnectionPool | None = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def start(self, pool: ConnectionPool, inactive_days: float, interval_seconds: float, batch_size: int) -> None:
+        self.stop()
+        self._pool = pool
+        self.inactive_days = inactive_days
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="graphchat-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping = True
+            self._wake.set()
+            thread.join()
+
+    def run_once(self) -> int:
+        from .repository import Repository
+
+        pool = self._pool
+        if pool is None:
+            return 0
+        conn = pool.acquire()
+        try:
+            return len(Repository(conn, pool.shards).archive_inactive_sessions(self.inactive_days, self.batch_size))
+        finally:
+            pool.release(conn)
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            try:
+                self.run_once()
+            except Exception as exc:  # noqa: BLE001
+                metrics.incr("archive.failed")
+                print(f"[DEBUG] archive run failed: error={exc}")
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+
+
+session_archiver = SessionArchiver()
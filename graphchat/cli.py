@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+# Only config/db are imported eagerly; FastAPI, uvicorn and httpx load when actually serving.
+from .config import AppConfig, load_config
+from .db import MIGRATED_ENV, SCHEMA_VERSION, check_db, connect, init_db, open_shards, schema_version
+
+
+def _check() -> int:
+    try:
+        config = load_config(Path.cwd())
+    except (ValueError, FileNotFoundError) as exc:
+        print(f"Config check failed: {exc}")
+        return 1
+    print(f"Config OK: server={config.server.host}:{config.server.port}, workers={config.server.workers}")
+    problems = check_db(config.db.path)
+    if problems:
+        print("DB check failed:")
+        for item in problems:
+            print(f"- {item}")
+        return 1
+    if not Path(config.db.path).exists():
+        print(f"DB OK: {config.db.path} will be created on first start.")
+        return 0
+    conn = connect(config.db.path)
+    try:
+        version = schema_version(conn)
+    finally:
+        conn.close()
+    if version == SCHEMA_VERSION:
+        print(f"DB OK: schema version {version}.")
+    else:
+        print(f"DB OK: schema version {version}, will migrate to {SCHEMA_VERSION} on start.")
+    return 0
+
+
+def _export(path: str) -> int:
+    from .services.transfer_service import export_ndjson
+
+    config = load_config(Path.cwd())
+    init_db(config.db.path)
+    shards = open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    conn = connect(config.db.path)
+    try:
+        if path == "-":
+            sys.stdout.writelines(export_ndjson(conn, shards=shards))
+        else:
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.writelines(export_ndjson(conn, shards=shards))
+    finally:
+        conn.close()
+    return 0
+
+
+def _import(path: str) -> int:
+    from .services.transfer_service import NdjsonImporter
+
+    config = load_config(Path.cwd())
+    init_db(config.db.path)
+    shards = open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    conn = connect(config.db.path)
+    try:
+        with open(path, "rb") as fh:
+            result = NdjsonImporter(conn, shards=shards).run(fh)
+    except (ValueError, KeyError, TypeError) as exc:
+        print(f"Import failed: {exc}")
+        return 1
+    finally:
+        conn.close()
+    summary = ", ".join(f"{k}={v}" for k, v in result.items() if k != "session_ids")
+    print(f"Imported {summary}.")
+    return 0
+
+
+def _archive() -> int:
+    from .repository import Repository
+
+    config = load_config(Path.cwd())
+    init_db(config.db.path)
+    shards = open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    conn = connect(config.db.path)
+    try:
+        repo = Repository(conn, shards)
+        total = 0
+        while True:
+            batch = repo.archive_inactive_sessions(config.archive.inactive_days, config.archive.batch_size)
+            if not batch:
+                break
+            total += len(batch)
+    finally:
+        conn.close()
+    print(f"Archived {total} sessions inactive for {config.archive.inactive_days:g} days.")
+    return 0
+
+
+def _mib(value: int | None) -> str:
+    return "n/a" if value is None else f"{value / 2**20:.1f} MiB"
+
+
+def _storage_report() -> int:
+    from .repository import Repository
+
+    config = load_config(Path.cwd())
+    init_db(config.db.path)
+    shards = open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    conn = connect(config.db.path)
+    try:
+        report = Repository(conn, shards).storage_report()
+    finally:
+        conn.close()
+    print(
+        f"Hot:  sessions={report['hot_sessions']} nodes={report['hot_nodes']} edges={report['hot_edges']}"
+        f" pages={_mib(report['hot_page_bytes'])}"
+    )
+    print(
+        f"Cold: sessions={report['cold_sessions']} nodes={report['cold_nodes']} edges={report['cold_edges']}"
+        f" pages={_mib(report['cold_page_bytes'])} raw={_mib(report['cold_raw_bytes'])}"
+        f" compressed={_mib(report['cold_stored_bytes'])}"
+    )
+    return 0
+
+
+def serve(config: AppConfig) -> None:
+    import uvicorn
+
+    # Migrate once here instead of racing in every worker's lifespan.
+    init_db(config.db.path)
+    open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    os.environ[MIGRATED_ENV] = "1"
+    if config.server.workers > 1:
+        uvicorn.run(
+            "graphchat.main:create_app",
+            factory=True,
+            host=config.server.host,
+            port=config.server.port,
+            workers=config.server.workers,
+        )
+        return
+    from .main import create_app
+
+    uvicorn.run(create_app(config), host=config.server.host, port=config.server.port)
+
+
+def run(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="graphchat-server", description="GraphChat API server")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="validate config.json and the database, then exit without starting the server",
+    )
+    parser.add_argument("--export", metavar="FILE", help="write all sessions as NDJSON to FILE ('-' for stdout)")
+    parser.add_argument("--import", dest="import_file", metavar="FILE", help="import sessions from an NDJSON export")
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="move sessions inactive for archive.inactive_days into compressed cold storage, then exit",
+    )
+    parser.add_argument(
+        "--storage-report", action="store_true", help="print hot and cold (archived) storage sizes, then exit"
+    )
+    args = parser.parse_args(argv)
+    if args.check:
+        return _check()
+    if args.export:
+        return _export(args.export)
+    if args.import_file:
+        return _import(args.import_file)
+    if args.archive:
+        return _archive()
+    if args.storage_report:
+        return _storage_report()
+    serve(load_config(Path.cwd()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(run())
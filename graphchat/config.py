@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import json
 import shutil
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from importlib import resources
 from pathlib import Path
 from typing import Any
@@ -12,6 +12,8 @@ from typing import Any
 class ServerConfig:
     host: str
     port: int
+    workers: int = 1
+    compress_min_bytes: int = 1024
 
 
 @dataclass(frozen=True)
@@ -19,16 +21,150 @@ class CorsConfig:
     origins: list[str]
 
 
+@dataclass(frozen=True)
+class LlmEndpoint:
+    base_url: str
+    api_key: str
+    model: str
+
+
 @dataclass(frozen=True)
 class LlmConfig:
     base_url: str
     api_key: str
     model: str
+    max_concurrency: int = 4
+    # Extra endpoints used for routing and failover next to the primary one above.
+    endpoints: list[LlmEndpoint] = field(default_factory=list)
+    max_retries: int = 2
+    retry_backoff_seconds: float = 0.5
+    # Streaming only: start a second attempt on another endpoint if nothing has arrived by then;
+    # 0 disables hedging.
+    hedge_after_seconds: float = 0.0
+    cooldown_seconds: float = 30.0
+    # Streaming only: max wait for the first token, and for each later token; 0 disables.
+    first_token_timeout_seconds: float = 60.0
+    stall_timeout_seconds: float = 30.0
 
 
 @dataclass(frozen=True)
 class DbConfig:
     path: str
+    pool_size: int = 8
+    # Connections one worker may have in use at once; requests wait `acquire_timeout_seconds`
+    # for one beyond that and then fail with 503.
+    max_connections: int = 32
+    acquire_timeout_seconds: float = 30.0
+    # 0 keeps every session in `path`; N > 0 hashes sessions over N shard files in `shard_dir`
+    # (default `<path>.shards`), with `path` kept as the catalog. Fixed once sessions exist.
+    shards: int = 0
+    shard_dir: str = ""
+
+
+@dataclass(frozen=True)
+class MaterialsConfig:
+    max_upload_bytes: int = 5 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ContextConfig:
+    max_tokens: int = 6000
+    nodes_weight: float = 0.45
+    sections_weight: float = 0.25
+    materials_weight: float = 0.30
+    # Materials never take more than this or their weighted share of the budget, whichever is
+    # smaller, even when few nodes are selected; the default matches the former 4000-char cap.
+    max_material_tokens: int = 1000
+
+
+@dataclass(frozen=True)
+class SummaryConfig:
+    # Opt-in: each answer schedules extra background LLM calls to summarize its long nodes.
+    enabled: bool = False
+    min_chars: int = 600
+    max_chars: int = 240
+    max_inflight: int = 2
+    max_pending: int = 256
+
+
+@dataclass(frozen=True)
+class PrefetchConfig:
+    enabled: bool = False
+    suggestions: int = 3
+    pregenerate_answer: bool = False
+    max_inflight: int = 2
+    session_budget: int = 20
+    # The budget is per window; it starts with a session's first prefetch call.
+    budget_window_seconds: float = 3600.0
+    idle_seconds: float = 300.0
+
+
+@dataclass(frozen=True)
+class QuizConfig:
+    questions_per_node: int = 3
+    # Nodes per LLM call, and how many of those calls may run at once.
+    batch_size: int = 10
+    max_inflight: int = 4
+    min_chars: int = 40
+    max_node_chars: int = 1500
+
+
+@dataclass(frozen=True)
+class DedupeConfig:
+    # Estimated Jaccard similarity (character 3-grams) above which a new knowledge node is a copy:
+    # by title when its heading streams in, by title and content once its body is complete.
+    enabled: bool = True
+    title_threshold: float = 0.8
+    content_threshold: float = 0.6
+    # By default a copy is kept and only linked to the node it repeats. With `merge` a title match
+    # drops the section's body and a content match soft-deletes the new node, which loses text.
+    merge: bool = False
+
+
+@dataclass(frozen=True)
+class PositionsConfig:
+    # Buffer node moves/resizes in memory and write the latest per node every interval.
+    write_behind: bool = True
+    flush_interval_seconds: float = 0.5
+    # Flush early once this many nodes have unwritten moves.
+    max_pending: int = 10000
+
+
+@dataclass(frozen=True)
+class SearchConfig:
+    # bm25 ranks only the newest matches of a query (0 = all), so terms found in most nodes still
+    # answer quickly; every page of such a query then comes from those newest matches.
+    max_candidates: int = 10000
+
+
+@dataclass(frozen=True)
+class ArchiveConfig:
+    # Move sessions whose graph was not written for `inactive_days` into compressed cold storage,
+    # checking every `interval_seconds`; an archived session is restored on its first access.
+    enabled: bool = False
+    inactive_days: float = 90.0
+    interval_seconds: float = 3600.0
+    # Sessions archived per DB file and run.
+    batch_size: int = 100
+
+
+@dataclass(frozen=True)
+class ProfilingConfig:
+    # Profile a request with cProfile when it carries `header` (any value but "0") or, otherwise,
+    # with probability `sample_rate`. Profiles go to `dir` as .prof files; the oldest are pruned
+    # to keep at most `max_files` files and `max_bytes` bytes.
+    enabled: bool = False
+    header: str = "X-GraphChat-Profile"
+    sample_rate: float = 0.0
+    dir: str = "profiles"
+    max_files: int = 200
+    max_bytes: int = 100 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class GraphCacheConfig:
+    enabled: bool = True
+    max_bytes: int = 32 * 1024 * 1024
 
 
 @dataclass(frozen=True)
@@ -37,6 +173,17 @@ class AppConfig:
     cors: CorsConfig
     llm: LlmConfig
     db: DbConfig
+    materials: MaterialsConfig = field(default_factory=MaterialsConfig)
+    prefetch: PrefetchConfig = field(default_factory=PrefetchConfig)
+    context: ContextConfig = field(default_factory=ContextConfig)
+    summaries: SummaryConfig = field(default_factory=SummaryConfig)
+    graph_cache: GraphCacheConfig = field(default_factory=GraphCacheConfig)
+    quiz: QuizConfig = field(default_factory=QuizConfig)
+    positions: PositionsConfig = field(default_factory=PositionsConfig)
+    dedupe: DedupeConfig = field(default_factory=DedupeConfig)
+    search: SearchConfig = field(default_factory=SearchConfig)
+    archive: ArchiveConfig = field(default_factory=ArchiveConfig)
+    profiling: ProfilingConfig = field(default_factory=ProfilingConfig)
 
 
 def _load_json(path: Path) -> dict[str, Any]:
@@ -75,14 +222,30 @@ def load_config(cwd: Path | None = None) -> AppConfig:
             server=ServerConfig(
                 host=str(data["server"]["host"]),
                 port=int(data["server"]["port"]),
+                workers=int(data["server"].get("workers", 1)),
+                compress_min_bytes=int(data["server"].get("compress_min_bytes", 1024)),
             ),
             cors=CorsConfig(origins=[str(x) for x in data["cors"]["origins"]]),
-            llm=LlmConfig(
-                base_url=str(data["llm"]["base_url"]).rstrip("/"),
-                api_key=str(data["llm"]["api_key"]),
-                model=str(data["llm"]["model"]),
+            llm=_load_llm(data["llm"]),
+            db=DbConfig(
+                path=str(data["db"]["path"]),
+                pool_size=int(data["db"].get("pool_size", 8)),
+                max_connections=int(data["db"].get("max_connections", 32)),
+                acquire_timeout_seconds=float(data["db"].get("acquire_timeout_seconds", 30.0)),
+                shards=int(data["db"].get("shards", 0)),
+                shard_dir=str(data["db"].get("shard_dir", "")),
             ),
-            db=DbConfig(path=str(data["db"]["path"])),
+            materials=_load_materials(data.get("materials", {})),
+            prefetch=_load_prefetch(data.get("prefetch", {})),
+            context=_load_context(data.get("context", {})),
+            summaries=_load_summaries(data.get("summaries", {})),
+            graph_cache=_load_graph_cache(data.get("graph_cache", {})),
+            quiz=_load_quiz(data.get("quiz", {})),
+            positions=_load_positions(data.get("positions", {})),
+            dedupe=_load_dedupe(data.get("dedupe", {})),
+            search=_load_search(data.get("search", {})),
+            archive=_load_archive(data.get("archive", {})),
+            profiling=_load_profiling(data.get("profiling", {})),
         )
         _validate_config(cfg)
         return cfg
@@ -90,11 +253,200 @@ def load_config(cwd: Path | None = None) -> AppConfig:
         raise ValueError(f"Missing required config key: {exc}") from exc
 
 
+def _load_llm(data: dict[str, Any]) -> LlmConfig:
+    base_url = str(data["base_url"]).rstrip("/")
+    api_key = str(data["api_key"])
+    model = str(data["model"])
+    defaults = LlmConfig(base_url=base_url, api_key=api_key, model=model)
+    return LlmConfig(
+        base_url=base_url,
+        api_key=api_key,
+        model=model,
+        max_concurrency=int(data.get("max_concurrency", defaults.max_concurrency)),
+        # Extra endpoints inherit the primary key and model unless they set their own.
+        endpoints=[
+            LlmEndpoint(
+                base_url=str(item["base_url"]).rstrip("/"),
+                api_key=str(item.get("api_key", api_key)),
+                model=str(item.get("model", model)),
+            )
+            for item in data.get("endpoints", [])
+        ],
+        max_retries=int(data.get("max_retries", defaults.max_retries)),
+        retry_backoff_seconds=float(data.get("retry_backoff_seconds", defaults.retry_backoff_seconds)),
+        hedge_after_seconds=float(data.get("hedge_after_seconds", defaults.hedge_after_seconds)),
+        cooldown_seconds=float(data.get("cooldown_seconds", defaults.cooldown_seconds)),
+        first_token_timeout_seconds=float(
+            data.get("first_token_timeout_seconds", defaults.first_token_timeout_seconds)
+        ),
+        stall_timeout_seconds=float(data.get("stall_timeout_seconds", defaults.stall_timeout_seconds)),
+    )
+
+
+def _load_materials(data: dict[str, Any]) -> MaterialsConfig:
+    defaults = MaterialsConfig()
+    return MaterialsConfig(
+        max_upload_bytes=int(data.get("max_upload_bytes", defaults.max_upload_bytes)),
+    )
+
+
+def _load_prefetch(data: dict[str, Any]) -> PrefetchConfig:
+    defaults = PrefetchConfig()
+    return PrefetchConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        suggestions=int(data.get("suggestions", defaults.suggestions)),
+        pregenerate_answer=bool(data.get("pregenerate_answer", defaults.pregenerate_answer)),
+        max_inflight=int(data.get("max_inflight", defaults.max_inflight)),
+        session_budget=int(data.get("session_budget", defaults.session_budget)),
+        budget_window_seconds=float(data.get("budget_window_seconds", defaults.budget_window_seconds)),
+        idle_seconds=float(data.get("idle_seconds", defaults.idle_seconds)),
+    )
+
+
+def _load_context(data: dict[str, Any]) -> ContextConfig:
+    defaults = ContextConfig()
+    return ContextConfig(
+        max_tokens=int(data.get("max_tokens", defaults.max_tokens)),
+        nodes_weight=float(data.get("nodes_weight", defaults.nodes_weight)),
+        sections_weight=float(data.get("sections_weight", defaults.sections_weight)),
+        materials_weight=float(data.get("materials_weight", defaults.materials_weight)),
+        max_material_tokens=int(data.get("max_material_tokens", defaults.max_material_tokens)),
+    )
+
+
+def _load_summaries(data: dict[str, Any]) -> SummaryConfig:
+    defaults = SummaryConfig()
+    return SummaryConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        min_chars=int(data.get("min_chars", defaults.min_chars)),
+        max_chars=int(data.get("max_chars", defaults.max_chars)),
+        max_inflight=int(data.get("max_inflight", defaults.max_inflight)),
+        max_pending=int(data.get("max_pending", defaults.max_pending)),
+    )
+
+
+def _load_graph_cache(data: dict[str, Any]) -> GraphCacheConfig:
+    defaults = GraphCacheConfig()
+    return GraphCacheConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        max_bytes=int(data.get("max_bytes", defaults.max_bytes)),
+    )
+
+
+def _load_quiz(data: dict[str, Any]) -> QuizConfig:
+    defaults = QuizConfig()
+    return QuizConfig(
+        questions_per_node=int(data.get("questions_per_node", defaults.questions_per_node)),
+        batch_size=int(data.get("batch_size", defaults.batch_size)),
+        max_inflight=int(data.get("max_inflight", defaults.max_inflight)),
+        min_chars=int(data.get("min_chars", defaults.min_chars)),
+        max_node_chars=int(data.get("max_node_chars", defaults.max_node_chars)),
+    )
+
+
+def _load_positions(data: dict[str, Any]) -> PositionsConfig:
+    defaults = PositionsConfig()
+    return PositionsConfig(
+        write_behind=bool(data.get("write_behind", defaults.write_behind)),
+        flush_interval_seconds=float(data.get("flush_interval_seconds", defaults.flush_interval_seconds)),
+        max_pending=int(data.get("max_pending", defaults.max_pending)),
+    )
+
+
+def _load_dedupe(data: dict[str, Any]) -> DedupeConfig:
+    defaults = DedupeConfig()
+    return DedupeConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        title_threshold=float(data.get("title_threshold", defaults.title_threshold)),
+        content_threshold=float(data.get("content_threshold", defaults.content_threshold)),
+        merge=bool(data.get("merge", defaults.merge)),
+    )
+
+
+def _load_search(data: dict[str, Any]) -> SearchConfig:
+    defaults = SearchConfig()
+    return SearchConfig(max_candidates=int(data.get("max_candidates", defaults.max_candidates)))
+
+
+def _load_archive(data: dict[str, Any]) -> ArchiveConfig:
+    defaults = ArchiveConfig()
+    return ArchiveConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        inactive_days=float(data.get("inactive_days", defaults.inactive_days)),
+        interval_seconds=float(data.get("interval_seconds", defaults.interval_seconds)),
+        batch_size=int(data.get("batch_size", defaults.batch_size)),
+    )
+
+
+def _load_profiling(data: dict[str, Any]) -> ProfilingConfig:
+    defaults = ProfilingConfig()
+    return ProfilingConfig(
+        enabled=bool(data.get("enabled", defaults.enabled)),
+        header=str(data.get("header", defaults.header)),
+        sample_rate=float(data.get("sample_rate", defaults.sample_rate)),
+        dir=str(data.get("dir", defaults.dir)),
+        max_files=int(data.get("max_files", defaults.max_files)),
+        max_bytes=int(data.get("max_bytes", defaults.max_bytes)),
+    )
+
+
 def _validate_config(cfg: AppConfig) -> None:
+    if cfg.server.workers < 1:
+        raise ValueError("Invalid config: server.workers must be >= 1.")
+    if cfg.db.pool_size < 1:
+        raise ValueError("Invalid config: db.pool_size must be >= 1.")
+    if cfg.db.max_connections < cfg.db.pool_size or cfg.db.acquire_timeout_seconds <= 0:
+        raise ValueError("Invalid config: db.max_connections must be >= pool_size and acquire_timeout_seconds > 0.")
+    if not 0 <= cfg.db.shards <= 1024:
+        raise ValueError("Invalid config: db.shards must be between 0 and 1024.")
+    if cfg.materials.max_upload_bytes < 1:
+        raise ValueError("Invalid config: materials.max_upload_bytes must be >= 1.")
     if not cfg.llm.base_url.strip():
         raise ValueError("Invalid config: llm.base_url is required.")
     if not cfg.llm.model.strip():
         raise ValueError("Invalid config: llm.model is required.")
+    if cfg.llm.max_concurrency < 1:
+        raise ValueError("Invalid config: llm.max_concurrency must be >= 1.")
+    if any(not ep.base_url.strip() or not ep.model.strip() for ep in cfg.llm.endpoints):
+        raise ValueError("Invalid config: every llm.endpoints entry needs a base_url and model.")
+    if cfg.llm.max_retries < 0:
+        raise ValueError("Invalid config: llm.max_retries must be >= 0.")
+    if min(cfg.llm.retry_backoff_seconds, cfg.llm.hedge_after_seconds, cfg.llm.cooldown_seconds) < 0:
+        raise ValueError("Invalid config: llm backoff, hedge and cooldown seconds must be >= 0.")
+    if min(cfg.llm.first_token_timeout_seconds, cfg.llm.stall_timeout_seconds) < 0:
+        raise ValueError("Invalid config: llm first-token and stall timeouts must be >= 0.")
+    if cfg.prefetch.suggestions < 1 or cfg.prefetch.max_inflight < 1:
+        raise ValueError("Invalid config: prefetch.suggestions and prefetch.max_inflight must be >= 1.")
+    if cfg.prefetch.budget_window_seconds <= 0:
+        raise ValueError("Invalid config: prefetch.budget_window_seconds must be > 0.")
+    if cfg.context.max_tokens < 1:
+        raise ValueError("Invalid config: context.max_tokens must be >= 1.")
+    if cfg.context.max_material_tokens < 0:
+        raise ValueError("Invalid config: context.max_material_tokens must be >= 0.")
+    if min(cfg.context.nodes_weight, cfg.context.sections_weight, cfg.context.materials_weight) < 0:
+        raise ValueError("Invalid config: context weights must be >= 0.")
+    if cfg.summaries.max_inflight < 1 or cfg.summaries.max_chars < 1:
+        raise ValueError("Invalid config: summaries.max_inflight and summaries.max_chars must be >= 1.")
+    if cfg.graph_cache.max_bytes < 0:
+        raise ValueError("Invalid config: graph_cache.max_bytes must be >= 0.")
+    if min(cfg.quiz.questions_per_node, cfg.quiz.batch_size, cfg.quiz.max_inflight, cfg.quiz.max_node_chars) < 1:
+        raise ValueError(
+            "Invalid config: quiz.questions_per_node, batch_size, max_inflight and max_node_chars must be >= 1."
+        )
+    if cfg.positions.flush_interval_seconds <= 0 or cfg.positions.max_pending < 1:
+        raise ValueError("Invalid config: positions.flush_interval_seconds must be > 0 and max_pending >= 1.")
+    if not (0 < cfg.dedupe.title_threshold <= 1 and 0 < cfg.dedupe.content_threshold <= 1):
+        raise ValueError("Invalid config: dedupe thresholds must be in (0, 1].")
+    if cfg.search.max_candidates < 0:
+        raise ValueError("Invalid config: search.max_candidates must be >= 0.")
+    if cfg.archive.inactive_days <= 0 or cfg.archive.interval_seconds <= 0 or cfg.archive.batch_size < 1:
+        raise ValueError(
+            "Invalid config: archive.inactive_days and interval_seconds must be > 0 and batch_size >= 1."
+        )
+    if not 0 <= cfg.profiling.sample_rate <= 1:
+        raise ValueError("Invalid config: profiling.sample_rate must be between 0 and 1.")
+    if cfg.profiling.max_files < 1 or cfg.profiling.max_bytes < 1:
+        raise ValueError("Invalid config: profiling.max_files and max_bytes must be >= 1.")
     key = cfg.llm.api_key.strip()
     if not key or key == "replace_me":
         raise ValueError(
@@ -1,14 +1,30 @@
 from __future__ import annotations
 
+import hashlib
+import queue
 import sqlite3
+import threading
 from pathlib import Path
 
 
-SCHEMA_SQL = """
+# Bump whenever SCHEMA_SQL or the forward migrations in `init_db` change.
+SCHEMA_VERSION = 13
+
+# Set once the serving parent process has migrated the DB, so workers skip it.
+MIGRATED_ENV = "GRAPHCHAT_DB_MIGRATED"
+
+# How long a write waits for another connection's write lock before "database is locked".
+BUSY_TIMEOUT_MS = 15000
+
+# Tables holding one session's rows. With `db.shards` set these live in the session's shard file.
+SESSION_SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS sessions (
   id TEXT PRIMARY KEY,
   topic TEXT NOT NULL,
-  created_at TEXT NOT NULL
+  revision INTEGER NOT NULL DEFAULT 0,
+  created_at TEXT NOT NULL,
+  -- Last write to the session's graph (or restore); see `archive`.
+  active_at TEXT
 );
 
 CREATE TABLE IF NOT EXISTS nodes (
@@ -24,6 +40,8 @@ CREATE TABLE IF NOT EXISTS nodes (
   created_at TEXT NOT NULL
 );
 
+CREATE INDEX IF NOT EXISTS idx_nodes_session ON nodes(session_id);
+
 CREATE TABLE IF NOT EXISTS edges (
   id TEXT PRIMARY KEY,
   session_id TEXT NOT NULL,
@@ -34,29 +52,429 @@ CREATE TABLE IF NOT EXISTS edges (
   created_at TEXT NOT NULL
 );
 
+-- Both directions, so graph walks (ancestors, descendants, components) stay index lookups.
+CREATE INDEX IF NOT EXISTS idx_edges_session_source ON edges(session_id, source_node_id);
+CREATE INDEX IF NOT EXISTS idx_edges_session_target ON edges(session_id, target_node_id);
+
 CREATE TABLE IF NOT EXISTS materials (
   id TEXT PRIMARY KEY,
   session_id TEXT NOT NULL,
   filename TEXT NOT NULL,
   mime_type TEXT NOT NULL,
   content_text TEXT NOT NULL,
+  content_hash TEXT,
+  created_at TEXT NOT NULL
+);
+
+-- Spaced-repetition state; times are unix seconds so the due queue is a plain index range scan.
+CREATE TABLE IF NOT EXISTS review_states (
+  node_id TEXT PRIMARY KEY,
+  session_id TEXT NOT NULL,
+  due_at REAL NOT NULL,
+  interval_days REAL NOT NULL DEFAULT 0,
+  ease REAL NOT NULL DEFAULT 2.5,
+  repetitions INTEGER NOT NULL DEFAULT 0,
+  lapses INTEGER NOT NULL DEFAULT 0,
+  last_reviewed_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_review_states_due ON review_states(due_at);
+CREATE INDEX IF NOT EXISTS idx_review_states_session_due ON review_states(session_id, due_at);
+
+CREATE TABLE IF NOT EXISTS prefetch_suggestions (
+  id TEXT PRIMARY KEY,
+  session_id TEXT NOT NULL,
+  source_node_id TEXT NOT NULL,
+  question TEXT NOT NULL,
+  rank INTEGER NOT NULL,
+  answer_text TEXT,
+  -- `node_content_hash` of the source node the answer was generated from.
+  source_content_hash TEXT,
+  created_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_prefetch_suggestions_session ON prefetch_suggestions(session_id, rank);
+
+CREATE TABLE IF NOT EXISTS node_summaries (
+  node_id TEXT PRIMARY KEY,
+  content_hash TEXT NOT NULL,
+  summary TEXT NOT NULL,
   created_at TEXT NOT NULL
 );
 
+-- Cold tier: the graph rows of an inactive session, serialized and compressed; see `archive`.
+CREATE TABLE IF NOT EXISTS session_archives (
+  session_id TEXT PRIMARY KEY,
+  codec TEXT NOT NULL,
+  payload BLOB NOT NULL,
+  raw_bytes INTEGER NOT NULL,
+  node_count INTEGER NOT NULL,
+  edge_count INTEGER NOT NULL,
+  archived_at TEXT NOT NULL
+);
+
 """
 
+# Tables shared by all sessions; these always stay in the main (catalog) DB.
+SHARED_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS material_blobs (
+  content_hash TEXT PRIMARY KEY,
+  size_bytes INTEGER NOT NULL,
+  ref_count INTEGER NOT NULL,
+  created_at TEXT NOT NULL
+);
 
-def connect(db_path: str) -> sqlite3.Connection:
+CREATE TABLE IF NOT EXISTS material_blob_chunks (
+  content_hash TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  content_text TEXT NOT NULL,
+  PRIMARY KEY (content_hash, seq)
+);
+
+-- Keyed by node content hash: unchanged nodes, and identical nodes anywhere, share their quiz.
+CREATE TABLE IF NOT EXISTS quiz_items (
+  content_hash TEXT NOT NULL,
+  seq INTEGER NOT NULL,
+  question TEXT NOT NULL,
+  answer TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  PRIMARY KEY (content_hash, seq)
+);
+
+-- Storage layout the DB was created with; see `ShardRouter`.
+CREATE TABLE IF NOT EXISTS storage_meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+
+SCHEMA_SQL = SESSION_SCHEMA_SQL + SHARED_SCHEMA_SQL
+
+# Full-text index of live nodes. External content: the text stays in `nodes` only and the index
+# rowid is the node's rowid. Trigram tokens match substrings, and need no word boundaries, so
+# Chinese text is searchable too. Kept separate because SQLite builds without FTS5 cannot create it.
+SEARCH_SCHEMA_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(
+  title, content, content='nodes', content_rowid='rowid', tokenize='trigram'
+);
+
+-- An external-content index must be told the old text to remove, and only rows it holds:
+-- soft-deleted nodes are never indexed, so deleting and restoring both go through these.
+CREATE TRIGGER IF NOT EXISTS nodes_fts_insert AFTER INSERT ON nodes WHEN new.deleted_at IS NULL BEGIN
+  INSERT INTO nodes_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS nodes_fts_delete AFTER DELETE ON nodes WHEN old.deleted_at IS NULL BEGIN
+  INSERT INTO nodes_fts(nodes_fts, rowid, title, content) VALUES ('delete', old.rowid, old.title, old.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS nodes_fts_update AFTER UPDATE OF title, content, deleted_at ON nodes BEGIN
+  INSERT INTO nodes_fts(nodes_fts, rowid, title, content)
+  SELECT 'delete', old.rowid, old.title, old.content WHERE old.deleted_at IS NULL;
+  INSERT INTO nodes_fts(rowid, title, content)
+  SELECT new.rowid, new.title, new.content WHERE new.deleted_at IS NULL;
+END;
+"""
+
+
+def connect(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
     path = Path(db_path)
     path.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(path)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # Workers, request threads and background writers share each file; in WAL mode readers never
+    # block the writer and vice versa. The mode is stored in the file, so this is a no-op after
+    # the first connection.
+    conn.execute("PRAGMA journal_mode = WAL")
     return conn
 
 
+class PoolTimeoutError(RuntimeError):
+    """Every connection the pool may open is in use and none came back in time."""
+
+
+class ConnectionPool:
+    """Small LIFO pool of SQLite connections shared by the request threads of one worker.
+
+    Up to `size` idle connections are kept; at most `max_connections` are handed out at once,
+    and `acquire` waits up to `acquire_timeout` seconds for one to come back beyond that.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 8,
+        shards: ShardRouter | None = None,
+        max_connections: int = 32,
+        acquire_timeout: float = 30.0,
+    ) -> None:
+        self.db_path = db_path
+        # Handed to every `Repository` built on this pool's connections.
+        self.shards = shards
+        self.acquire_timeout = acquire_timeout
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(max(size, max_connections))
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PoolTimeoutError(f"No database connection free after {self.acquire_timeout:g}s.")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            # Streaming responses resume their generator on arbitrary threadpool threads.
+            return connect(self.db_path, check_same_thread=False)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+                return
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ShardRouter:
+    """Places each session's rows in one of `count` SQLite files, by a stable hash of its id.
+
+    The main DB stays the catalog: the session list and the tables shared by all sessions. Every
+    shard connection attaches it as `catalog`, so queries that join session rows with shared
+    tables (material bodies) work unchanged, while writes to different shards take different
+    write locks. `connection` keeps one connection per thread and shard, opened on first use;
+    anything that holds a cursor across a yield (exports) must `open` its own instead.
+    """
+
+    def __init__(self, catalog_path: str, count: int, shard_dir: str = "") -> None:
+        self.catalog_path = catalog_path
+        self.count = count
+        self.shard_dir = Path(shard_dir or f"{catalog_path}.shards")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened: list[sqlite3.Connection] = []
+
+    def path(self, index: int) -> Path:
+        return self.shard_dir / f"shard-{index:03d}.db"
+
+    def index(self, session_id: str) -> int:
+        return int(hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8], 16) % self.count
+
+    def connection(self, session_id: str) -> sqlite3.Connection:
+        return self.shard_connection(self.index(session_id))
+
+    def shard_connection(self, index: int) -> sqlite3.Connection:
+        conns: dict[int, sqlite3.Connection] | None = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(index)
+        if conn is None:
+            conn = conns[index] = self.open(index)
+            with self._lock:
+                self._opened.append(conn)
+        return conn
+
+    def open(self, index: int) -> sqlite3.Connection:
+        """A new connection to one shard, owned (and closed) by the caller."""
+        # Streaming responses resume their generator on arbitrary threadpool threads.
+        conn = connect(str(self.path(index)), check_same_thread=False)
+        conn.execute("ATTACH DATABASE ? AS catalog", (self.catalog_path,))
+        return conn
+
+    def init_shards(self) -> None:
+        for index in range(self.count):
+            conn = connect(str(self.path(index)))
+            try:
+                if schema_version(conn) != SCHEMA_VERSION:
+                    conn.executescript(SESSION_SCHEMA_SQL)
+                    _migrate_session_activity(conn)
+                    _migrate_prefetch_source_hash(conn)
+                    init_search(conn)
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    conn.commit()
+            finally:
+                conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for conn in opened:
+            conn.close()
+
+
+def open_shards(db_path: str, count: int, shard_dir: str = "") -> ShardRouter | None:
+    """Check `count` against the layout recorded in the DB; returns None for an unsharded DB.
+
+    The shard count cannot change in place (sessions would hash to other files), so a mismatch
+    fails startup instead; export and import into a fresh DB to change it.
+    """
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM storage_meta WHERE key = 'shards'").fetchone()
+        recorded = int(row[0]) if row is not None else None
+        if recorded is None and count:
+            if conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is not None:
+                recorded = 0
+            else:
+                conn.execute("INSERT INTO storage_meta(key, value) VALUES ('shards', ?)", (str(count),))
+                conn.commit()
+                recorded = count
+    finally:
+        conn.close()
+    if recorded is not None and recorded != count:
+        raise RuntimeError(
+            f"{db_path} holds sessions stored with db.shards={recorded}, not {count}; "
+            "export them and import into a fresh DB to change the layout"
+        )
+    if not count:
+        return None
+    router = ShardRouter(db_path, count, shard_dir)
+    router.init_shards()
+    return router
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def check_db(db_path: str) -> list[str]:
+    """Return problems found in an existing DB without creating or migrating it."""
+    path = Path(db_path)
+    if not path.exists():
+        return []
+    problems: list[str] = []
+    try:
+        conn = sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)
+    except sqlite3.Error as exc:
+        return [f"cannot open {path}: {exc}"]
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            problems.append(f"integrity check failed: {result}")
+        version = schema_version(conn)
+        if version > SCHEMA_VERSION:
+            problems.append(f"schema version {version} is newer than supported version {SCHEMA_VERSION}")
+    except sqlite3.DatabaseError as exc:
+        problems.append(f"{path} is not a usable SQLite database: {exc}")
+    finally:
+        conn.close()
+    return problems
+
+
+def has_search(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'nodes_fts'").fetchone()
+    return row is not None
+
+
+def rebuild_search(conn: sqlite3.Connection) -> None:
+    """Re-index every live node, e.g. after rowids changed; the caller commits."""
+    conn.execute("INSERT INTO nodes_fts(nodes_fts) VALUES ('delete-all')")
+    conn.execute(
+        "INSERT INTO nodes_fts(rowid, title, content) SELECT rowid, title, content FROM nodes WHERE deleted_at IS NULL"
+    )
+
+
+def init_search(conn: sqlite3.Connection) -> None:
+    """Create the search index and its triggers, indexing existing nodes on first creation.
+
+    Leaves the DB without search (the endpoint then answers 503) when SQLite lacks FTS5.
+    """
+    if has_search(conn):
+        return
+    try:
+        conn.executescript(SEARCH_SCHEMA_SQL)
+    except sqlite3.OperationalError as exc:
+        print(f"[DEBUG] full-text search disabled, no FTS5 trigram tokenizer: error={exc}")
+        return
+    rebuild_search(conn)
+
+
+def _migrate_session_activity(conn: sqlite3.Connection) -> None:
+    try:
+        conn.execute("ALTER TABLE sessions ADD COLUMN active_at TEXT")
+    except sqlite3.OperationalError:
+        return
+    # Sessions written before activity was tracked count as active when their last node was added.
+    conn.execute(
+        """
+        UPDATE sessions SET active_at = COALESCE(
+          (SELECT MAX(created_at) FROM nodes WHERE nodes.session_id = sessions.id), created_at
+        )
+        """
+    )
+
+
+def _migrate_prefetch_source_hash(conn: sqlite3.Connection) -> None:
+    try:
+        conn.execute("ALTER TABLE prefetch_suggestions ADD COLUMN source_content_hash TEXT")
+    except sqlite3.OperationalError:
+        return
+    # Older answers cannot be checked against their source node, so they are never served.
+    conn.execute("UPDATE prefetch_suggestions SET answer_text = NULL")
+
+
+def _migrate_material_bodies(conn: sqlite3.Connection) -> None:
+    """Move inline (v1) and per-material chunked (v2) bodies into content-addressed blobs."""
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    has_chunks = "material_chunks" in tables
+    rows = conn.execute("SELECT id, content_text, created_at FROM materials WHERE content_hash IS NULL").fetchall()
+    for row in rows:
+        texts: list[str] = []
+        if has_chunks:
+            texts = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT content_text FROM material_chunks WHERE material_id = ? ORDER BY seq ASC", (row[0],)
+                )
+            ]
+        if not texts and row[1]:
+            texts = [row[1]]
+        digest = hashlib.sha256()
+        size = 0
+        for text in texts:
+            data = text.encode("utf-8")
+            digest.update(data)
+            size += len(data)
+        content_hash = digest.hexdigest()
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO material_blobs(content_hash, size_bytes, ref_count, created_at) VALUES (?, ?, 1, ?)",
+            (content_hash, size, row[2]),
+        )
+        if cur.rowcount:
+            conn.executemany(
+                "INSERT INTO material_blob_chunks(content_hash, seq, content_text) VALUES (?, ?, ?)",
+                [(content_hash, seq, text) for seq, text in enumerate(texts)],
+            )
+        else:
+            conn.execute("UPDATE material_blobs SET ref_count = ref_count + 1 WHERE content_hash = ?", (content_hash,))
+        conn.execute("UPDATE materials SET content_hash = ?, content_text = '' WHERE id = ?", (content_hash, row[0]))
+    if has_chunks:
+        conn.execute("DROP TABLE material_chunks")
+
+
 def init_db(db_path: str) -> None:
     conn = connect(db_path)
     try:
+        if schema_version(conn) == SCHEMA_VERSION:
+            return
         conn.executescript(SCHEMA_SQL)
         # Lightweight forward migrations for existing DBs.
         try:
@@ -72,6 +490,19 @@ def init_db(db_path: str) -> None:
         except sqlite3.OperationalError:
             pass
         conn.execute("UPDATE nodes SET width = 400 WHERE width IS NULL OR width <= 0")
+        try:
+            conn.execute("ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        try:
+            conn.execute("ALTER TABLE materials ADD COLUMN content_hash TEXT")
+        except sqlite3.OperationalError:
+            pass
+        _migrate_material_bodies(conn)
+        _migrate_session_activity(conn)
+        _migrate_prefetch_source_hash(conn)
+        init_search(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
     finally:
         conn.close()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+from .metrics import metrics
+from .models import Edge, Node
+
+# Rough per-row overhead of a cached pydantic model on top of its text fields.
+_ROW_OVERHEAD_BYTES = 400
+# How many recently written sessions to remember for rejecting loads that raced a write.
+_RECENT_WRITES = 4096
+
+
+def _node_bytes(node: Node) -> int:
+    return _ROW_OVERHEAD_BYTES + len(node.title) + len(node.content)
+
+
+class CachedGraph:
+    def __init__(self, revision: int, nodes: list[Node], edges: list[Edge]) -> None:
+        self.revision = revision
+        self.nodes: dict[str, Node] = {n.id: n for n in nodes}
+        self.edges = edges
+        self.size = sum(_node_bytes(n) for n in nodes) + _ROW_OVERHEAD_BYTES * len(edges)
+
+    # The mutators below mirror `Repository` writes and keep `size` current.
+
+    def add_node(self, node: Node) -> None:
+        self.nodes[node.id] = node
+        self.size += _node_bytes(node)
+
+    def add_edge(self, edge: Edge) -> None:
+        # Same rule as `list_edges`: only edges between live nodes of this graph are visible.
+        if edge.source_node_id in self.nodes and edge.target_node_id in self.nodes:
+            self.edges.append(edge)
+            self.size += _ROW_OVERHEAD_BYTES
+
+    def update_node(self, node_id: str, **fields: object) -> None:
+        old = self.nodes.get(node_id)
+        if old is None:
+            return
+        new = old.model_copy(update=fields)
+        self.nodes[node_id] = new
+        self.size += _node_bytes(new) - _node_bytes(old)
+
+    def remove_node(self, node_id: str) -> None:
+        old = self.nodes.pop(node_id, None)
+        if old is None:
+            return
+        kept = [e for e in self.edges if node_id not in (e.source_node_id, e.target_node_id)]
+        self.size -= _node_bytes(old) + _ROW_OVERHEAD_BYTES * (len(self.edges) - len(kept))
+        self.edges = kept
+
+    def remove_edge(self, edge_id: str) -> None:
+        kept = [e for e in self.edges if e.id != edge_id]
+        self.size -= _ROW_OVERHEAD_BYTES * (len(self.edges) - len(kept))
+        self.edges = kept
+
+
+class GraphCache:
+    """In-process LRU of live session graphs, bounded by an estimate of their size in bytes.
+
+    `Repository` fills it on reads and patches it after each committed write, using the session
+    revision to detect writes it did not see: any gap drops the entry instead of patching it.
+    With `verify` set (several workers share the DB) every read still checks the revision.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, enabled: bool = True, verify: bool = False) -> None:
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CachedGraph] = OrderedDict()
+        self._recent: OrderedDict[str, int] = OrderedDict()
+        self._bytes = 0
+
+    def configure(self, max_bytes: int, enabled: bool, verify: bool) -> None:
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.enabled = enabled
+            self.verify = verify
+            self._entries.clear()
+            self._recent.clear()
+            self._bytes = 0
+
+    def get(self, session_id: str) -> CachedGraph | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+        metrics.incr("graph_cache.hits" if entry is not None else "graph_cache.misses")
+        return entry
+
+    def peek_revision(self, session_id: str) -> int | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry.revision if entry is not None else None
+
+    def put(self, session_id: str, entry: CachedGraph) -> None:
+        with self._lock:
+            if self._recent.get(session_id, -1) > entry.revision:
+                # A write committed while this snapshot was being read; it is already stale.
+                return
+            self._drop(session_id)
+            if entry.size > self.max_bytes:
+                return
+            self._entries[session_id] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                metrics.incr("graph_cache.evictions")
+
+    def apply(self, session_id: str, revision: int, change: Callable[[CachedGraph], None]) -> None:
+        """Patch a cached graph with a write that produced `revision`, or drop it if one was missed."""
+        with self._lock:
+            self._recent[session_id] = revision
+            self._recent.move_to_end(session_id)
+            if len(self._recent) > _RECENT_WRITES:
+                self._recent.popitem(last=False)
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            if entry.revision != revision - 1:
+                self._drop(session_id)
+                metrics.incr("graph_cache.invalidations")
+                return
+            before = entry.size
+            change(entry)
+            entry.revision = revision
+            self._bytes += entry.size - before
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                metrics.incr("graph_cache.evictions")
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+graph_cache = GraphCache()
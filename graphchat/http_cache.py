@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import gzip
+import json
+from typing import Any
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:  # Optional: `pip install graphchat[brotli]`.
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison (RFC 9110 13.1.2): compressed and identity bodies share one ETag.
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"})
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted: set[str] = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in {"q=0", "q=0.0", "q=0.00", "q=0.000"}:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def pick_encoding(accept_encoding: str) -> str | None:
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def json_response(request: Request, payload: Any, etag: str | None, min_compress_bytes: int) -> Response:
+    """Serialize `payload` once, tag it with `etag` and compress it when large enough."""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag:
+        headers["ETag"] = etag
+    encoding = pick_encoding(request.headers.get("accept-encoding", "")) if len(body) >= min_compress_bytes else None
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
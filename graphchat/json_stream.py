@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Collection
+from typing import Any
+
+_WHITESPACE = " \t\r\n"
+
+
+class JsonObjectStream:
+    """Incremental parser for one JSON object whose text arrives in arbitrary chunks.
+
+    `feed` returns `(key, value)` for each top-level member as soon as its value is complete.
+    Members named in `split_arrays` whose value is an array are reported element by element
+    instead, each as soon as it closes, so callers can act on the first entries of a long list
+    while the model is still writing the rest. Text around the object (e.g. Markdown fences)
+    is ignored. Only the scanning is incremental; each finished value goes through `json.loads`.
+    """
+
+    def __init__(self, split_arrays: Collection[str] = ()) -> None:
+        self.split_arrays = frozenset(split_arrays)
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._done = False
+        # Top-level member being read: its key (None while reading the key) and value start.
+        self._want_key = False
+        self._key_start = -1
+        self._key: str | None = None
+        self._value_start = -1
+        self._splitting = False
+        self._item_start = -1
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        self._buf += chunk
+        out: list[tuple[str, Any]] = []
+        buf = self._buf
+        i = self._pos
+        while i < len(buf) and not self._done:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._want_key:
+                        self._key = json.loads(buf[self._key_start : i + 1])
+                        self._want_key = False
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._want_key:
+                    self._key_start = i
+            elif ch in "{[":
+                if self._depth == 0:
+                    if ch == "{":
+                        self._depth = 1
+                        self._want_key = True
+                elif self._depth == 1 and ch == "[" and self._key in self.split_arrays and self._is_value_start(i):
+                    self._splitting = True
+                    self._depth = 2
+                    self._item_start = i + 1
+                else:
+                    self._depth += 1
+            elif ch in "}]":
+                if self._depth == 2 and self._splitting:
+                    self._end_item(i, out)
+                    self._splitting = False
+                    # The array was reported item by item; the member itself is not reported again.
+                    self._value_start = -1
+                elif self._depth == 1:
+                    self._end_value(i, out)
+                    self._done = True
+                self._depth -= 1
+            elif ch == ",":
+                if self._depth == 2 and self._splitting:
+                    self._end_item(i, out)
+                    self._item_start = i + 1
+                elif self._depth == 1:
+                    self._end_value(i, out)
+                    self._want_key = True
+            elif ch == ":" and self._depth == 1 and self._key is not None and self._value_start < 0:
+                self._value_start = i + 1
+            i += 1
+        self._pos = i
+        return out
+
+    def close(self) -> None:
+        """Raise ValueError unless a complete object was read."""
+        if not self._done:
+            raise ValueError("JSON object ended before it was complete.")
+
+    def _is_value_start(self, i: int) -> bool:
+        return self._value_start >= 0 and not self._buf[self._value_start : i].strip(_WHITESPACE)
+
+    def _end_item(self, end: int, out: list[tuple[str, Any]]) -> None:
+        text = self._buf[self._item_start : end].strip(_WHITESPACE)
+        if text and self._key is not None:
+            out.append((self._key, json.loads(text)))
+
+    def _end_value(self, end: int, out: list[tuple[str, Any]]) -> None:
+        if self._key is not None and self._value_start >= 0:
+            out.append((self._key, json.loads(self._buf[self._value_start : end])))
+        self._key = None
+        self._value_start = -1
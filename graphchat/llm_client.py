@@ -1,74 +1,393 @@
 from __future__ import annotations
 
 import json
-from collections.abc import Generator
+import queue
+import random
+import socket
+import threading
+import time
+from collections.abc import Callable, Generator
+from typing import Any
 
 import httpx
 
-from .config import LlmConfig
+from .config import LlmConfig, LlmEndpoint
+from .metrics import metrics
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+MAX_RETRY_AFTER_SECONDS = 10.0
 
 
 class LlmError(RuntimeError):
-    pass
+    code = "LLM_UNAVAILABLE"
+
+
+class LlmTimeoutError(LlmError):
+    """The upstream sent nothing in time: `phase` is "first_token" or "stall"."""
+
+    def __init__(self, message: str, phase: str) -> None:
+        super().__init__(message)
+        self.phase = phase
+        self.code = "LLM_STALLED" if phase == "stall" else "LLM_FIRST_TOKEN_TIMEOUT"
+
+
+class _RetryableError(LlmError):
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _is_retryable(error: LlmError) -> bool:
+    # A stream that never started may be retried elsewhere; one that stalled mid-answer may not.
+    if isinstance(error, LlmTimeoutError):
+        return error.phase == "first_token"
+    return isinstance(error, _RetryableError)
+
+
+def _classify(exc: Exception) -> LlmError:
+    if isinstance(exc, LlmError):
+        return exc
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if status in RETRYABLE_STATUS:
+            retry_after: float | None = None
+            try:
+                retry_after = float(exc.response.headers.get("retry-after", ""))
+            except ValueError:
+                pass
+            return _RetryableError(str(exc), retry_after)
+        return LlmError(str(exc))
+    if isinstance(exc, httpx.TransportError):
+        return _RetryableError(str(exc) or type(exc).__name__)
+    return LlmError(str(exc))
+
+
+class _EndpointState:
+    """Health of one upstream: smoothed latency per call kind and a cooldown after failures."""
+
+    def __init__(self, endpoint: LlmEndpoint) -> None:
+        self.endpoint = endpoint
+        self.latency: dict[str, float] = {}
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class _Attempt:
+    def __init__(self, state: _EndpointState, hedge: bool) -> None:
+        self.state = state
+        self.hedge = hedge
+        self.cancel = threading.Event()
+        self.started = time.monotonic()
+        self.response: httpx.Response | None = None
+
+    def close(self) -> None:
+        # Shutting the socket down wakes the worker's blocked read so it drops the connection now;
+        # a plain close() from another thread would leave the read waiting on the upstream.
+        self.cancel.set()
+        response = self.response
+        stream = response.extensions.get("network_stream") if response is not None else None
+        if stream is None:
+            return
+        sock = stream.get_extra_info("socket")
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
 
 class LlmClient:
+    """OpenAI-compatible client that routes across endpoints, retries, hedges and fails over.
+
+    Retries and hedges only happen before the first result reaches the caller: once a stream has
+    produced a token it is committed to that endpoint, and a later failure surfaces as `LlmError`.
+    """
+
     def __init__(self, cfg: LlmConfig) -> None:
         self.cfg = cfg
+        # Shared across requests so upstream connections are kept alive between calls.
+        self._client = httpx.Client(timeout=httpx.Timeout(180.0, connect=20.0))
+        primary = LlmEndpoint(base_url=cfg.base_url, api_key=cfg.api_key, model=cfg.model)
+        self._endpoints = [_EndpointState(ep) for ep in (primary, *cfg.endpoints)]
+        self._lock = threading.Lock()
 
-    def json_completion(self, system_prompt: str, user_prompt: str) -> dict:
-        url = f"{self.cfg.base_url}/chat/completions"
-        payload = {
-            "model": self.cfg.model,
-            "temperature": 0.3,
-            "response_format": {"type": "json_object"},
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        }
-        headers = {"Authorization": f"Bearer {self.cfg.api_key}"}
+    def close(self) -> None:
+        self._client.close()
+
+    def endpoint_health(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "base_url": st.endpoint.base_url,
+                    "model": st.endpoint.model,
+                    "healthy": st.down_until <= now,
+                    "failures": st.failures,
+                    "latency": dict(st.latency),
+                }
+                for st in self._endpoints
+            ]
+
+    def _ranked(self, kind: str) -> list[_EndpointState]:
+        # Healthy endpoints fastest first (unmeasured ones count as fast so they get probed),
+        # then cooling-down endpoints as a last resort, soonest to recover first.
+        now = time.monotonic()
+        with self._lock:
+            healthy = [st for st in self._endpoints if st.down_until <= now]
+            down = [st for st in self._endpoints if st.down_until > now]
+            healthy.sort(key=lambda st: st.latency.get(kind, 0.0))
+            down.sort(key=lambda st: st.down_until)
+        return healthy + down
+
+    def _record_latency(self, state: _EndpointState, kind: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            previous = state.latency.get(kind)
+            state.latency[kind] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+            if ok:
+                state.failures = 0
+                state.down_until = 0.0
+
+    def _record_failure(self, state: _EndpointState) -> None:
+        with self._lock:
+            state.failures += 1
+            state.down_until = time.monotonic() + self.cfg.cooldown_seconds
+        metrics.incr("llm.endpoint_failures")
+
+    def _stream_read_timeout(self) -> float:
+        # Backstop for the worker thread only; the caller is released by the timeouts in `_race`,
+        # which also cover the wait for response headers that no socket shutdown can reach.
+        limits = [t for t in (self.cfg.first_token_timeout_seconds, self.cfg.stall_timeout_seconds) if t > 0]
+        return max(limits) + 5.0 if limits else 300.0
+
+    def _backoff(self, retry: int, error: LlmError) -> float:
+        delay = random.uniform(0, self.cfg.retry_backoff_seconds * (2**retry))
+        if isinstance(error, _RetryableError) and error.retry_after is not None:
+            delay = max(delay, min(error.retry_after, MAX_RETRY_AFTER_SECONDS))
+        return delay
+
+    def _race(
+        self,
+        kind: str,
+        work: Callable[[_EndpointState, _Attempt, Callable[[str, Any], None]], None],
+        first_timeout: float = 0.0,
+        stall_timeout: float = 0.0,
+        hedge: bool = True,
+    ) -> Generator[tuple[str, Any], None, None]:
+        """Yield `(event, value)` pairs from the first attempt that produces output.
+
+        `work` runs on its own thread per attempt and reports through the given callback with
+        "item" for each piece of output and "done" at the end; exceptions count as failures.
+        An attempt with no output after `first_timeout` fails like a retryable error; once one has
+        won, a gap longer than `stall_timeout` between items aborts the call. 0 disables either.
+        `hedge=False` never races a second attempt, for calls whose loser cannot be cut off.
+        """
+        events: queue.Queue[tuple[_Attempt, str, Any]] = queue.Queue()
+        active: list[_Attempt] = []
+        ranked = self._ranked(kind)
+        next_index = 0
+        retries = 0
+        hedged = False
+        winner: _Attempt | None = None
+        last_item = 0.0
+
+        def start(hedge: bool = False) -> None:
+            nonlocal next_index
+            state = ranked[next_index % len(ranked)]
+            next_index += 1
+            attempt = _Attempt(state, hedge)
+            active.append(attempt)
+            metrics.incr("llm.attempts")
+
+            def report(event: str, value: Any) -> None:
+                events.put((attempt, event, value))
+
+            def run() -> None:
+                try:
+                    work(state, attempt, report)
+                except Exception as exc:  # noqa: BLE001
+                    report("error", _classify(exc))
+
+            threading.Thread(target=run, name="graphchat-llm", daemon=True).start()
+
+        def next_deadline() -> float | None:
+            deadlines: list[float] = []
+            if winner is not None:
+                if stall_timeout > 0:
+                    deadlines.append(last_item + stall_timeout)
+            else:
+                hedge_at = self.cfg.hedge_after_seconds if hedge else 0.0
+                if not hedged and hedge_at > 0 and len(active) == 1:
+                    deadlines.append(active[0].started + hedge_at)
+                if first_timeout > 0:
+                    deadlines.extend(a.started + first_timeout for a in active)
+            return min(deadlines) if deadlines else None
+
+        start()
         try:
-            with httpx.Client(timeout=httpx.Timeout(180.0, connect=20.0)) as client:
-                resp = client.post(url, headers=headers, json=payload)
+            while True:
+                deadline = next_deadline()
+                try:
+                    attempt, event, value = events.get(
+                        timeout=None if deadline is None else max(0.0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    now = time.monotonic()
+                    if winner is not None:
+                        metrics.incr("llm.stalls")
+                        raise LlmTimeoutError(
+                            f"LLM stream stalled: no output for {stall_timeout:g}s.", phase="stall"
+                        ) from None
+                    expired = [a for a in active if first_timeout > 0 and now >= a.started + first_timeout]
+                    if not expired:
+                        # The first attempt is slow: race a second one, on the next endpoint if there is one.
+                        hedged = True
+                        metrics.incr("llm.hedges")
+                        start(hedge=True)
+                        continue
+                    metrics.incr("llm.first_token_timeouts", len(expired))
+                    attempt, event = expired[0], "error"
+                    value = LlmTimeoutError(
+                        f"LLM produced no output within {first_timeout:g}s.", phase="first_token"
+                    )
+                    for other in expired[1:]:
+                        active.remove(other)
+                        other.close()
+                        self._record_failure(other.state)
+                    attempt.close()
+                if attempt not in active:
+                    # Late reports from attempts that already lost, failed or timed out.
+                    continue
+                if event == "error":
+                    active.remove(attempt)
+                    retryable = _is_retryable(value)
+                    if retryable:
+                        self._record_failure(attempt.state)
+                    if winner is not None or not retryable:
+                        raise value
+                    if active:
+                        # A hedge is still running; let it finish instead of retrying now.
+                        continue
+                    if retries >= self.cfg.max_retries:
+                        raise value
+                    time.sleep(self._backoff(retries, value))
+                    retries += 1
+                    metrics.incr("llm.retries")
+                    hedged = False
+                    start()
+                    continue
+                now = time.monotonic()
+                if winner is None:
+                    winner = attempt
+                    self._record_latency(attempt.state, kind, now - attempt.started, ok=True)
+                    metrics.observe(f"llm.{kind}_seconds", now - attempt.started)
+                    if attempt.hedge:
+                        metrics.incr("llm.hedge_wins")
+                    for other in active:
+                        if other is not attempt:
+                            # A lost race is a lower bound on that endpoint's latency; count it so
+                            # routing stops preferring it.
+                            self._record_latency(other.state, kind, now - other.started, ok=False)
+                            other.close()
+                    active[:] = [attempt]
+                last_item = now
+                yield event, value
+                if event == "done":
+                    return
+        finally:
+            # Also reached on timeouts and when the caller stops consuming: drop every upstream.
+            for attempt in active:
+                attempt.close()
+
+    def json_completion(self, system_prompt: str, user_prompt: str) -> dict:
+        def work(state: _EndpointState, attempt: _Attempt, report: Callable[[str, Any], None]) -> None:
+            ep = state.endpoint
+            payload = {
+                "model": ep.model,
+                "temperature": 0.3,
+                "response_format": {"type": "json_object"},
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+            }
+            headers = {"Authorization": f"Bearer {ep.api_key}"}
+            resp = self._client.post(f"{ep.base_url}/chat/completions", headers=headers, json=payload)
             resp.raise_for_status()
+            if attempt.cancel.is_set():
+                return
             data = resp.json()
             content = data["choices"][0]["message"]["content"]
-            return json.loads(content)
-        except Exception as exc:  # noqa: BLE001
-            raise LlmError(str(exc)) from exc
+            report("item", json.loads(content))
+            report("done", None)
+
+        # Not hedged: a non-streaming upstream usually sends nothing, not even headers, until the
+        # whole completion is done, so a losing attempt could not be closed early and would keep
+        # generating (and billing) to the end.
+        for event, value in self._race("json", work, hedge=False):
+            if event == "item":
+                return value
+        raise LlmError("LLM returned no completion.")
 
     def stream_text_completion(self, system_prompt: str, user_prompt: str) -> Generator[str, None, None]:
-        url = f"{self.cfg.base_url}/chat/completions"
-        payload = {
-            "model": self.cfg.model,
-            "temperature": 0.3,
-            "stream": True,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        }
-        headers = {
-            "Authorization": f"Bearer {self.cfg.api_key}",
-            "Accept": "text/event-stream",
-        }
-        try:
-            with httpx.Client(timeout=httpx.Timeout(300.0, connect=20.0)) as client:
-                with client.stream("POST", url, headers=headers, json=payload) as resp:
-                    resp.raise_for_status()
-                    for line in resp.iter_lines():
-                        if not line:
-                            continue
-                        text = line.strip()
-                        if not text.startswith("data:"):
-                            continue
-                        data_part = text[5:].strip()
-                        if data_part == "[DONE]":
-                            break
-                        chunk = json.loads(data_part)
-                        delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if delta:
-                            yield str(delta)
-        except Exception as exc:  # noqa: BLE001
-            raise LlmError(str(exc)) from exc
+        return self._stream_completion(system_prompt, user_prompt, {})
+
+    def stream_json_completion(self, system_prompt: str, user_prompt: str) -> Generator[str, None, None]:
+        """JSON-mode completion yielded as raw text chunks while it is generated; see `JsonObjectStream`."""
+        return self._stream_completion(system_prompt, user_prompt, {"response_format": {"type": "json_object"}})
+
+    def _stream_completion(
+        self, system_prompt: str, user_prompt: str, options: dict[str, Any]
+    ) -> Generator[str, None, None]:
+        def work(state: _EndpointState, attempt: _Attempt, report: Callable[[str, Any], None]) -> None:
+            ep = state.endpoint
+            payload = {
+                "model": ep.model,
+                "temperature": 0.3,
+                "stream": True,
+                **options,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+            }
+            headers = {
+                "Authorization": f"Bearer {ep.api_key}",
+                "Accept": "text/event-stream",
+            }
+            with self._client.stream(
+                "POST",
+                f"{ep.base_url}/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=httpx.Timeout(self._stream_read_timeout(), connect=20.0),
+            ) as resp:
+                attempt.response = resp
+                if attempt.cancel.is_set():
+                    return
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if attempt.cancel.is_set():
+                        return
+                    if not line:
+                        continue
+                    text = line.strip()
+                    if not text.startswith("data:"):
+                        continue
+                    data_part = text[5:].strip()
+                    if data_part == "[DONE]":
+                        break
+                    chunk = json.loads(data_part)
+                    delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                    if delta:
+                        report("item", str(delta))
+            report("done", None)
+
+        for event, value in self._race(
+            "stream",
+            work,
+            first_timeout=self.cfg.first_token_timeout_seconds,
+            stall_timeout=self.cfg.stall_timeout_seconds,
+        ):
+            if event == "item":
+                yield value
@@ -1,83 +1,192 @@
 from __future__ import annotations
+import asyncio
+import codecs
+import hashlib
 import json
+import os
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any
 
-import uvicorn
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import APIRouter, FastAPI, File, HTTPException, Query, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
-from fastapi.staticfiles import StaticFiles
-
-from .config import load_config
-from .db import connect, init_db
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from .archive import session_archiver
+from .cli import run
+from .config import AppConfig, load_config
+from .db import MIGRATED_ENV, ConnectionPool, PoolTimeoutError, init_db, open_shards
+from .graph_cache import graph_cache
+from .http_cache import etag_matches, json_response, not_modified
 from .llm_client import LlmClient, LlmError
+from .metrics import metrics
 from .models import (
     AskIn,
     AskOut,
+    ExpandIn,
     GraphOut,
     InitSessionIn,
     InitSessionOut,
+    LinkMaterialIn,
+    NodeDepthOut,
+    PathOut,
+    QuizGenerateOut,
+    QuizPageOut,
+    ReviewEnrollIn,
+    ReviewEnrollOut,
+    ReviewGradesIn,
+    ReviewGradesOut,
+    ReviewItemOut,
+    SearchPageOut,
+    SessionOut,
+    SuggestionOut,
     UpdatePositionIn,
 )
+from .near_duplicates import knowledge_index
+from .position_buffer import position_buffer
+from .profiling import ProfiledRoute, ProfilingMiddleware, follow
+from .pubsub import broker
 from .repository import Repository
-from .services.graph_service import GraphService
-
-config = load_config(Path.cwd())
-init_db(config.db.path)
-
-app = FastAPI(title="GraphChat API", version="0.1.0")
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=config.cors.origins,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    allow_credentials=False,
-)
+from .services.expand_service import ExpandService
+from .services.graph_service import AnswerDiscardedError, GraphService
+from .services.prefetch_service import PrefetchService
+from .services.quiz_service import QuizService
+from .services.review_service import ReviewService
+from .services.search_service import SearchService
+from .services.summary_service import SummaryService
+from .services.transfer_service import NdjsonImporter, export_ndjson
+from .services.traversal_service import TraversalService
+from .static_assets import StaticAssets
 
 STATIC_DIR = Path(__file__).resolve().parent / "static"
-INDEX_FILE = STATIC_DIR / "index.html"
-if STATIC_DIR.exists():
-    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
-
-
-def _services() -> tuple[Repository, GraphService]:
-    conn = connect(config.db.path)
-    repo = Repository(conn)
-    llm = LlmClient(config.llm)
-    return repo, GraphService(repo, llm)
-
-
-@app.get("/health")
+UPLOAD_CHUNK_BYTES = 16 * 1024
+
+router = APIRouter(route_class=ProfiledRoute)
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    config: AppConfig = app.state.config
+    if os.environ.get(MIGRATED_ENV) != "1":
+        init_db(config.db.path)
+    shards = open_shards(config.db.path, config.db.shards, config.db.shard_dir)
+    app.state.pool = ConnectionPool(
+        config.db.path,
+        size=config.db.pool_size,
+        shards=shards,
+        max_connections=config.db.max_connections,
+        acquire_timeout=config.db.acquire_timeout_seconds,
+    )
+    # With several workers another process may write a cached session, so reads re-check revisions.
+    graph_cache.configure(
+        config.graph_cache.max_bytes, config.graph_cache.enabled, verify=config.server.workers > 1
+    )
+    app.state.static = StaticAssets(STATIC_DIR, min_compress_bytes=config.server.compress_min_bytes)
+    app.state.llm = LlmClient(config.llm)
+    app.state.prefetch = PrefetchService(config.prefetch, app.state.llm, app.state.pool, config.context)
+    app.state.summaries = SummaryService(config.summaries, app.state.llm, app.state.pool)
+    app.state.quizzes = QuizService(config.quiz, app.state.llm, app.state.pool)
+    knowledge_index.configure(
+        config.dedupe.enabled, config.dedupe.title_threshold, config.dedupe.content_threshold, config.dedupe.merge
+    )
+    if config.positions.write_behind:
+        position_buffer.start(app.state.pool, config.positions.flush_interval_seconds, config.positions.max_pending)
+    if config.archive.enabled:
+        session_archiver.start(
+            app.state.pool, config.archive.inactive_days, config.archive.interval_seconds, config.archive.batch_size
+        )
+    try:
+        yield
+    finally:
+        session_archiver.stop()
+        # Before the pool closes, so the last buffered moves are still written.
+        position_buffer.stop()
+        app.state.quizzes.close()
+        app.state.summaries.close()
+        app.state.prefetch.close()
+        app.state.llm.close()
+        app.state.pool.close()
+        if shards is not None:
+            shards.close()
+
+
+def create_app(config: AppConfig | None = None) -> FastAPI:
+    config = config or load_config(Path.cwd())
+    app = FastAPI(title="GraphChat API", version="0.1.0", lifespan=_lifespan)
+    app.state.config = config
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=config.cors.origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        allow_credentials=False,
+    )
+    if config.profiling.enabled:
+        app.add_middleware(ProfilingMiddleware, config=config.profiling)
+    app.add_exception_handler(PoolTimeoutError, _pool_timeout)
+    app.include_router(router)
+    return app
+
+
+def _pool_timeout(request: Request, exc: Exception) -> JSONResponse:
+    metrics.incr("db.pool_timeouts")
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+
+def _services(request: Request) -> tuple[Repository, GraphService]:
+    state = request.app.state
+    repo = Repository(state.pool.acquire(), state.pool.shards)
+    return repo, GraphService(repo, state.llm, state.config.context)
+
+
+def _release(request: Request, repo: Repository) -> None:
+    request.app.state.pool.release(repo.conn)
+
+
+@router.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@app.get("/api/sessions")
-def list_sessions(limit: int = 50) -> list[dict]:
-    repo, _ = _services()
+@router.get("/metrics")
+def get_metrics() -> dict[str, Any]:
+    return metrics.snapshot()
+
+
+@router.get("/api/sessions", response_model=list[SessionOut])
+def list_sessions(request: Request, limit: int = 50) -> Response:
+    repo, _ = _services(request)
     try:
-        return [s.model_dump() for s in repo.list_sessions(limit=limit)]
+        count, latest = repo.sessions_fingerprint()
+        etag = f'W/"sessions-{count}-{hashlib.sha1(latest.encode()).hexdigest()[:16]}-{limit}"'
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        payload = [s.model_dump() for s in repo.list_sessions(limit=limit)]
+        return json_response(request, payload, etag, request.app.state.config.server.compress_min_bytes)
     finally:
-        repo.conn.close()
+        _release(request, repo)
 
 
-@app.post("/api/sessions/init", response_model=InitSessionOut)
-def init_session(req: InitSessionIn) -> InitSessionOut:
-    repo, graph_svc = _services()
+@router.post("/api/sessions/init", response_model=InitSessionOut)
+def init_session(request: Request, req: InitSessionIn) -> InitSessionOut:
+    repo, graph_svc = _services(request)
     try:
         session, nodes, edges = graph_svc.init_session(req.topic.strip())
+        request.app.state.summaries.schedule(session.id, nodes)
         return InitSessionOut(session=session, nodes=nodes, edges=edges)
     except LlmError as exc:
         raise HTTPException(status_code=503, detail=f"LLM_UNAVAILABLE: {exc}") from exc
     except ValueError as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
     finally:
-        repo.conn.close()
+        _release(request, repo)
 
 
-@app.post("/api/sessions/init/stream")
-def init_session_stream(req: InitSessionIn) -> StreamingResponse:
-    repo, graph_svc = _services()
+@router.post("/api/sessions/init/stream")
+def init_session_stream(request: Request, req: InitSessionIn) -> StreamingResponse:
+    repo, graph_svc = _services(request)
 
     def event_stream():
         try:
@@ -122,176 +231,644 @@ def init_session_stream(req: InitSessionIn) -> StreamingResponse:
                     result = InitSessionOut(session=session, nodes=nodes, edges=edges)
                     payload = json.dumps({"type": "done", "result": result.model_dump()}, ensure_ascii=False)
                     yield f"data: {payload}\n\n"
+                    request.app.state.summaries.schedule(session.id, nodes)
                     break
         except Exception as exc:  # noqa: BLE001
-            payload = json.dumps({"type": "error", "message": str(exc)}, ensure_ascii=False)
+            payload = json.dumps(_error_payload(exc), ensure_ascii=False)
             yield f"data: {payload}\n\n"
         finally:
-            repo.conn.close()
+            _release(request, repo)
+
+    return StreamingResponse(follow(event_stream()), media_type="text/event-stream")
+
+
+def _export_response(request: Request, repo: Repository, session_ids: list[str] | None, filename: str) -> StreamingResponse:
+    def lines():
+        try:
+            yield from export_ndjson(repo.conn, session_ids, repo.shards)
+        finally:
+            _release(request, repo)
+
+    return StreamingResponse(
+        follow(lines()),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/api/export")
+def export_all_sessions(request: Request) -> StreamingResponse:
+    repo, _ = _services(request)
+    return _export_response(request, repo, None, "graphchat-export.ndjson")
+
+
+@router.get("/api/sessions/{session_id}/export")
+def export_session(request: Request, session_id: str) -> StreamingResponse:
+    repo, _ = _services(request)
+    try:
+        if repo.get_session(session_id) is None:
+            raise HTTPException(status_code=404, detail="Session not found.")
+    except BaseException:
+        # On success the stream releases the connection once the body is sent.
+        _release(request, repo)
+        raise
+    return _export_response(request, repo, [session_id], f"graphchat-{session_id}.ndjson")
+
+
+@router.post("/api/import")
+def import_sessions(request: Request, file: UploadFile = File(...)) -> dict[str, Any]:
+    repo, _ = _services(request)
+    try:
+        return NdjsonImporter(repo.conn, shards=repo.shards).run(file.file)
+    except (ValueError, KeyError, TypeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid import file: {exc}") from exc
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/graph", response_model=GraphOut)
+def get_graph(request: Request, session_id: str) -> Response:
+    request.app.state.prefetch.touch(session_id)
+    repo, _ = _services(request)
+    try:
+        # Read the revision before the graph so a concurrent write can only make the ETag stale, never wrong.
+        # Buffered moves are not in the revision yet; their sequence number keeps the ETag changing.
+        moved = position_buffer.pending_seq(session_id)
+        revision = repo.get_session_revision(session_id)
+        etag = None
+        if revision is not None:
+            etag = f'W/"graph-{session_id}-{revision}"' if moved is None else f'W/"graph-{session_id}-{revision}-m{moved}"'
+        if etag is not None and etag_matches(request, etag):
+            return not_modified(etag)
+        graph = GraphOut(nodes=repo.list_nodes(session_id), edges=repo.list_edges(session_id))
+        return json_response(request, graph.model_dump(), etag, request.app.state.config.server.compress_min_bytes)
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/nodes/{node_id}/ancestors", response_model=list[NodeDepthOut])
+def get_ancestors(
+    request: Request, session_id: str, node_id: str, max_depth: int = Query(default=16, ge=1, le=64)
+) -> list[NodeDepthOut]:
+    repo, _ = _services(request)
+    try:
+        return TraversalService(repo).ancestors(session_id, node_id, max_depth)
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/nodes/{node_id}/descendants", response_model=list[NodeDepthOut])
+def get_descendants(
+    request: Request, session_id: str, node_id: str, max_depth: int = Query(default=16, ge=1, le=64)
+) -> list[NodeDepthOut]:
+    repo, _ = _services(request)
+    try:
+        return TraversalService(repo).descendants(session_id, node_id, max_depth)
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/nodes/{node_id}/component", response_model=GraphOut)
+def get_component(request: Request, session_id: str, node_id: str) -> GraphOut:
+    repo, _ = _services(request)
+    try:
+        graph = TraversalService(repo).component(session_id, node_id)
+        if graph is None:
+            raise HTTPException(status_code=404, detail="Node not found.")
+        return graph
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/path", response_model=PathOut)
+def get_path(
+    request: Request, session_id: str, source: str, target: str, directed: bool = False
+) -> PathOut:
+    repo, _ = _services(request)
+    try:
+        path = TraversalService(repo).shortest_path(session_id, source, target, directed)
+        if path is None:
+            raise HTTPException(status_code=404, detail="No path between these nodes.")
+        return path
+    finally:
+        _release(request, repo)
+
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+async def _wait_disconnect(websocket: WebSocket) -> None:
+    # Clients only listen; anything they send is ignored until the socket closes.
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
 
 
-@app.get("/api/sessions/{session_id}/graph", response_model=GraphOut)
-def get_graph(session_id: str) -> GraphOut:
-    repo, _ = _services()
+@router.websocket("/api/sessions/{session_id}/ws")
+async def session_updates(websocket: WebSocket, session_id: str) -> None:
+    """Push graph deltas for one session; each carries the session revision it produced."""
+    pool: ConnectionPool = websocket.app.state.pool
+
+    def read_revision() -> int | None:
+        conn = pool.acquire()
+        try:
+            return Repository(conn, pool.shards).get_session_revision(session_id)
+        finally:
+            pool.release(conn)
+
+    # Subscribe before reading the revision so no write can fall between the two.
+    sub = broker.subscribe(session_id)
+    receiver: asyncio.Task[None] | None = None
     try:
-        return GraphOut(nodes=repo.list_nodes(session_id), edges=repo.list_edges(session_id))
+        revision = await run_in_threadpool(read_revision)
+        if revision is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+        await websocket.send_json({"type": "hello", "session_id": session_id, "revision": revision})
+        metrics.incr("ws.connections")
+        receiver = asyncio.create_task(_wait_disconnect(websocket))
+        while True:
+            getter = asyncio.ensure_future(sub.queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                return
+            delta = getter.result()
+            if sub.overflowed:
+                # This client fell too far behind; drop the backlog and let it refetch the graph.
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.overflowed = False
+                metrics.incr("ws.resyncs")
+                delta = {"type": "resync", "session_id": session_id}
+            await websocket.send_json(delta)
+            metrics.incr("ws.deltas_sent")
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: sending on a socket the client already closed.
+        pass
     finally:
-        repo.conn.close()
+        broker.unsubscribe(sub)
+        if receiver is not None:
+            receiver.cancel()
 
 
-@app.post("/api/sessions/{session_id}/ask", response_model=AskOut)
-def ask(session_id: str, req: AskIn) -> AskOut:
-    repo, graph_svc = _services()
+@router.post("/api/sessions/{session_id}/ask", response_model=AskOut)
+def ask(request: Request, session_id: str, req: AskIn) -> AskOut:
+    state = request.app.state
+    state.prefetch.touch(session_id)
+    repo, graph_svc = _services(request)
     try:
-        return graph_svc.ask(
+        state.summaries.schedule_ids(session_id, repo, req.node_ids)
+        result = graph_svc.ask(
             session_id,
             req.question.strip(),
             req.node_ids,
             [s.model_dump() for s in req.selected_sections],
+            ancestor_depth=req.ancestor_depth,
         )
+        state.summaries.schedule(session_id, result.new_nodes)
+        return result
     except LlmError as exc:
         raise HTTPException(status_code=503, detail=f"LLM_UNAVAILABLE: {exc}") from exc
     finally:
-        repo.conn.close()
+        _release(request, repo)
+
+
+def _error_payload(exc: Exception) -> dict[str, Any]:
+    # LLM failures carry a code so clients can tell a stalled stream from other errors.
+    body: dict[str, Any] = {"type": "error", "message": str(exc)}
+    if isinstance(exc, AnswerDiscardedError):
+        # What the failed answer had already streamed out, so clients can drop it too.
+        body["discarded"] = {"node_ids": exc.node_ids, "edge_ids": exc.edge_ids}
+        exc = exc.cause
+    if isinstance(exc, LlmError):
+        body["code"] = exc.code
+    return body
+
+
+def _ask_event_payload(event: dict[str, Any]) -> dict[str, Any]:
+    etype = event.get("type")
+    if etype == "start":
+        return {
+            "type": "start",
+            "nodes": [n.model_dump() for n in event.get("nodes", [])],
+            "question_node_id": event.get("question_node_id"),
+            "answer_node_id": event.get("answer_node_id"),
+            "edges": [e.model_dump() for e in event.get("edges", [])],
+        }
+    if etype == "knowledge_start":
+        node = event.get("node")
+        edge = event.get("edge")
+        return {
+            "type": "knowledge_start",
+            "node": node.model_dump() if node else None,
+            "edge": edge.model_dump() if edge else None,
+        }
+    if etype == "knowledge_link":
+        return {
+            "type": "knowledge_link",
+            "node": event["node"].model_dump(),
+            "edge": event["edge"].model_dump(),
+            "similarity": event.get("similarity"),
+        }
+    if etype == "knowledge_duplicate":
+        return {
+            "type": "knowledge_duplicate",
+            "node_id": event.get("node_id"),
+            "duplicate_of": event["duplicate_of"].model_dump(),
+            "edge": event["edge"].model_dump(),
+            "similarity": event.get("similarity"),
+        }
+    if etype == "knowledge_merged":
+        edge = event.get("edge")
+        return {
+            "type": "knowledge_merged",
+            "node_id": event.get("node_id"),
+            "into": event["into"].model_dump(),
+            "edge": edge.model_dump() if edge else None,
+            "similarity": event.get("similarity"),
+        }
+    if etype == "question_title":
+        return {
+            "type": "question_title",
+            "node_id": event.get("node_id"),
+            "title": event.get("title", ""),
+        }
+    return {
+        "type": "token",
+        "node_id": event.get("node_id"),
+        "content": event.get("content", ""),
+    }
+
+
+def _ask_json_event_payload(event: dict[str, Any]) -> dict[str, Any]:
+    etype = event.get("type")
+    if etype == "node":
+        return {"type": "node", "node": event["node"].model_dump()}
+    if etype == "edge":
+        return {"type": "edge", "edge": event["edge"].model_dump()}
+    if etype == "counterexample":
+        edge = event.get("edge")
+        return {
+            "type": "counterexample",
+            "node": event["node"].model_dump(),
+            "edge": edge.model_dump() if edge else None,
+        }
+    return {"type": "redirect_hint", "redirect_hint": event.get("redirect_hint")}
+
+
+@router.post("/api/sessions/{session_id}/ask/json/stream")
+def ask_json_stream(request: Request, session_id: str, req: AskIn) -> StreamingResponse:
+    """SSE variant of `/ask`: each node and edge is sent as soon as the model finishes writing it."""
+    summaries = request.app.state.summaries
+    request.app.state.prefetch.touch(session_id)
+    repo, graph_svc = _services(request)
+
+    def event_stream():
+        try:
+            summaries.schedule_ids(session_id, repo, req.node_ids)
+            gen = graph_svc.ask_json_stream(
+                session_id,
+                req.question.strip(),
+                req.node_ids,
+                [s.model_dump() for s in req.selected_sections],
+                ancestor_depth=req.ancestor_depth,
+            )
+            while True:
+                try:
+                    event = next(gen)
+                    payload = json.dumps(_ask_json_event_payload(event), ensure_ascii=False)
+                    yield f"data: {payload}\n\n"
+                except StopIteration as stop:
+                    result = stop.value
+                    payload = json.dumps({"type": "done", "result": result.model_dump()}, ensure_ascii=False)
+                    yield f"data: {payload}\n\n"
+                    summaries.schedule(session_id, result.new_nodes)
+                    break
+        except Exception as exc:  # noqa: BLE001
+            payload = json.dumps(_error_payload(exc), ensure_ascii=False)
+            yield f"data: {payload}\n\n"
+        finally:
+            _release(request, repo)
 
+    return StreamingResponse(follow(event_stream()), media_type="text/event-stream")
 
-@app.post("/api/sessions/{session_id}/ask/stream")
-def ask_stream(session_id: str, req: AskIn) -> StreamingResponse:
-    repo, graph_svc = _services()
+
+@router.post("/api/sessions/{session_id}/ask/stream")
+def ask_stream(request: Request, session_id: str, req: AskIn) -> StreamingResponse:
+    prefetch = request.app.state.prefetch
+    summaries = request.app.state.summaries
+    prefetch.touch(session_id)
+    repo, graph_svc = _services(request)
+    question = req.question.strip()
 
     def event_stream():
         try:
+            summaries.schedule_ids(session_id, repo, req.node_ids)
+            prefetched = None
+            answer_node_id = None
+            # Prefetched answers were generated without sections or ancestor context.
+            if not req.selected_sections and not req.ancestor_depth:
+                prefetched = repo.take_prefetched_answer(session_id, question, req.node_ids)
             gen = graph_svc.ask_stream(
                 session_id,
-                req.question.strip(),
+                question,
                 req.node_ids,
                 [s.model_dump() for s in req.selected_sections],
+                prefetched_answer=prefetched,
+                ancestor_depth=req.ancestor_depth,
             )
+            while True:
+                try:
+                    event = next(gen)
+                    if event.get("type") == "start":
+                        answer_node_id = event.get("answer_node_id")
+                    payload = json.dumps(_ask_event_payload(event), ensure_ascii=False)
+                    yield f"data: {payload}\n\n"
+                except StopIteration as stop:
+                    result = stop.value
+                    payload = json.dumps(
+                        {"type": "done", "result": result.model_dump(), "prefetched": prefetched is not None},
+                        ensure_ascii=False,
+                    )
+                    yield f"data: {payload}\n\n"
+                    summaries.schedule(session_id, result.new_nodes)
+                    answer = next((n for n in result.new_nodes if n.id == answer_node_id), None)
+                    if answer is not None:
+                        prefetch.schedule(session_id, question, answer)
+                    break
+        except Exception as exc:  # noqa: BLE001
+            payload = json.dumps(_error_payload(exc), ensure_ascii=False)
+            yield f"data: {payload}\n\n"
+        finally:
+            _release(request, repo)
+
+    return StreamingResponse(follow(event_stream()), media_type="text/event-stream")
+
+
+@router.get("/api/sessions/{session_id}/suggestions", response_model=list[SuggestionOut])
+def list_suggestions(request: Request, session_id: str) -> list[SuggestionOut]:
+    request.app.state.prefetch.touch(session_id)
+    repo, _ = _services(request)
+    try:
+        return repo.list_suggestions(session_id)
+    finally:
+        _release(request, repo)
+
+
+@router.post("/api/sessions/{session_id}/quiz", response_model=QuizGenerateOut)
+def generate_quiz(request: Request, session_id: str) -> QuizGenerateOut:
+    repo, _ = _services(request)
+    try:
+        if repo.get_session(session_id) is None:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        return request.app.state.quizzes.schedule(repo, session_id)
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/sessions/{session_id}/quiz", response_model=QuizPageOut)
+def list_quiz(
+    request: Request,
+    session_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=20, ge=1, le=100),
+) -> QuizPageOut:
+    repo, _ = _services(request)
+    try:
+        return request.app.state.quizzes.page(repo, session_id, offset, limit)
+    finally:
+        _release(request, repo)
+
+
+@router.post("/api/sessions/{session_id}/review/enroll", response_model=ReviewEnrollOut)
+def enroll_review(request: Request, session_id: str, req: ReviewEnrollIn) -> ReviewEnrollOut:
+    repo, _ = _services(request)
+    try:
+        return ReviewEnrollOut(enrolled=ReviewService(repo).enroll(session_id, req.node_ids))
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/review/due", response_model=list[ReviewItemOut])
+def list_due_reviews(
+    request: Request, session_id: str | None = None, limit: int = Query(default=20, ge=1, le=200)
+) -> list[ReviewItemOut]:
+    repo, _ = _services(request)
+    try:
+        return ReviewService(repo).due(limit, session_id)
+    finally:
+        _release(request, repo)
+
+
+@router.post("/api/review/grades", response_model=ReviewGradesOut)
+def submit_review_grades(request: Request, req: ReviewGradesIn) -> ReviewGradesOut:
+    repo, _ = _services(request)
+    try:
+        return ReviewService(repo).grade(req.grades)
+    finally:
+        _release(request, repo)
+
+
+@router.get("/api/search", response_model=SearchPageOut)
+def search_nodes(
+    request: Request,
+    q: str = Query(min_length=1, max_length=200),
+    session_id: str | None = None,
+    offset: int = Query(default=0, ge=0, le=10000),
+    limit: int = Query(default=20, ge=1, le=100),
+) -> SearchPageOut:
+    repo, _ = _services(request)
+    try:
+        if not repo.search_available():
+            raise HTTPException(status_code=503, detail="Full-text search needs SQLite built with FTS5.")
+        if session_id is not None and repo.get_session(session_id) is None:
+            raise HTTPException(status_code=404, detail="Session not found.")
+        try:
+            return SearchService(repo, request.app.state.config.search.max_candidates).search(q, limit, offset, session_id)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+    finally:
+        _release(request, repo)
+
+
+@router.post("/api/sessions/{session_id}/expand/stream")
+def expand_stream(request: Request, session_id: str, req: ExpandIn) -> StreamingResponse:
+    repo, _ = _services(request)
+    state = request.app.state
+    concurrency = min(req.concurrency or state.config.llm.max_concurrency, state.config.llm.max_concurrency)
+    expand_svc = ExpandService(repo, state.llm, state.pool, state.config.context)
+
+    def event_stream():
+        try:
+            gen = expand_svc.expand_stream(session_id, req.node_ids, req.question, concurrency)
             while True:
                 try:
                     event = next(gen)
                     etype = event.get("type")
-                    if etype == "start":
-                        payload = json.dumps(
-                            {
-                                "type": "start",
-                                "nodes": [n.model_dump() for n in event.get("nodes", [])],
-                                "question_node_id": event.get("question_node_id"),
-                                "answer_node_id": event.get("answer_node_id"),
-                                "edges": [e.model_dump() for e in event.get("edges", [])],
-                            },
-                            ensure_ascii=False,
-                        )
-                    elif etype == "knowledge_start":
-                        node = event.get("node")
-                        edge = event.get("edge")
-                        payload = json.dumps(
-                            {
-                                "type": "knowledge_start",
-                                "node": node.model_dump() if node else None,
-                                "edge": edge.model_dump() if edge else None,
-                            },
-                            ensure_ascii=False,
-                        )
-                    elif etype == "question_title":
-                        payload = json.dumps(
-                            {
-                                "type": "question_title",
-                                "node_id": event.get("node_id"),
-                                "title": event.get("title", ""),
-                            },
-                            ensure_ascii=False,
-                        )
+                    if etype == "branch_done":
+                        state.summaries.schedule(session_id, event["result"].new_nodes)
+                        body = {"type": "branch_done", "result": event["result"].model_dump()}
+                    elif etype == "branch_error":
+                        body = {"type": "branch_error", "message": event.get("message", ""), "code": event.get("code")}
+                    elif etype == "expand_start":
+                        body = {"type": "expand_start", "node_ids": event.get("node_ids", [])}
                     else:
-                        payload = json.dumps(
-                            {
-                                "type": "token",
-                                "node_id": event.get("node_id"),
-                                "content": event.get("content", ""),
-                            },
-                            ensure_ascii=False,
-                        )
+                        body = _ask_event_payload(event)
+                    body["branch_node_id"] = event.get("branch_node_id")
+                    payload = json.dumps(body, ensure_ascii=False)
                     yield f"data: {payload}\n\n"
                 except StopIteration as stop:
-                    result = stop.value
-                    payload = json.dumps({"type": "done", "result": result.model_dump()}, ensure_ascii=False)
+                    summary = {node_id: out.model_dump() for node_id, out in stop.value.items()}
+                    payload = json.dumps({"type": "done", "results": summary}, ensure_ascii=False)
                     yield f"data: {payload}\n\n"
                     break
         except Exception as exc:  # noqa: BLE001
-            payload = json.dumps({"type": "error", "message": str(exc)}, ensure_ascii=False)
+            payload = json.dumps(_error_payload(exc), ensure_ascii=False)
             yield f"data: {payload}\n\n"
         finally:
-            repo.conn.close()
+            _release(request, repo)
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return StreamingResponse(follow(event_stream()), media_type="text/event-stream")
 
 
-@app.patch("/api/sessions/{session_id}/nodes/{node_id}/position")
-def update_position(session_id: str, node_id: str, req: UpdatePositionIn) -> dict[str, bool]:
-    repo, _ = _services()
+@router.patch("/api/sessions/{session_id}/nodes/{node_id}/position")
+def update_position(request: Request, session_id: str, node_id: str, req: UpdatePositionIn) -> dict[str, bool]:
+    repo, _ = _services(request)
     try:
-        repo.update_node_position(session_id, node_id, req.x, req.y, req.width)
+        if position_buffer.enabled:
+            position_buffer.put(session_id, node_id, req.x, req.y, req.width)
+        else:
+            repo.update_node_position(session_id, node_id, req.x, req.y, req.width)
         return {"ok": True}
     finally:
-        repo.conn.close()
+        _release(request, repo)
 
 
-@app.delete("/api/sessions/{session_id}/nodes/{node_id}")
-def delete_node(session_id: str, node_id: str) -> dict[str, bool]:
-    repo, _ = _services()
+@router.delete("/api/sessions/{session_id}/nodes/{node_id}")
+def delete_node(request: Request, session_id: str, node_id: str) -> dict[str, bool]:
+    repo, _ = _services(request)
     try:
         repo.soft_delete_node(session_id, node_id)
         return {"ok": True}
     finally:
-        repo.conn.close()
-
-
-@app.post("/api/sessions/{session_id}/materials")
-async def upload_material(session_id: str, file: UploadFile = File(...)) -> dict[str, str]:
-    repo, _ = _services()
+        _release(request, repo)
+
+
+def _check_material_filename(filename: str | None) -> str:
+    if not filename:
+        raise HTTPException(status_code=400, detail="Empty filename.")
+    ext = filename.lower().split(".")[-1]
+    if ext not in {"txt", "md"}:
+        raise HTTPException(status_code=400, detail="Only .txt/.md are supported in MVP.")
+    return filename
+
+
+def _hash_upload(file: UploadFile, max_bytes: int) -> tuple[str, int]:
+    digest = hashlib.sha256()
+    total = 0
+    while True:
+        data = file.file.read(UPLOAD_CHUNK_BYTES)
+        if not data:
+            break
+        total += len(data)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes.")
+        digest.update(data)
+    file.file.seek(0)
+    return digest.hexdigest(), total
+
+
+def _iter_upload_text(file: UploadFile) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = file.file.read(UPLOAD_CHUNK_BYTES)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+@router.post("/api/sessions/{session_id}/materials")
+def upload_material(request: Request, session_id: str, file: UploadFile = File(...)) -> dict[str, Any]:
+    max_bytes = request.app.state.config.materials.max_upload_bytes
+    filename = _check_material_filename(file.filename)
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds {max_bytes} bytes.")
+    # The upload is already spooled locally, so hashing first lets known bodies skip all chunk writes.
+    content_hash, size_bytes = _hash_upload(file, max_bytes)
+    mime_type = file.content_type or "text/plain"
+    repo, _ = _services(request)
     try:
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="Empty filename.")
-        ext = file.filename.lower().split(".")[-1]
-        if ext not in {"txt", "md"}:
-            raise HTTPException(status_code=400, detail="Only .txt/.md are supported in MVP.")
-        data = await file.read()
-        try:
-            text = data.decode("utf-8")
-        except UnicodeDecodeError as exc:
-            raise HTTPException(status_code=400, detail="File must be UTF-8 text.") from exc
+        material_id = repo.link_material(session_id, filename, mime_type, content_hash)
+        if material_id is not None:
+            return {"id": material_id, "content_hash": content_hash, "deduplicated": True}
         material_id = repo.add_material(
             session_id=session_id,
-            filename=file.filename,
-            mime_type=file.content_type or "text/plain",
-            content_text=text,
+            filename=filename,
+            mime_type=mime_type,
+            content_hash=content_hash,
+            size_bytes=size_bytes,
+            chunks=_iter_upload_text(file),
         )
-        return {"id": material_id}
+        return {"id": material_id, "content_hash": content_hash, "deduplicated": False}
+    except UnicodeDecodeError as exc:
+        raise HTTPException(status_code=400, detail="File must be UTF-8 text.") from exc
+    finally:
+        _release(request, repo)
+
+
+@router.post("/api/sessions/{session_id}/materials/link")
+def link_material(request: Request, session_id: str, req: LinkMaterialIn) -> dict[str, Any]:
+    filename = _check_material_filename(req.filename)
+    repo, _ = _services(request)
+    try:
+        material_id = repo.link_material(session_id, filename, req.mime_type, req.content_hash)
+        if material_id is None:
+            raise HTTPException(status_code=404, detail="Unknown content hash; upload the file instead.")
+        return {"id": material_id, "content_hash": req.content_hash, "deduplicated": True}
     finally:
-        repo.conn.close()
+        _release(request, repo)
 
 
-def run() -> None:
-    uvicorn.run(app, host=config.server.host, port=config.server.port)
+@router.delete("/api/sessions/{session_id}/materials/{material_id}")
+def delete_material(request: Request, session_id: str, material_id: str) -> dict[str, bool]:
+    repo, _ = _services(request)
+    try:
+        if not repo.delete_material(session_id, material_id):
+            raise HTTPException(status_code=404, detail="Material not found.")
+        return {"ok": True}
+    finally:
+        _release(request, repo)
 
 
-@app.get("/", response_model=None)
-def index() -> Response:
-    if INDEX_FILE.exists():
-        return FileResponse(INDEX_FILE)
+def _index_response(request: Request) -> Response:
+    resp = request.app.state.static.response(request, "index.html")
+    if resp is not None:
+        return resp
     return JSONResponse({"message": "Frontend not built. Run `make web-build`."}, status_code=404)
 
 
-@app.get("/{full_path:path}", response_model=None)
-def spa_fallback(full_path: str) -> Response:
-    if full_path.startswith("api/") or full_path in {"health", "docs", "openapi.json", "redoc"}:
+@router.get("/static/{asset_path:path}", response_model=None)
+def static_asset(request: Request, asset_path: str) -> Response:
+    resp = request.app.state.static.response(request, asset_path)
+    if resp is None:
         return JSONResponse({"detail": "Not Found"}, status_code=404)
-    if INDEX_FILE.exists():
-        return FileResponse(INDEX_FILE)
-    return JSONResponse({"message": "Frontend not built. Run `make web-build`."}, status_code=404)
+    return resp
+
+
+@router.get("/", response_model=None)
+def index(request: Request) -> Response:
+    return _index_response(request)
+
+
+@router.get("/{full_path:path}", response_model=None)
+def spa_fallback(request: Request, full_path: str) -> Response:
+    if full_path.startswith("api/") or full_path in {"health", "metrics", "docs", "openapi.json", "redoc"}:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    return _index_response(request)
 
 
 if __name__ == "__main__":
-    run()
+    raise SystemExit(run())
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import threading
+from typing import Any
+
+
+class Metrics:
+    """Thread-safe in-process counters and value summaries, exposed at `/metrics` per worker."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._summaries: dict[str, dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = {"count": 1, "sum": value, "max": value, "last": value}
+                return
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {k: dict(v) for k, v in self._summaries.items()},
+            }
+
+
+metrics = Metrics()
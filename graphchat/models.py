@@ -51,6 +51,17 @@ class GraphOut(BaseModel):
     edges: list[Edge]
 
 
+class NodeDepthOut(BaseModel):
+    node: Node
+    depth: int
+
+
+class PathOut(BaseModel):
+    node_ids: list[str]
+    nodes: list[Node]
+    edges: list[Edge]
+
+
 class SelectedSection(BaseModel):
     node_id: str
     title: str
@@ -62,6 +73,14 @@ class AskIn(BaseModel):
     question: str = Field(min_length=1, max_length=1200)
     node_ids: list[str] = Field(default_factory=list)
     selected_sections: list[SelectedSection] = Field(default_factory=list)
+    # Also give the LLM the selected nodes' ancestors up to this many edges back.
+    ancestor_depth: int = Field(default=0, ge=0, le=8)
+
+
+class ExpandIn(BaseModel):
+    node_ids: list[str] = Field(default_factory=list, max_length=50)
+    question: str = Field(default="Explain {title} in more depth.", min_length=1, max_length=1200)
+    concurrency: int | None = Field(default=None, ge=1)
 
 
 class AskOut(BaseModel):
@@ -77,3 +96,88 @@ class UpdatePositionIn(BaseModel):
     width: float | None = Field(default=None, gt=80.0, le=1200.0)
 
 
+class LinkMaterialIn(BaseModel):
+    filename: str = Field(min_length=1, max_length=255)
+    content_hash: str = Field(pattern=r"^[0-9a-f]{64}$")
+    mime_type: str = "text/plain"
+
+
+class SuggestionOut(BaseModel):
+    id: str
+    source_node_id: str
+    question: str
+    rank: int
+    prefetched: bool
+
+
+class QuizQuestionOut(BaseModel):
+    question: str
+    answer: str
+
+
+class NodeQuizOut(BaseModel):
+    node_id: str
+    title: str
+    questions: list[QuizQuestionOut]
+
+
+class QuizPageOut(BaseModel):
+    items: list[NodeQuizOut]
+    total: int
+    offset: int
+    limit: int
+    # Quizzable nodes on this page whose questions are still being generated.
+    pending: int
+
+
+class QuizGenerateOut(BaseModel):
+    scheduled: int
+    cached: int
+
+
+class ReviewEnrollIn(BaseModel):
+    # Empty means every non-question node of the session.
+    node_ids: list[str] = Field(default_factory=list, max_length=5000)
+
+
+class ReviewEnrollOut(BaseModel):
+    enrolled: int
+
+
+class ReviewGradeIn(BaseModel):
+    node_id: str
+    grade: int = Field(ge=0, le=5)
+
+
+class ReviewGradesIn(BaseModel):
+    grades: list[ReviewGradeIn] = Field(min_length=1, max_length=1000)
+
+
+class ReviewGradesOut(BaseModel):
+    updated: int
+    missing: list[str]
+
+
+class ReviewItemOut(BaseModel):
+    node: Node
+    due_at: str
+    interval_days: float
+    ease: float
+    repetitions: int
+    lapses: int
+
+
+class SearchHitOut(BaseModel):
+    node: Node
+    # HTML-escaped text with matches wrapped in <mark>, safe to render as is.
+    title_html: str
+    snippet_html: str
+    # bm25 rank; lower is better. 0 for session searches made only of terms shorter than 3 characters.
+    score: float
+
+
+class SearchPageOut(BaseModel):
+    items: list[SearchHitOut]
+    offset: int
+    limit: int
+    has_more: bool
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+from .models import Node
+
+_MASK = (1 << 64) - 1
+# Character shingles, so text without spaces between words (e.g. Chinese) works the same way.
+_SHINGLE = 3
+_BINS = 64
+_ROWS_PER_BAND = 4
+# Only the start of long bodies is sketched; duplicates already agree there.
+_MAX_CONTENT_CHARS = 2000
+
+Signature = tuple[int | None, ...]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def signature(text: str) -> Signature:
+    """One-permutation MinHash: each shingle is hashed once and kept only if smallest in its bin.
+
+    Far cheaper than k independent hash functions in pure Python; bins no shingle fell into stay
+    None and are ignored when comparing, so short texts (titles) still estimate well.
+    """
+    text = _normalize(text)
+    mins: list[int | None] = [None] * _BINS
+    if not text:
+        return tuple(mins)
+    for i in range(max(1, len(text) - _SHINGLE + 1)):
+        # The built-in string hash is fast and stable within a process, which is all the index needs.
+        h = hash(text[i : i + _SHINGLE]) & _MASK
+        b, v = h % _BINS, (h // _BINS) & _MASK
+        current = mins[b]
+        if current is None or v < current:
+            mins[b] = v
+    return tuple(mins)
+
+
+def similarity(a: Signature, b: Signature) -> float:
+    """Estimated Jaccard similarity of the two texts' shingle sets."""
+    both = same = 0
+    for x, y in zip(a, b):
+        if x is None and y is None:
+            continue
+        both += 1
+        if x == y:
+            same += 1
+    return same / both if both else 0.0
+
+
+def _bands(sig: Signature) -> list[tuple[int, Signature]]:
+    return [(i, sig[i : i + _ROWS_PER_BAND]) for i in range(0, _BINS, _ROWS_PER_BAND)]
+
+
+class _SketchTable:
+    """Signatures of one kind plus LSH band buckets, so a lookup only compares likely matches."""
+
+    def __init__(self) -> None:
+        self.sigs: dict[str, Signature] = {}
+        self.buckets: dict[tuple[int, Signature], set[str]] = {}
+
+    def add(self, node_id: str, sig: Signature) -> None:
+        self.remove(node_id)
+        self.sigs[node_id] = sig
+        for key in _bands(sig):
+            # An all-empty band says nothing about the text; bucketing it would match everything.
+            if any(v is not None for v in key[1]):
+                self.buckets.setdefault(key, set()).add(node_id)
+
+    def remove(self, node_id: str) -> None:
+        sig = self.sigs.pop(node_id, None)
+        if sig is None:
+            return
+        for key in _bands(sig):
+            ids = self.buckets.get(key)
+            if ids is not None:
+                ids.discard(node_id)
+                if not ids:
+                    del self.buckets[key]
+
+    def best(self, sig: Signature, exclude: str | None) -> tuple[str, float] | None:
+        candidates: set[str] = set()
+        for key in _bands(sig):
+            candidates.update(self.buckets.get(key, ()))
+        candidates.discard(exclude or "")
+        scored = [(nid, similarity(sig, self.sigs[nid])) for nid in candidates]
+        return max(scored, key=lambda item: item[1]) if scored else None
+
+
+class _SessionSketches:
+    def __init__(self) -> None:
+        self.revision: int | None = None
+        self.hashes: dict[str, str] = {}
+        self.titles = _SketchTable()
+        self.bodies = _SketchTable()
+
+    def add(self, node: Node) -> None:
+        digest = hashlib.sha256(f"{node.title}\n{node.content}".encode("utf-8")).hexdigest()
+        if self.hashes.get(node.id) == digest:
+            return
+        self.hashes[node.id] = digest
+        self.titles.add(node.id, signature(node.title))
+        self.bodies.add(node.id, signature(f"{node.title}\n{node.content[:_MAX_CONTENT_CHARS]}"))
+
+    def remove(self, node_id: str) -> None:
+        self.hashes.pop(node_id, None)
+        self.titles.remove(node_id)
+        self.bodies.remove(node_id)
+
+
+class NearDuplicateIndex:
+    """Per-session MinHash sketches of knowledge nodes, kept in step with the session graph.
+
+    Each lookup first syncs against the session revision: when it moved, only nodes whose text
+    changed are re-sketched, so repeated lookups during one answer stay cheap.
+    """
+
+    def __init__(self, max_sessions: int = 1024) -> None:
+        self.enabled = True
+        self.merge = False
+        self.title_threshold = 0.8
+        self.content_threshold = 0.6
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, _SessionSketches] = OrderedDict()
+
+    def configure(self, enabled: bool, title_threshold: float, content_threshold: float, merge: bool = False) -> None:
+        with self._lock:
+            self.enabled = enabled
+            self.merge = merge
+            self.title_threshold = title_threshold
+            self.content_threshold = content_threshold
+            self._sessions.clear()
+
+    def sync(self, session_id: str, revision: int | None, load: Callable[[], list[Node]]) -> None:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = _SessionSketches()
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(session_id)
+            if revision is not None and entry.revision == revision:
+                return
+            nodes = [n for n in load() if n.node_type == "knowledge"]
+            live = {n.id for n in nodes}
+            for node_id in [nid for nid in entry.hashes if nid not in live]:
+                entry.remove(node_id)
+            for node in nodes:
+                entry.add(node)
+            entry.revision = revision
+
+    def match_title(self, session_id: str, title: str) -> tuple[str, float] | None:
+        """The indexed node whose title is a near-duplicate of `title`, with its similarity."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            hit = entry.titles.best(signature(title), None) if entry is not None else None
+        return hit if hit is not None and hit[1] >= self.title_threshold else None
+
+    def match_node(self, session_id: str, node: Node) -> tuple[str, float] | None:
+        """Another indexed node whose title and content nearly duplicate `node`'s."""
+        sig = signature(f"{node.title}\n{node.content[:_MAX_CONTENT_CHARS]}")
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            hit = entry.bodies.best(sig, node.id) if entry is not None else None
+        return hit if hit is not None and hit[1] >= self.content_threshold else None
+
+    def add(self, session_id: str, node: Node) -> None:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry.add(node)
+
+    def remove(self, session_id: str, node_id: str) -> None:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry.remove(node_id)
+
+
+knowledge_index = NearDuplicateIndex()
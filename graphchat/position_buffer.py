@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import itertools
+import threading
+from typing import TYPE_CHECKING
+
+from .metrics import metrics
+from .models import Node
+
+if TYPE_CHECKING:
+    from .db import ConnectionPool
+
+
+class PositionBuffer:
+    """Write-behind buffer for node moves and resizes, keeping only the latest per node.
+
+    Drags fire many position updates per second; each is recorded in memory and a background
+    thread writes every session's pending moves in one transaction each `interval_seconds`
+    (sooner once `max_pending` nodes wait, and on shutdown). `Repository` reads overlay pending
+    moves so a user always sees their own changes. Moves still buffered when the process dies
+    are lost, which only ever costs the last fraction of a second of dragging.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.interval_seconds = 0.5
+        self.max_pending = 10000
+        self._pool: ConnectionPool | None = None
+        self._lock = threading.Lock()
+        # session id -> node id -> fields, for pending and in-flight (being flushed) moves.
+        self._pending: dict[str, dict[str, dict[str, float]]] = {}
+        self._flushing: dict[str, dict[str, dict[str, float]]] = {}
+        self._pending_count = 0
+        # Bumped on every buffered move so graph ETags change before the flush bumps the revision.
+        self._seq = itertools.count(1)
+        self._session_seq: dict[str, int] = {}
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def start(self, pool: ConnectionPool, interval_seconds: float, max_pending: int) -> None:
+        self.stop()
+        self._pool = pool
+        self.interval_seconds = interval_seconds
+        self.max_pending = max_pending
+        self._stopping = False
+        self.enabled = True
+        self._thread = threading.Thread(target=self._loop, name="graphchat-positions", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flush thread after writing everything still pending."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping = True
+            self._wake.set()
+            thread.join()
+        self.enabled = False
+
+    def put(self, session_id: str, node_id: str, x: float, y: float, width: float | None = None) -> None:
+        fields = {"x": x, "y": y}
+        if width is not None:
+            fields["width"] = width
+        with self._lock:
+            nodes = self._pending.setdefault(session_id, {})
+            previous = nodes.get(node_id)
+            if previous is None:
+                nodes[node_id] = fields
+                self._pending_count += 1
+            else:
+                # A later move without a width keeps the width of an earlier, unflushed resize.
+                previous.update(fields)
+                metrics.incr("positions.coalesced")
+            self._session_seq[session_id] = next(self._seq)
+            full = self._pending_count >= self.max_pending
+        metrics.incr("positions.buffered")
+        if full:
+            self._wake.set()
+
+    def pending_seq(self, session_id: str) -> int | None:
+        """Changes whenever a move of the session is buffered; None once all of them are written."""
+        with self._lock:
+            if session_id not in self._pending and session_id not in self._flushing:
+                return None
+            return self._session_seq.get(session_id)
+
+    def overlay(self, session_id: str, nodes: list[Node]) -> list[Node]:
+        """`nodes` with buffered moves applied; the models are replaced, never modified."""
+        with self._lock:
+            moves = {**self._flushing.get(session_id, {}), **self._pending.get(session_id, {})}
+        if not moves:
+            return nodes
+        return [n.model_copy(update=moves[n.id]) if n.id in moves else n for n in nodes]
+
+    def flush(self) -> None:
+        from .repository import Repository
+
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._pending_count = 0
+            self._flushing = batch
+        pool = self._pool
+        if not batch or pool is None:
+            with self._lock:
+                self._flushing = {}
+            return
+        failed: dict[str, dict[str, dict[str, float]]] = {}
+        conn = pool.acquire()
+        try:
+            repo = Repository(conn, pool.shards)
+            for session_id, moves in batch.items():
+                try:
+                    repo.update_node_positions(session_id, moves)
+                    metrics.incr("positions.flushed", len(moves))
+                except Exception as exc:  # noqa: BLE001
+                    failed[session_id] = moves
+                    metrics.incr("positions.flush_failed")
+                    print(f"[DEBUG] position flush failed: session_id={session_id}, error={exc}")
+        finally:
+            pool.release(conn)
+            with self._lock:
+                # Failed moves are retried next time unless a newer move replaced them meanwhile.
+                for session_id, moves in failed.items():
+                    nodes = self._pending.setdefault(session_id, {})
+                    for node_id, fields in moves.items():
+                        if node_id not in nodes:
+                            nodes[node_id] = fields
+                            self._pending_count += 1
+                self._flushing = {}
+                for session_id in batch:
+                    if session_id not in self._pending:
+                        self._session_seq.pop(session_id, None)
+
+    def _loop(self) -> None:
+        while True:
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            self.flush()
+            if self._stopping:
+                return
+
+
+position_buffer = PositionBuffer()
+
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import cProfile
+import functools
+import inspect
+import itertools
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, TypeVar
+
+import anyio
+from fastapi.routing import APIRoute
+
+from .config import ProfilingConfig
+from .metrics import metrics
+
+T = TypeVar("T")
+
+_current: ContextVar[RequestProfile | None] = ContextVar("graphchat_profile", default=None)
+_UNSAFE = re.compile(r"[^A-Za-z0-9]+")
+_seq = itertools.count(1)
+
+
+class RequestProfile:
+    """cProfile data for one request, gathered on every thread that works on it.
+
+    cProfile only sees the thread it is enabled on, and a request's handler and each step of
+    its streaming body may run on different thread-pool threads, so each thread gets its own
+    profiler and the results are merged when the request ends.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._profilers: dict[int, cProfile.Profile] = {}
+        self._active: set[int] = set()
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """Profile the current thread for the duration of the block (nested blocks are no-ops)."""
+        ident = threading.get_ident()
+        with self._lock:
+            if ident in self._active:
+                profiler = None
+            else:
+                profiler = self._profilers.setdefault(ident, cProfile.Profile())
+                self._active.add(ident)
+        if profiler is None:
+            yield
+            return
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                self._active.discard(ident)
+
+    def stats(self) -> pstats.Stats | None:
+        with self._lock:
+            profilers = list(self._profilers.values())
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def _profiled(endpoint: Callable[..., Any]) -> Callable[..., Any]:
+    if inspect.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        profile = _current.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        with profile.thread():
+            return endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose endpoint runs under the current request's profile, if it has one."""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def follow(iterator: Iterable[T]) -> Iterator[T]:
+    """Iterate `iterator`, profiling each step under the current request's profile, if any.
+
+    Wrap streaming response bodies in this so a profile covers the whole stream, not just the
+    handler that created it; the steps run on whichever thread-pool thread serves them.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield from iterator
+        return
+    it = iter(iterator)
+    try:
+        while True:
+            with profile.thread():
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            close()
+
+
+def _write(stats: pstats.Stats, config: ProfilingConfig, method: str, route: str, elapsed_ms: float) -> Path:
+    directory = Path(config.dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = _UNSAFE.sub("_", route).strip("_") or "root"
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    path = directory / f"{stamp}_{method}_{slug}_{elapsed_ms:.0f}ms_{os.getpid()}-{next(_seq)}.prof"
+    tmp = path.with_suffix(".tmp")
+    stats.dump_stats(str(tmp))
+    os.replace(tmp, path)
+    _prune(directory, config.max_files, config.max_bytes)
+    return path
+
+
+def _prune(directory: Path, max_files: int, max_bytes: int) -> None:
+    """Delete the oldest profiles until at most `max_files` files and `max_bytes` bytes remain."""
+    entries: list[tuple[float, int, Path]] = []
+    for path in directory.glob("*.prof"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    count = len(entries)
+    for _, size, path in entries:
+        if count <= max_files and total <= max_bytes:
+            break
+        # Another worker sharing the directory may have pruned it first.
+        path.unlink(missing_ok=True)
+        metrics.incr("profiling.pruned")
+        count -= 1
+        total -= size
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles opted-in requests and writes one .prof file per request.
+
+    A request is profiled when it carries `config.header` (any value but "0") or is picked with
+    probability `config.sample_rate`. The profile and the latency in the filename cover the
+    request until its last body chunk is sent, so streamed answers are measured in full.
+    Load a file with `python -m pstats FILE` or a viewer such as snakeviz.
+    """
+
+    def __init__(self, app: Callable[..., Any], config: ProfilingConfig) -> None:
+        self.app = app
+        self.config = config
+        self._header = config.header.lower().encode("latin-1")
+
+    def _wanted(self, scope: Mapping[str, Any]) -> bool:
+        for name, value in scope.get("headers", ()):
+            if name == self._header:
+                return value.strip() != b"0"
+        return self.config.sample_rate > 0 and random.random() < self.config.sample_rate
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("path", "")
+            await self._save(profile, scope.get("method", "GET"), path, elapsed_ms)
+
+    async def _save(self, profile: RequestProfile, method: str, route: str, elapsed_ms: float) -> None:
+        stats = profile.stats()
+        if stats is None:
+            return
+        try:
+            await anyio.to_thread.run_sync(_write, stats, self.config, method, route, elapsed_ms)
+        except OSError as exc:
+            metrics.incr("profiling.failed")
+            print(f"[DEBUG] profile write failed: route={route}, error={exc}")
+            return
+        metrics.incr("profiling.profiles")
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any
+
+
+class Subscription:
+    def __init__(self, session_id: str, loop: asyncio.AbstractEventLoop, maxsize: int) -> None:
+        self.session_id = session_id
+        self.loop = loop
+        self.queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize=maxsize)
+        # Set when deltas were dropped; the subscriber should refetch the full graph.
+        self.overflowed = False
+
+    def _offer(self, delta: dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    """In-process per-session pub/sub; publishers may run on any thread, subscribers are asyncio.
+
+    Deltas only reach subscribers in the same worker process.
+    """
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._subs: dict[str, set[Subscription]] = {}
+
+    def subscribe(self, session_id: str) -> Subscription:
+        sub = Subscription(session_id, asyncio.get_running_loop(), self.maxsize)
+        with self._lock:
+            self._subs.setdefault(session_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.session_id)
+            if subs is None:
+                return
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.session_id]
+
+    def has_subscribers(self, session_id: str) -> bool:
+        return session_id in self._subs
+
+    def publish(self, session_id: str, delta: dict[str, Any]) -> None:
+        with self._lock:
+            subs = list(self._subs.get(session_id, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, delta)
+            except RuntimeError:
+                # The subscriber's event loop has shut down.
+                self.unsubscribe(sub)
+
+
+broker = Broker()
@@ -1,39 +1,204 @@
 from __future__ import annotations
 
+import hashlib
+import heapq
 import sqlite3
 import uuid
-from datetime import datetime, timezone
+from collections.abc import Iterable
+from datetime import datetime, timedelta, timezone
+from typing import Any
 
-from .models import Edge, Node, SessionOut
+from .archive import archive_session, restore_session
+from .db import ShardRouter, has_search
+from .graph_cache import CachedGraph, graph_cache
+from .models import Edge, Node, SessionOut, SuggestionOut
+from .position_buffer import position_buffer
+from .pubsub import broker
 
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def node_content_hash(node: Node) -> str:
+    return hashlib.sha256(f"{node.title}\n{node.content}".encode("utf-8")).hexdigest()
+
+
+# Fixed stand-ins for bm25's per-index average column lengths, in characters.
+_SCORE_TITLE_CHARS = 24
+_SCORE_CONTENT_CHARS = 800
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def text_score(title: str, content: str, terms: list[str]) -> float:
+    """bm25-like score (lower is better) computed from the node's own text only.
+
+    FTS5's bm25 depends on its index's document count and average lengths, so scores from two
+    shard files do not compare. This keeps bm25's saturating term frequency, length
+    normalization (against fixed reference lengths) and 10:1 title weight, without the
+    corpus-dependent IDF, so it ranks nodes from any file on one scale.
+    """
+    total = 0.0
+    for text, reference, weight in ((title, _SCORE_TITLE_CHARS, 10.0), (content, _SCORE_CONTENT_CHARS, 1.0)):
+        folded = text.lower()
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(text) / reference)
+        for term in terms:
+            tf = folded.count(term.lower())
+            total += weight * tf * (_BM25_K1 + 1) / (tf + norm)
+    return -total
+
+
 class Repository:
-    def __init__(self, conn: sqlite3.Connection) -> None:
+    """Reads and writes over one catalog connection, plus per-session shards when `shards` is set."""
+
+    def __init__(self, conn: sqlite3.Connection, shards: ShardRouter | None = None) -> None:
         self.conn = conn
+        self.shards = shards
+        # Sessions already checked for (and restored from) the archive by this repository.
+        self._restored: set[str] = set()
+
+    def _db(self, session_id: str) -> sqlite3.Connection:
+        """Connection to the file holding the session's rows: its shard, or `conn` when unsharded.
+
+        An archived session is restored here on first access, so no caller sees the cold tier.
+        """
+        if self.shards is None:
+            conn = self.conn
+        else:
+            conn = self.shards.connection(session_id)
+            if conn.in_transaction:
+                # Left open by a call that raised; pooled connections get the same on release.
+                conn.rollback()
+        if session_id not in self._restored:
+            self._restored.add(session_id)
+            restore_session(conn, session_id)
+        return conn
+
+    def _all_dbs(self) -> list[sqlite3.Connection]:
+        if self.shards is None:
+            return [self.conn]
+        conns = [self.shards.shard_connection(i) for i in range(self.shards.count)]
+        for conn in conns:
+            if conn.in_transaction:
+                conn.rollback()
+        return conns
+
+    @staticmethod
+    def _bump_revision(conn: sqlite3.Connection, session_id: str) -> int:
+        # Runs inside the write's transaction, so readers never see new data with an old revision.
+        row = conn.execute(
+            "UPDATE sessions SET revision = revision + 1, active_at = ? WHERE id = ? RETURNING revision",
+            (_now_iso(), session_id),
+        ).fetchone()
+        return int(row["revision"]) if row is not None else 0
+
+    @staticmethod
+    def _publish(session_id: str, revision: int, delta: dict[str, Any]) -> None:
+        # Called only after commit so subscribers never see a change that could still roll back.
+        if broker.has_subscribers(session_id):
+            broker.publish(session_id, {**delta, "session_id": session_id, "revision": revision})
+
+    def _graph(self, session_id: str) -> CachedGraph | None:
+        """The session's live graph from the shared cache, loading it on a miss; None if disabled."""
+        if not graph_cache.enabled:
+            return None
+        entry = graph_cache.get(session_id)
+        if entry is not None and graph_cache.verify:
+            # Other workers write to the same DB; one indexed lookup tells if the entry is current.
+            if self._read_revision(self._db(session_id), session_id) != entry.revision:
+                graph_cache.invalidate(session_id)
+                entry = None
+        if entry is not None:
+            return entry
+        conn = self._db(session_id)
+        own_txn = not conn.in_transaction
+        if own_txn:
+            # One read snapshot, so the revision matches the rows loaded with it.
+            conn.execute("BEGIN")
+        try:
+            revision = self._read_revision(conn, session_id)
+            if revision is None:
+                return None
+            entry = CachedGraph(revision, self._query_nodes(conn, session_id), self._query_edges(conn, session_id))
+        finally:
+            if own_txn:
+                conn.commit()
+        graph_cache.put(session_id, entry)
+        return entry
+
+    @staticmethod
+    def _read_revision(conn: sqlite3.Connection, session_id: str) -> int | None:
+        row = conn.execute("SELECT revision FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return int(row["revision"]) if row is not None else None
+
+    def get_session_revision(self, session_id: str) -> int | None:
+        if graph_cache.enabled and not graph_cache.verify:
+            cached = graph_cache.peek_revision(session_id)
+            if cached is not None:
+                return cached
+        return self._read_revision(self._db(session_id), session_id)
+
+    def graph_counts(self, session_id: str) -> tuple[int, int]:
+        entry = self._graph(session_id)
+        if entry is not None:
+            return len(entry.nodes), len(entry.edges)
+        conn = self._db(session_id)
+        return len(self._query_nodes(conn, session_id)), len(self._query_edges(conn, session_id))
+
+    def sessions_fingerprint(self) -> tuple[int, str]:
+        row = self.conn.execute("SELECT COUNT(*) AS n, COALESCE(MAX(created_at), '') AS latest FROM sessions").fetchone()
+        return int(row["n"]), str(row["latest"])
 
     def create_session(self, topic: str) -> SessionOut:
         sid = str(uuid.uuid4())
         created_at = _now_iso()
+        if self.shards is not None:
+            # Shard row first: a catalog entry is then never listed without its session.
+            conn = self._db(sid)
+            conn.execute(
+                "INSERT INTO sessions(id, topic, created_at, active_at) VALUES(?, ?, ?, ?)",
+                (sid, topic, created_at, created_at),
+            )
+            conn.commit()
         self.conn.execute(
-            "INSERT INTO sessions(id, topic, created_at) VALUES(?, ?, ?)",
-            (sid, topic, created_at),
+            "INSERT INTO sessions(id, topic, created_at, active_at) VALUES(?, ?, ?, ?)",
+            (sid, topic, created_at, created_at),
         )
         self.conn.commit()
+        if graph_cache.enabled:
+            graph_cache.put(sid, CachedGraph(0, [], []))
         return SessionOut(id=sid, topic=topic, created_at=created_at)
 
+    def get_session(self, session_id: str) -> SessionOut | None:
+        row = self.conn.execute("SELECT id, topic, created_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return SessionOut(**dict(row)) if row is not None else None
+
     def list_sessions(self, limit: int = 50) -> list[SessionOut]:
         rows = self.conn.execute(
-            "SELECT * FROM sessions ORDER BY created_at DESC LIMIT ?",
+            "SELECT id, topic, created_at FROM sessions ORDER BY created_at DESC LIMIT ?",
             (limit,),
         ).fetchall()
         return [SessionOut(**dict(r)) for r in rows]
 
     def list_nodes(self, session_id: str) -> list[Node]:
-        rows = self.conn.execute(
+        entry = self._graph(session_id)
+        if entry is not None:
+            # Copies, so callers can never modify the shared cached models.
+            nodes = [n.model_copy() for n in entry.nodes.values()]
+        else:
+            nodes = self._query_nodes(self._db(session_id), session_id)
+        return position_buffer.overlay(session_id, nodes) if position_buffer.enabled else nodes
+
+    def list_edges(self, session_id: str) -> list[Edge]:
+        entry = self._graph(session_id)
+        if entry is not None:
+            return [e.model_copy() for e in entry.edges]
+        return self._query_edges(self._db(session_id), session_id)
+
+    @staticmethod
+    def _query_nodes(conn: sqlite3.Connection, session_id: str) -> list[Node]:
+        rows = conn.execute(
             "SELECT * FROM nodes WHERE session_id = ? AND deleted_at IS NULL ORDER BY created_at ASC", (session_id,)
         ).fetchall()
         out: list[Node] = []
@@ -44,8 +209,9 @@ class Repository:
             out.append(Node(**data))
         return out
 
-    def list_edges(self, session_id: str) -> list[Edge]:
-        rows = self.conn.execute(
+    @staticmethod
+    def _query_edges(conn: sqlite3.Connection, session_id: str) -> list[Edge]:
+        rows = conn.execute(
             """
             SELECT e.*
             FROM edges e
@@ -70,10 +236,11 @@ class Repository:
         width: float,
         node_type: str,
     ) -> Node:
+        conn = self._db(session_id)
         nid = str(uuid.uuid4())
         created_at = _now_iso()
         try:
-            self.conn.execute(
+            conn.execute(
                 """
                 INSERT INTO nodes(id, session_id, title, content, x, y, width, node_type, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -82,15 +249,16 @@ class Repository:
             )
         except sqlite3.Error:
             # Backward compatibility for older DB schema that still requires mastery/importance.
-            self.conn.execute(
+            conn.execute(
                 """
                 INSERT INTO nodes(id, session_id, title, content, mastery, importance, x, y, width, node_type, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (nid, session_id, title, content, 0.0, 0.0, x, y, width, node_type, created_at),
             )
-        self.conn.commit()
-        return Node(
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+        node = Node(
             id=nid,
             session_id=session_id,
             title=title,
@@ -101,6 +269,9 @@ class Repository:
             node_type=node_type,  # type: ignore[arg-type]
             created_at=created_at,
         )
+        graph_cache.apply(session_id, revision, lambda g: g.add_node(node.model_copy()))
+        self._publish(session_id, revision, {"type": "node_created", "node": node.model_dump()})
+        return node
 
     def create_edge(
         self,
@@ -110,10 +281,11 @@ class Repository:
         source_section_key: str | None,
         edge_type: str,
     ) -> Edge:
+        conn = self._db(session_id)
         eid = str(uuid.uuid4())
         created_at = _now_iso()
         try:
-            self.conn.execute(
+            conn.execute(
                 """
                 INSERT INTO edges(id, session_id, source_node_id, target_node_id, source_section_key, edge_type, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -122,7 +294,7 @@ class Repository:
             )
         except sqlite3.Error:
             # Backward compatibility for older DB schema that still requires question/strength.
-            self.conn.execute(
+            conn.execute(
                 """
                 INSERT INTO edges(id, session_id, source_node_id, target_node_id, question, source_section_key, strength, edge_type, created_at)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -139,8 +311,9 @@ class Repository:
                     created_at,
                 ),
             )
-        self.conn.commit()
-        return Edge(
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+        edge = Edge(
             id=eid,
             session_id=session_id,
             source_node_id=source_node_id,
@@ -149,67 +322,724 @@ class Repository:
             edge_type=edge_type,  # type: ignore[arg-type]
             created_at=created_at,
         )
+        graph_cache.apply(session_id, revision, lambda g: g.add_edge(edge.model_copy()))
+        self._publish(session_id, revision, {"type": "edge_created", "edge": edge.model_dump()})
+        return edge
 
-    def get_nodes_by_ids(self, session_id: str, node_ids: list[str]) -> list[Node]:
+    def walk_nodes(
+        self, session_id: str, node_ids: list[str], direction: str, max_depth: int
+    ) -> list[tuple[Node, int]]:
+        """Nodes reachable from `node_ids` against ("ancestors") or along ("descendants") edges.
+
+        Each node comes with its shortest distance; the start nodes themselves are left out.
+        """
         if not node_ids:
             return []
+        conn = self._db(session_id)
+        step_from, step_to = (
+            ("target_node_id", "source_node_id") if direction == "ancestors" else ("source_node_id", "target_node_id")
+        )
         placeholders = ",".join("?" for _ in node_ids)
-        rows = self.conn.execute(
-            f"SELECT * FROM nodes WHERE session_id = ? AND deleted_at IS NULL AND id IN ({placeholders})",
-            (session_id, *node_ids),
+        rows = conn.execute(
+            f"""
+            WITH RECURSIVE walk(node_id, depth) AS (
+              SELECT id, 0 FROM nodes
+              WHERE session_id = ? AND deleted_at IS NULL AND id IN ({placeholders})
+              UNION
+              SELECT e.{step_to}, w.depth + 1
+              FROM walk w
+              JOIN edges e ON e.session_id = ? AND e.{step_from} = w.node_id
+              JOIN nodes n ON n.id = e.{step_to} AND n.deleted_at IS NULL
+              WHERE w.depth < ?
+            )
+            SELECT n.*, MIN(w.depth) AS walk_depth
+            FROM walk w JOIN nodes n ON n.id = w.node_id
+            WHERE w.depth > 0 AND n.id NOT IN ({placeholders})
+            GROUP BY n.id
+            ORDER BY walk_depth ASC, n.created_at ASC
+            """,
+            (session_id, *node_ids, session_id, max_depth, *node_ids),
         ).fetchall()
-        out: list[Node] = []
+        out: list[tuple[Node, int]] = []
         for r in rows:
             data = dict(r)
+            depth = int(data.pop("walk_depth"))
             if data.get("width") is None or float(data.get("width", 0) or 0) <= 0:
                 data["width"] = 400.0
-            out.append(Node(**data))
+            out.append((Node(**data), depth))
         return out
 
+    def component_node_ids(self, session_id: str, node_id: str) -> list[str]:
+        """Ids of every live node connected to `node_id`, ignoring edge direction."""
+        conn = self._db(session_id)
+        rows = conn.execute(
+            """
+            WITH RECURSIVE comp(node_id) AS (
+              SELECT id FROM nodes WHERE session_id = ? AND id = ? AND deleted_at IS NULL
+              UNION
+              SELECT CASE WHEN e.source_node_id = c.node_id THEN e.target_node_id ELSE e.source_node_id END
+              FROM comp c
+              JOIN edges e ON e.session_id = ? AND (e.source_node_id = c.node_id OR e.target_node_id = c.node_id)
+              JOIN nodes n
+                ON n.id = CASE WHEN e.source_node_id = c.node_id THEN e.target_node_id ELSE e.source_node_id END
+               AND n.deleted_at IS NULL
+            )
+            SELECT node_id FROM comp
+            """,
+            (session_id, node_id, session_id),
+        ).fetchall()
+        return [str(r["node_id"]) for r in rows]
+
+    def list_edge_pairs(self, session_id: str) -> list[tuple[str, str]]:
+        """`(source, target)` of every edge between live nodes; cheaper than `list_edges` for walks."""
+        entry = self._graph(session_id)
+        if entry is not None:
+            return [(e.source_node_id, e.target_node_id) for e in entry.edges]
+        conn = self._db(session_id)
+        rows = conn.execute(
+            """
+            SELECT e.source_node_id, e.target_node_id
+            FROM edges e
+            JOIN nodes src ON src.id = e.source_node_id
+            JOIN nodes dst ON dst.id = e.target_node_id
+            WHERE e.session_id = ?
+              AND src.deleted_at IS NULL
+              AND dst.deleted_at IS NULL
+            """,
+            (session_id,),
+        ).fetchall()
+        return [(str(r[0]), str(r[1])) for r in rows]
+
+    def get_nodes_by_ids(self, session_id: str, node_ids: list[str]) -> list[Node]:
+        if not node_ids:
+            return []
+        entry = self._graph(session_id)
+        if entry is not None:
+            out = [entry.nodes[nid].model_copy() for nid in dict.fromkeys(node_ids) if nid in entry.nodes]
+        else:
+            placeholders = ",".join("?" for _ in node_ids)
+            rows = (
+                self._db(session_id)
+                .execute(
+                    f"SELECT * FROM nodes WHERE session_id = ? AND deleted_at IS NULL AND id IN ({placeholders})",
+                    (session_id, *node_ids),
+                )
+                .fetchall()
+            )
+            out = []
+            for r in rows:
+                data = dict(r)
+                if data.get("width") is None or float(data.get("width", 0) or 0) <= 0:
+                    data["width"] = 400.0
+                out.append(Node(**data))
+        return position_buffer.overlay(session_id, out) if position_buffer.enabled else out
+
     def update_node_position(self, session_id: str, node_id: str, x: float, y: float, width: float | None = None) -> None:
+        conn = self._db(session_id)
         if width is None:
-            self.conn.execute(
+            conn.execute(
                 "UPDATE nodes SET x = ?, y = ? WHERE session_id = ? AND id = ? AND deleted_at IS NULL",
                 (x, y, session_id, node_id),
             )
         else:
-            self.conn.execute(
+            conn.execute(
                 "UPDATE nodes SET x = ?, y = ?, width = ? WHERE session_id = ? AND id = ? AND deleted_at IS NULL",
                 (x, y, width, session_id, node_id),
             )
-        self.conn.commit()
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+        delta: dict[str, Any] = {"type": "node_position", "node_id": node_id, "x": x, "y": y}
+        if width is not None:
+            delta["width"] = width
+        fields = {k: v for k, v in delta.items() if k in ("x", "y", "width")}
+        graph_cache.apply(session_id, revision, lambda g: g.update_node(node_id, **fields))
+        self._publish(session_id, revision, delta)
+
+    def update_node_positions(self, session_id: str, moves: dict[str, dict[str, float]]) -> None:
+        """Apply many `{node_id: {x, y[, width]}}` moves as one write with one revision."""
+        if not moves:
+            return
+        conn = self._db(session_id)
+        conn.executemany(
+            """
+            UPDATE nodes SET x = :x, y = :y, width = COALESCE(:width, width)
+            WHERE session_id = :session_id AND id = :node_id AND deleted_at IS NULL
+            """,
+            [
+                {"session_id": session_id, "node_id": node_id, "width": fields.get("width"), **fields}
+                for node_id, fields in moves.items()
+            ],
+        )
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+
+        def change(g: CachedGraph) -> None:
+            for node_id, fields in moves.items():
+                g.update_node(node_id, **fields)
+
+        graph_cache.apply(session_id, revision, change)
+        self._publish(
+            session_id,
+            revision,
+            {"type": "node_positions", "positions": [{"node_id": nid, **fields} for nid, fields in moves.items()]},
+        )
 
     def update_node_content(self, session_id: str, node_id: str, title: str, content: str) -> None:
-        self.conn.execute(
+        conn = self._db(session_id)
+        conn.execute(
             "UPDATE nodes SET title = ?, content = ? WHERE session_id = ? AND id = ? AND deleted_at IS NULL",
             (title, content, session_id, node_id),
         )
-        self.conn.commit()
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+        graph_cache.apply(session_id, revision, lambda g: g.update_node(node_id, title=title, content=content))
+        self._publish(
+            session_id, revision, {"type": "node_content", "node_id": node_id, "title": title, "content": content}
+        )
 
     def soft_delete_node(self, session_id: str, node_id: str) -> None:
-        self.conn.execute(
+        conn = self._db(session_id)
+        conn.execute(
             "UPDATE nodes SET deleted_at = ? WHERE session_id = ? AND id = ? AND deleted_at IS NULL",
             (_now_iso(), session_id, node_id),
         )
-        self.conn.commit()
+        # Deleted nodes leave the review queue, so due scans never have to skip over them.
+        conn.execute("DELETE FROM review_states WHERE node_id = ?", (node_id,))
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+        graph_cache.apply(session_id, revision, lambda g: g.remove_node(node_id))
+        self._publish(session_id, revision, {"type": "node_deleted", "node_id": node_id})
 
-    def add_material(self, session_id: str, filename: str, mime_type: str, content_text: str) -> str:
+    def discard_graph_items(self, session_id: str, node_ids: list[str], edge_ids: list[str]) -> None:
+        """Soft-delete `node_ids` and delete `edge_ids` in one write, e.g. to undo a failed answer."""
+        conn = self._db(session_id)
+        deleted_at = _now_iso()
+        conn.executemany(
+            "UPDATE nodes SET deleted_at = ? WHERE session_id = ? AND id = ? AND deleted_at IS NULL",
+            [(deleted_at, session_id, node_id) for node_id in node_ids],
+        )
+        conn.executemany("DELETE FROM review_states WHERE node_id = ?", [(node_id,) for node_id in node_ids])
+        conn.executemany(
+            "DELETE FROM edges WHERE session_id = ? AND id = ?", [(session_id, edge_id) for edge_id in edge_ids]
+        )
+        revision = self._bump_revision(conn, session_id)
+        conn.commit()
+
+        def change(g: CachedGraph) -> None:
+            for edge_id in edge_ids:
+                g.remove_edge(edge_id)
+            for node_id in node_ids:
+                g.remove_node(node_id)
+
+        graph_cache.apply(session_id, revision, change)
+        for edge_id in edge_ids:
+            self._publish(session_id, revision, {"type": "edge_deleted", "edge_id": edge_id})
+        for node_id in node_ids:
+            self._publish(session_id, revision, {"type": "node_deleted", "node_id": node_id})
+
+    def link_material(self, session_id: str, filename: str, mime_type: str, content_hash: str) -> str | None:
+        """Attach an already stored body to a session; returns None if the hash is unknown."""
+        conn = self._db(session_id)
+        cur = conn.execute(
+            "UPDATE material_blobs SET ref_count = ref_count + 1 WHERE content_hash = ?",
+            (content_hash,),
+        )
+        if not cur.rowcount:
+            conn.rollback()
+            return None
+        mid = self._insert_material(conn, session_id, filename, mime_type, content_hash)
+        conn.commit()
+        return mid
+
+    def add_material(
+        self,
+        session_id: str,
+        filename: str,
+        mime_type: str,
+        content_hash: str,
+        size_bytes: int,
+        chunks: Iterable[str],
+    ) -> str:
+        """Store a body as ordered chunks under its hash; nothing is kept if `chunks` raises."""
+        conn = self._db(session_id)
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO material_blobs(content_hash, size_bytes, ref_count, created_at) VALUES (?, ?, 1, ?)",
+                (content_hash, size_bytes, _now_iso()),
+            )
+            if cur.rowcount:
+                for seq, text in enumerate(chunks):
+                    conn.execute(
+                        "INSERT INTO material_blob_chunks(content_hash, seq, content_text) VALUES (?, ?, ?)",
+                        (content_hash, seq, text),
+                    )
+            else:
+                # A concurrent upload stored the same body first.
+                conn.execute(
+                    "UPDATE material_blobs SET ref_count = ref_count + 1 WHERE content_hash = ?",
+                    (content_hash,),
+                )
+            mid = self._insert_material(conn, session_id, filename, mime_type, content_hash)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return mid
+
+    @staticmethod
+    def _insert_material(
+        conn: sqlite3.Connection, session_id: str, filename: str, mime_type: str, content_hash: str
+    ) -> str:
         mid = str(uuid.uuid4())
-        created_at = _now_iso()
-        self.conn.execute(
-            "INSERT INTO materials(id, session_id, filename, mime_type, content_text, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (mid, session_id, filename, mime_type, content_text, created_at),
+        conn.execute(
+            """
+            INSERT INTO materials(id, session_id, filename, mime_type, content_text, content_hash, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (mid, session_id, filename, mime_type, "", content_hash, _now_iso()),
         )
-        self.conn.commit()
         return mid
 
+    def delete_material(self, session_id: str, material_id: str) -> bool:
+        conn = self._db(session_id)
+        row = conn.execute(
+            "SELECT content_hash FROM materials WHERE session_id = ? AND id = ?",
+            (session_id, material_id),
+        ).fetchone()
+        if row is None:
+            return False
+        content_hash = row["content_hash"]
+        conn.execute("DELETE FROM materials WHERE id = ?", (material_id,))
+        conn.execute(
+            "UPDATE material_blobs SET ref_count = ref_count - 1 WHERE content_hash = ?",
+            (content_hash,),
+        )
+        orphan = conn.execute(
+            "SELECT 1 FROM material_blobs WHERE content_hash = ? AND ref_count <= 0",
+            (content_hash,),
+        ).fetchone()
+        if orphan is not None:
+            conn.execute("DELETE FROM material_blob_chunks WHERE content_hash = ?", (content_hash,))
+            conn.execute("DELETE FROM material_blobs WHERE content_hash = ?", (content_hash,))
+        conn.commit()
+        return True
+
     def get_material_context(self, session_id: str, max_chars: int = 4000) -> str:
-        rows = self.conn.execute(
-            "SELECT filename, content_text FROM materials WHERE session_id = ? ORDER BY created_at DESC LIMIT 5",
+        conn = self._db(session_id)
+        materials = conn.execute(
+            "SELECT filename, content_hash FROM materials WHERE session_id = ? ORDER BY created_at DESC LIMIT 5",
             (session_id,),
         ).fetchall()
         pieces: list[str] = []
+        remaining = max_chars
+        for m in materials:
+            if remaining <= 0:
+                break
+            header = f"[{m['filename']}]\n"
+            if pieces:
+                header = "\n\n" + header
+            pieces.append(header[:remaining])
+            remaining -= len(header)
+            # The cursor is consumed lazily, so only the leading chunks are read.
+            for r in conn.execute(
+                "SELECT content_text FROM material_blob_chunks WHERE content_hash = ? ORDER BY seq ASC",
+                (m["content_hash"],),
+            ):
+                if remaining <= 0:
+                    break
+                text = r["content_text"][:remaining]
+                pieces.append(text)
+                remaining -= len(text)
+        return "".join(pieces)
+
+    def replace_suggestions(self, session_id: str, source_node_id: str, questions: list[str]) -> list[SuggestionOut]:
+        """Drop the session's previous suggestions; only follow-ups to the latest answer are kept."""
+        conn = self._db(session_id)
+        created_at = _now_iso()
+        out: list[SuggestionOut] = []
+        conn.execute("DELETE FROM prefetch_suggestions WHERE session_id = ?", (session_id,))
+        for rank, question in enumerate(questions):
+            sid = str(uuid.uuid4())
+            conn.execute(
+                """
+                INSERT INTO prefetch_suggestions(id, session_id, source_node_id, question, rank, answer_text, created_at)
+                VALUES (?, ?, ?, ?, ?, NULL, ?)
+                """,
+                (sid, session_id, source_node_id, question, rank, created_at),
+            )
+            out.append(
+                SuggestionOut(id=sid, source_node_id=source_node_id, question=question, rank=rank, prefetched=False)
+            )
+        conn.commit()
+        return out
+
+    def set_suggestion_answer(
+        self, session_id: str, suggestion_id: str, answer_text: str, source_content_hash: str
+    ) -> None:
+        conn = self._db(session_id)
+        conn.execute(
+            "UPDATE prefetch_suggestions SET answer_text = ?, source_content_hash = ? WHERE id = ?",
+            (answer_text, source_content_hash, suggestion_id),
+        )
+        conn.commit()
+
+    def list_suggestions(self, session_id: str) -> list[SuggestionOut]:
+        conn = self._db(session_id)
+        rows = conn.execute(
+            """
+            SELECT id, source_node_id, question, rank, answer_text IS NOT NULL AS prefetched
+            FROM prefetch_suggestions
+            WHERE session_id = ?
+            ORDER BY rank ASC
+            """,
+            (session_id,),
+        ).fetchall()
+        return [SuggestionOut(**dict(r)) for r in rows]
+
+    def take_prefetched_answer(self, session_id: str, question: str, node_ids: list[str]) -> str | None:
+        """Consume a pre-generated answer for `question` asked about exactly its source node.
+
+        The answer was generated with that node as its only context, so it is served only for the
+        same selection and while the node's title and content are unchanged since.
+        """
+        if len(node_ids) != 1:
+            return None
+        conn = self._db(session_id)
+        row = conn.execute(
+            """
+            SELECT id, answer_text, source_content_hash
+            FROM prefetch_suggestions
+            WHERE session_id = ? AND question = ? AND source_node_id = ? AND answer_text IS NOT NULL
+            """,
+            (session_id, question, node_ids[0]),
+        ).fetchone()
+        if row is None:
+            return None
+        source = self.get_nodes_by_ids(session_id, node_ids)
+        if not source or row["source_content_hash"] != node_content_hash(source[0]):
+            return None
+        conn.execute("DELETE FROM prefetch_suggestions WHERE id = ?", (row["id"],))
+        conn.commit()
+        return str(row["answer_text"])
+
+    def get_fresh_summaries(self, nodes: list[Node]) -> dict[str, str]:
+        """Cached summaries of `nodes` (all of one session) whose title/content is unchanged since."""
+        if not nodes:
+            return {}
+        placeholders = ",".join("?" for _ in nodes)
+        rows = self._db(nodes[0].session_id).execute(
+            f"SELECT node_id, content_hash, summary FROM node_summaries WHERE node_id IN ({placeholders})",
+            [n.id for n in nodes],
+        ).fetchall()
+        cached = {r["node_id"]: (r["content_hash"], r["summary"]) for r in rows}
+        out: dict[str, str] = {}
+        for n in nodes:
+            hit = cached.get(n.id)
+            if hit is not None and hit[0] == node_content_hash(n):
+                out[n.id] = hit[1]
+        return out
+
+    def upsert_node_summary(self, session_id: str, node_id: str, content_hash: str, summary: str) -> None:
+        conn = self._db(session_id)
+        conn.execute(
+            """
+            INSERT INTO node_summaries(node_id, content_hash, summary, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(node_id) DO UPDATE SET
+              content_hash = excluded.content_hash, summary = excluded.summary, created_at = excluded.created_at
+            """,
+            (node_id, content_hash, summary, _now_iso()),
+        )
+        conn.commit()
+
+    def search_available(self) -> bool:
+        return all(has_search(conn) for conn in self._all_dbs())
+
+    def search_nodes(
+        self,
+        match: str | None,
+        like_terms: list[str],
+        limit: int,
+        offset: int = 0,
+        session_id: str | None = None,
+        max_candidates: int = 0,
+        terms: list[str] | None = None,
+    ) -> list[tuple[Node, float]]:
+        """Live nodes matching the FTS5 `match` expression and containing every `like_terms` entry.
+
+        Returns `(node, score)` best first; the score is bm25 (lower is better) with title hits
+        weighted ten times body hits, computed over the newest `max_candidates` matches (0 = all).
+        Without `match` (terms too short to index) only `session_id`'s rows are scanned, in creation
+        order, all scoring 0. Without `session_id` every shard is searched; since bm25 does not
+        compare across files, the shards' top hits are then re-ranked by `text_score` of `terms`.
+        Each shard still picks its candidates by its own bm25, so cross-shard order is close to,
+        but not exactly, what one index over all nodes would give.
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        if session_id is not None:
+            where.append("n.session_id = ?")
+            params.append(session_id)
+        for term in like_terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(n.title LIKE ? ESCAPE '\\' OR n.content LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern])
+        if match is None:
+            if session_id is None:
+                raise ValueError("an unindexed search must be scoped to one session")
+            sql = f"""
+                SELECT n.*, 0.0 AS score FROM nodes n
+                WHERE n.deleted_at IS NULL AND {" AND ".join(where)}
+                ORDER BY n.created_at ASC
+                LIMIT ? OFFSET ?
+            """
+        else:
+            if session_id is not None:
+                # Lets FTS5 skip the parts of each term's doclist outside the session's rowid span.
+                where.append(
+                    "nodes_fts.rowid BETWEEN (SELECT MIN(rowid) FROM nodes WHERE session_id = ?)"
+                    " AND (SELECT MAX(rowid) FROM nodes WHERE session_id = ?)"
+                )
+                params.extend([session_id, session_id])
+            # The inner scan walks matches newest first, so the candidate limit stops it early.
+            sql = f"""
+                SELECT * FROM (
+                  SELECT n.*, bm25(nodes_fts, 10.0, 1.0) AS score
+                  FROM nodes_fts JOIN nodes n ON n.rowid = nodes_fts.rowid
+                  WHERE nodes_fts MATCH ?{"".join(" AND " + w for w in where)}
+                  ORDER BY nodes_fts.rowid DESC
+                  LIMIT {max_candidates or -1}
+                )
+                ORDER BY score ASC
+                LIMIT ? OFFSET ?
+            """
+            params.insert(0, match)
+        conns = [self._db(session_id)] if session_id is not None else self._all_dbs()
+        if len(conns) == 1:
+            scored = [(r, float(r["score"])) for r in conns[0].execute(sql, (*params, limit, offset))]
+        else:
+            # Any shard may hold the whole page, so each returns everything up to its end.
+            rank_terms = terms or like_terms
+            scored = [
+                (r, text_score(r["title"], r["content"], rank_terms))
+                for conn in conns
+                for r in conn.execute(sql, (*params, offset + limit, 0))
+            ]
+            scored.sort(key=lambda item: item[1])
+            scored = scored[offset : offset + limit]
+        out: list[tuple[Node, float]] = []
+        for r, score in scored:
+            data = {k: r[k] for k in r.keys() if k != "score"}
+            if data.get("width") is None or float(data.get("width", 0) or 0) <= 0:
+                data["width"] = 400.0
+            out.append((Node(**data), score))
+        return out
+
+    def archive_inactive_sessions(self, inactive_days: float, limit: int) -> list[str]:
+        """Archive up to `limit` sessions per DB file whose graph was last written `inactive_days` ago."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=inactive_days)).isoformat()
+        archived: list[str] = []
+        for conn in self._all_dbs():
+            rows = conn.execute(
+                """
+                SELECT id FROM sessions
+                WHERE COALESCE(active_at, created_at) < ?
+                  AND id NOT IN (SELECT session_id FROM session_archives)
+                  AND id NOT IN (SELECT session_id FROM review_states)
+                  AND EXISTS (SELECT 1 FROM nodes WHERE nodes.session_id = sessions.id)
+                ORDER BY COALESCE(active_at, created_at) ASC
+                LIMIT ?
+                """,
+                (cutoff, limit),
+            ).fetchall()
+            archived.extend(r["id"] for r in rows if archive_session(conn, r["id"]))
+        return archived
+
+    def storage_report(self) -> dict[str, Any]:
+        """Row counts and sizes of the hot graph tables and of the archive tier, over all files."""
+        totals: dict[str, Any] = {
+            "hot_sessions": 0,
+            "hot_nodes": 0,
+            "hot_edges": 0,
+            "cold_sessions": 0,
+            "cold_nodes": 0,
+            "cold_edges": 0,
+            "cold_raw_bytes": 0,
+            "cold_stored_bytes": 0,
+            # On-disk pages, including indexes and the search index; None without SQLite's dbstat.
+            "hot_page_bytes": 0,
+            "cold_page_bytes": 0,
+        }
+        for conn in self._all_dbs():
+            row = conn.execute(
+                """
+                SELECT COUNT(*) AS n, COALESCE(SUM(node_count), 0) AS nodes, COALESCE(SUM(edge_count), 0) AS edges,
+                       COALESCE(SUM(raw_bytes), 0) AS raw, COALESCE(SUM(LENGTH(payload)), 0) AS stored
+                FROM session_archives
+                """
+            ).fetchone()
+            totals["cold_sessions"] += row["n"]
+            totals["cold_nodes"] += row["nodes"]
+            totals["cold_edges"] += row["edges"]
+            totals["cold_raw_bytes"] += row["raw"]
+            totals["cold_stored_bytes"] += row["stored"]
+            totals["hot_sessions"] += conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE id NOT IN (SELECT session_id FROM session_archives)"
+            ).fetchone()[0]
+            totals["hot_nodes"] += conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+            totals["hot_edges"] += conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+            pages = self._page_bytes(conn)
+            for key in ("hot_page_bytes", "cold_page_bytes"):
+                if pages is None or totals[key] is None:
+                    totals[key] = None
+                else:
+                    totals[key] += pages[key]
+        return totals
+
+    @staticmethod
+    def _page_bytes(conn: sqlite3.Connection) -> dict[str, int] | None:
+        try:
+            rows = conn.execute(
+                """
+                SELECT m.tbl_name AS name, SUM(s.pgsize) AS size
+                FROM dbstat s JOIN sqlite_master m ON m.name = s.name
+                GROUP BY m.tbl_name
+                """
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return None
+        out = {"hot_page_bytes": 0, "cold_page_bytes": 0}
+        for r in rows:
+            name = str(r["name"])
+            if name in ("nodes", "edges", "node_summaries") or name.startswith("nodes_fts"):
+                out["hot_page_bytes"] += int(r["size"])
+            elif name == "session_archives":
+                out["cold_page_bytes"] += int(r["size"])
+        return out
+
+    def get_quiz_items(self, content_hashes: list[str]) -> dict[str, list[tuple[str, str]]]:
+        """Stored `(question, answer)` pairs per content hash; hashes without a quiz are absent."""
+        out: dict[str, list[tuple[str, str]]] = {}
+        if not content_hashes:
+            return out
+        placeholders = ",".join("?" for _ in content_hashes)
+        rows = self.conn.execute(
+            f"""
+            SELECT content_hash, question, answer FROM quiz_items
+            WHERE content_hash IN ({placeholders})
+            ORDER BY content_hash, seq
+            """,
+            content_hashes,
+        ).fetchall()
+        for r in rows:
+            out.setdefault(r["content_hash"], []).append((r["question"], r["answer"]))
+        return out
+
+    def save_quiz_items(self, quizzes: dict[str, list[tuple[str, str]]]) -> None:
+        created_at = _now_iso()
+        hashes = list(quizzes)
+        self.conn.executemany("DELETE FROM quiz_items WHERE content_hash = ?", [(h,) for h in hashes])
+        self.conn.executemany(
+            "INSERT INTO quiz_items(content_hash, seq, question, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (h, seq, question, answer, created_at)
+                for h, items in quizzes.items()
+                for seq, (question, answer) in enumerate(items)
+            ],
+        )
+        self.conn.commit()
+
+    def enroll_reviews(self, session_id: str, node_ids: list[str], due_at: float) -> int:
+        """Start review tracking for live non-question nodes; already tracked nodes are kept as is."""
+        conn = self._db(session_id)
+        sql = """
+            INSERT OR IGNORE INTO review_states(node_id, session_id, due_at)
+            SELECT id, session_id, ? FROM nodes
+            WHERE session_id = ? AND deleted_at IS NULL AND node_type != 'question'
+        """
+        params: list[Any] = [due_at, session_id]
+        if node_ids:
+            sql += f" AND id IN ({','.join('?' for _ in node_ids)})"
+            params.extend(node_ids)
+        cur = conn.execute(sql, params)
+        conn.commit()
+        return cur.rowcount
+
+    def due_reviews(self, now: float, limit: int, session_id: str | None = None) -> list[tuple[Node, sqlite3.Row]]:
+        """The `limit` most overdue states with their nodes, read off the due index in order.
+
+        Without `session_id` every shard is read the same way and the sorted results merged.
+        """
+        where = "r.due_at <= ?"
+        params: list[Any] = [now]
+        conns = self._all_dbs()
+        if session_id is not None:
+            where = "r.session_id = ? AND " + where
+            params.insert(0, session_id)
+            conns = [self._db(session_id)]
+        per_db = [
+            conn.execute(
+                f"""
+                SELECT r.due_at, r.interval_days, r.ease, r.repetitions, r.lapses, n.*
+                FROM review_states r JOIN nodes n ON n.id = r.node_id
+                WHERE {where}
+                ORDER BY r.due_at ASC
+                LIMIT ?
+                """,
+                (*params, limit),
+            ).fetchall()
+            for conn in conns
+        ]
+        rows = per_db[0] if len(per_db) == 1 else list(heapq.merge(*per_db, key=lambda r: r["due_at"]))[:limit]
+        out: list[tuple[Node, sqlite3.Row]] = []
         for r in rows:
-            pieces.append(f"[{r['filename']}]\n{r['content_text']}")
-        ctx = "\n\n".join(pieces)
-        return ctx[:max_chars]
+            data = {k: r[k] for k in r.keys() if k not in ("due_at", "interval_days", "ease", "repetitions", "lapses")}
+            if data.get("width") is None or float(data.get("width", 0) or 0) <= 0:
+                data["width"] = 400.0
+            out.append((Node(**data), r))
+        return out
+
+    def get_review_states(self, node_ids: list[str]) -> dict[str, sqlite3.Row]:
+        if not node_ids:
+            return {}
+        placeholders = ",".join("?" for _ in node_ids)
+        out: dict[str, sqlite3.Row] = {}
+        # Grades name nodes, not sessions, so every shard is asked; each lookup is a primary key hit.
+        for conn in self._all_dbs():
+            rows = conn.execute(f"SELECT * FROM review_states WHERE node_id IN ({placeholders})", node_ids).fetchall()
+            out.update((r["node_id"], r) for r in rows)
+        return out
+
+    def save_review_states(self, states: list[dict[str, Any]]) -> None:
+        """Write several graded states in one transaction; nothing is kept if any write fails.
+
+        Sharded sessions are committed shard by shard and then the catalog, like an import.
+        """
+        by_session: dict[str, list[dict[str, Any]]] = {}
+        for state in states:
+            by_session.setdefault(state["session_id"], []).append(state)
+        # Resolved before any write: `_db` rolls back whatever a shard connection has open.
+        conns = {session_id: self._db(session_id) for session_id in by_session}
+        touched: list[sqlite3.Connection] = []
+        for conn in conns.values():
+            if not any(conn is c for c in touched):
+                touched.append(conn)
+        try:
+            for session_id, batch in by_session.items():
+                conns[session_id].executemany(
+                    """
+                    UPDATE review_states
+                    SET due_at = :due_at, interval_days = :interval_days, ease = :ease,
+                        repetitions = :repetitions, lapses = :lapses, last_reviewed_at = :last_reviewed_at
+                    WHERE node_id = :node_id
+                    """,
+                    batch,
+                )
+            for conn in touched:
+                if conn is not self.conn:
+                    conn.commit()
+            if any(conn is self.conn for conn in touched):
+                self.conn.commit()
+        except BaseException:
+            for conn in touched:
+                conn.rollback()
+            raise
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from ..config import ContextConfig
+from ..metrics import metrics
+from ..models import Node
+
+TRUNCATION_MARKER = " ...[truncated]"
+CATEGORIES = ("nodes", "sections", "materials")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 ASCII chars per token, one token per non-ASCII (e.g. CJK) char."""
+    if not text:
+        return 0
+    chars = len(text)
+    # Non-ASCII chars here are mostly 3-byte UTF-8 (CJK), so extra bytes / 2 approximates their count.
+    non_ascii = min(chars, (len(text.encode("utf-8")) - chars) // 2)
+    return math.ceil((chars - non_ascii) / 4) + non_ascii
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    est = estimate_tokens(text)
+    if est <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARKER)
+    if budget <= 0:
+        return ""
+    cut = len(text) * budget // est
+    while cut > 0 and estimate_tokens(text[:cut]) > budget:
+        cut = cut * 9 // 10
+    if cut <= 0:
+        return ""
+    return text[:cut].rstrip() + TRUNCATION_MARKER
+
+
+def allocate(total: int, demands: list[int], weights: list[float]) -> list[int]:
+    """Water-fill `total` across demands by weight; budget a demand doesn't need rolls over to the rest."""
+    alloc = [0] * len(demands)
+    active = [i for i, d in enumerate(demands) if d > 0 and weights[i] > 0]
+    left = total
+    while active and left > 0:
+        wsum = sum(weights[i] for i in active)
+        grants = {i: int(left * weights[i] / wsum) for i in active}
+        satisfied = [i for i in active if grants[i] >= demands[i] - alloc[i]]
+        if not satisfied:
+            for i in active:
+                alloc[i] += grants[i]
+            break
+        for i in satisfied:
+            left -= demands[i] - alloc[i]
+            alloc[i] = demands[i]
+            active.remove(i)
+    return alloc
+
+
+@dataclass
+class PromptContext:
+    node_desc: str
+    section_desc: str
+    material_context: str
+    usage: dict[str, int] = field(default_factory=dict)
+
+
+class ContextBuilder:
+    def __init__(self, cfg: ContextConfig) -> None:
+        self.cfg = cfg
+
+    def build(
+        self,
+        question: str,
+        nodes: list[Node],
+        sections: list[dict[str, Any]],
+        load_materials: Callable[[int], str],
+        summaries: dict[str, str] | None = None,
+        ancestors: list[Node] | None = None,
+    ) -> PromptContext:
+        """Fit selected nodes, sections and materials into `cfg.max_tokens` after the question.
+
+        Items keep their given order; each category's share is split evenly across its items,
+        so the result only depends on the inputs. When full node contents do not fit, nodes with
+        a cached summary are represented by it instead. `ancestors` share the node budget after
+        the selected nodes and always use their summary when one exists.
+        """
+        summaries = summaries or {}
+        question_tokens = estimate_tokens(question)
+        available = max(0, self.cfg.max_tokens - question_tokens)
+        node_lines = [f"- {n.title}: {n.content}" for n in nodes]
+        node_lines += [f"- {n.title} (ancestor): {summaries.get(n.id) or n.content}" for n in ancestors or []]
+        section_lines = [f"- ({s.get('node_id')}) {s.get('title')}: {s.get('body')}" for s in sections]
+        weights = [self.cfg.nodes_weight, self.cfg.sections_weight, self.cfg.materials_weight]
+        # Materials are optional background: cap them at their weighted share (and the configured
+        # maximum) so they never grow into budget that unused node and section shares leave over.
+        material_cap = min(self.cfg.max_material_tokens, int(available * weights[2] / (sum(weights) or 1)))
+        # Materials are read lazily, so never fetch more than the cap could hold.
+        material_text = load_materials(material_cap * 4) if material_cap > 0 else ""
+
+        line_tokens = {
+            "nodes": [estimate_tokens(line) for line in node_lines],
+            "sections": [estimate_tokens(line) for line in section_lines],
+        }
+        demands = [
+            sum(line_tokens["nodes"]),
+            sum(line_tokens["sections"]),
+            min(material_cap, estimate_tokens(material_text)),
+        ]
+        budgets = dict(zip(CATEGORIES, allocate(available, demands, weights)))
+        summarized = 0
+        if budgets["nodes"] < demands[0] and summaries:
+            for idx, n in enumerate(nodes):
+                summary = summaries.get(n.id)
+                if summary is None:
+                    continue
+                line = f"- {n.title} (summary): {summary}"
+                tokens = estimate_tokens(line)
+                if tokens < line_tokens["nodes"][idx]:
+                    node_lines[idx] = line
+                    line_tokens["nodes"][idx] = tokens
+                    summarized += 1
+            demands[0] = sum(line_tokens["nodes"])
+            budgets = dict(zip(CATEGORIES, allocate(available, demands, weights)))
+
+        node_desc, node_used = self._fit_lines(node_lines, line_tokens["nodes"], budgets["nodes"])
+        section_desc, section_used = self._fit_lines(section_lines, line_tokens["sections"], budgets["sections"])
+        material_context = truncate_to_tokens(material_text, budgets["materials"])
+        usage = {
+            "budget": self.cfg.max_tokens,
+            "question": question_tokens,
+            "nodes": node_used,
+            "sections": section_used,
+            "materials": estimate_tokens(material_context),
+        }
+        usage["used"] = usage["question"] + usage["nodes"] + usage["sections"] + usage["materials"]
+        trimmed = usage["used"] < question_tokens + sum(demands)
+        for key in ("used", "nodes", "sections", "materials"):
+            metrics.observe(f"prompt_context.tokens.{key}", usage[key])
+        metrics.incr("prompt_context.builds")
+        metrics.incr("prompt_context.summarized_nodes", summarized)
+        if trimmed:
+            metrics.incr("prompt_context.trimmed")
+        return PromptContext(
+            node_desc=node_desc,
+            section_desc=section_desc,
+            material_context=material_context,
+            usage=usage,
+        )
+
+    @staticmethod
+    def _fit_lines(lines: list[str], tokens: list[int], budget: int) -> tuple[str, int]:
+        shares = allocate(budget, tokens, [1.0] * len(lines))
+        kept: list[str] = []
+        used = 0
+        for line, share in zip(lines, shares):
+            text = truncate_to_tokens(line, share)
+            if not text:
+                continue
+            kept.append(text)
+            used += estimate_tokens(text)
+        return "\n".join(kept), used
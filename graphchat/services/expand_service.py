@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import queue
+import threading
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from ..config import ContextConfig
+from ..db import ConnectionPool
+from ..llm_client import LlmClient, LlmError
+from ..models import AskOut, Node
+from ..repository import Repository
+from .graph_service import GraphService
+
+_BRANCH_FINISHED = object()
+
+
+class ExpandService:
+    """Runs one `ask_stream` branch per knowledge node, at most `concurrency` at a time."""
+
+    def __init__(
+        self,
+        repo: Repository,
+        llm: LlmClient,
+        pool: ConnectionPool,
+        context_cfg: ContextConfig | None = None,
+    ) -> None:
+        self.repo = repo
+        self.llm = llm
+        self.pool = pool
+        self.context_cfg = context_cfg
+
+    def expand_stream(
+        self,
+        session_id: str,
+        node_ids: list[str],
+        question: str,
+        concurrency: int,
+    ) -> Generator[dict[str, Any], None, dict[str, AskOut]]:
+        if node_ids:
+            by_id = {n.id: n for n in self.repo.get_nodes_by_ids(session_id, node_ids)}
+            nodes = [by_id[nid] for nid in dict.fromkeys(node_ids) if nid in by_id]
+        else:
+            nodes = [n for n in self.repo.list_nodes(session_id) if n.node_type == "knowledge"]
+        yield {"type": "expand_start", "node_ids": [n.id for n in nodes], "branch_node_id": None}
+        if not nodes:
+            return {}
+
+        events: queue.Queue[Any] = queue.Queue()
+        stop = threading.Event()
+
+        def run_branch(node: Node) -> None:
+            conn = self.pool.acquire()
+            try:
+                # Each branch persists through its own connection, independent of the others.
+                graph_svc = GraphService(Repository(conn, self.pool.shards), self.llm, self.context_cfg)
+                gen = graph_svc.ask_stream(session_id, question.replace("{title}", node.title), [node.id])
+                try:
+                    while True:
+                        if stop.is_set():
+                            gen.close()
+                            return
+                        try:
+                            event = next(gen)
+                        except StopIteration as done:
+                            events.put({"type": "branch_done", "branch_node_id": node.id, "result": done.value})
+                            return
+                        events.put({**event, "branch_node_id": node.id})
+                except Exception as exc:  # noqa: BLE001
+                    events.put(
+                        {
+                            "type": "branch_error",
+                            "branch_node_id": node.id,
+                            "message": str(exc),
+                            "code": exc.code if isinstance(exc, LlmError) else None,
+                        }
+                    )
+            finally:
+                self.pool.release(conn)
+                events.put(_BRANCH_FINISHED)
+
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="graphchat-expand")
+        results: dict[str, AskOut] = {}
+        try:
+            for node in nodes:
+                executor.submit(run_branch, node)
+            remaining = len(nodes)
+            while remaining:
+                event = events.get()
+                if event is _BRANCH_FINISHED:
+                    remaining -= 1
+                    continue
+                if event["type"] == "branch_done":
+                    results[event["branch_node_id"]] = event["result"]
+                yield event
+        finally:
+            # Also reached when the client disconnects: stop running branches, drop queued ones.
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
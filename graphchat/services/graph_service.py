@@ -1,17 +1,33 @@
 from __future__ import annotations
 
-from collections.abc import Generator
+from collections.abc import Generator, Iterable
 from typing import Any
 
-from ..llm_client import LlmClient
+from ..config import ContextConfig
+from ..json_stream import JsonObjectStream
+from ..llm_client import LlmClient, LlmError
+from ..metrics import metrics
 from ..models import AskOut, Edge, Node, SessionOut
+from ..near_duplicates import knowledge_index
 from ..repository import Repository
+from .context_builder import ContextBuilder, PromptContext
+
+
+class AnswerDiscardedError(RuntimeError):
+    """A streamed answer failed part-way and the nodes and edges it had created were removed."""
+
+    def __init__(self, cause: Exception, node_ids: list[str], edge_ids: list[str]) -> None:
+        super().__init__(str(cause))
+        self.cause = cause
+        self.node_ids = node_ids
+        self.edge_ids = edge_ids
 
 
 class GraphService:
-    def __init__(self, repo: Repository, llm: LlmClient) -> None:
+    def __init__(self, repo: Repository, llm: LlmClient, context_cfg: ContextConfig | None = None) -> None:
         self.repo = repo
         self.llm = llm
+        self.context_builder = ContextBuilder(context_cfg or ContextConfig())
 
     def init_session(self, topic: str) -> tuple[SessionOut, list[Node], list[Edge]]:
         session = self.repo.create_session(topic)
@@ -200,20 +216,59 @@ class GraphService:
         question: str,
         node_ids: list[str],
         selected_sections: list[dict[str, Any]] | None = None,
+        ancestor_depth: int = 0,
     ) -> AskOut:
-        selected_sections = selected_sections or []
-        selected_nodes = self.repo.get_nodes_by_ids(session_id, node_ids)
-        section_node_ids = [str(s.get("node_id", "")) for s in selected_sections if s.get("node_id")]
-        section_nodes = self.repo.get_nodes_by_ids(session_id, section_node_ids)
-        context_nodes = {n.id: n for n in selected_nodes}
-        context_nodes.update({n.id: n for n in section_nodes})
-        node_desc = "\n".join([f"- {n.title}: {n.content}" for n in context_nodes.values()])
-        section_desc = "\n".join(
-            [f"- ({s.get('node_id')}) {s.get('title')}: {s.get('body')}" for s in selected_sections]
+        """Structured (JSON-mode) answer, written only once the whole document has parsed.
+
+        A cut-off, stalled or malformed completion raises `LlmError` before anything is created.
+        """
+        selected_nodes, system_prompt, user_prompt = self._ask_json_prompts(
+            session_id, question, node_ids, selected_sections or [], ancestor_depth
+        )
+        members = list(self._json_members(system_prompt, user_prompt, split_arrays=("nodes", "edges")))
+        gen = self._discard_on_failure(session_id, self._write_json_answer(session_id, selected_nodes, members))
+        while True:
+            try:
+                next(gen)
+            except StopIteration as stop:
+                return stop.value
+
+    def ask_json_stream(
+        self,
+        session_id: str,
+        question: str,
+        node_ids: list[str],
+        selected_sections: list[dict[str, Any]] | None = None,
+        ancestor_depth: int = 0,
+    ) -> Generator[dict[str, Any], None, AskOut]:
+        """Structured (JSON-mode) answer, creating each node and edge as soon as its object closes.
+
+        Yields `node`, `edge`, `counterexample` and `redirect_hint` events while the model writes
+        and returns the same `AskOut` as `ask`. If the completion fails part-way, everything it
+        created is removed again and `AnswerDiscardedError` names what was removed.
+        """
+        selected_nodes, system_prompt, user_prompt = self._ask_json_prompts(
+            session_id, question, node_ids, selected_sections or [], ancestor_depth
+        )
+        members = self._json_members(system_prompt, user_prompt, split_arrays=("nodes", "edges"))
+        return (
+            yield from self._discard_on_failure(
+                session_id, self._write_json_answer(session_id, selected_nodes, members)
+            )
         )
-        graph_nodes = self.repo.list_nodes(session_id)
-        graph_edges = self.repo.list_edges(session_id)
-        material_context = self.repo.get_material_context(session_id)
+
+    def _ask_json_prompts(
+        self,
+        session_id: str,
+        question: str,
+        node_ids: list[str],
+        selected_sections: list[dict[str, Any]],
+        ancestor_depth: int,
+    ) -> tuple[list[Node], str, str]:
+        selected_nodes, ctx = self._prompt_context(
+            session_id, question, node_ids, selected_sections, ancestor_depth
+        )
+        node_count, edge_count = self.repo.graph_counts(session_id)
 
         system_prompt = (
             "You are a knowledge graph tutor. Return JSON with fields: "
@@ -226,37 +281,57 @@ class GraphService:
         )
         user_prompt = (
             f"User question: {question}\n"
-            f"Selected nodes:\n{node_desc}\n"
-            f"Selected sections:\n{section_desc}\n"
-            f"Graph stats: nodes={len(graph_nodes)}, edges={len(graph_edges)}\n"
-            f"Reference materials:\n{material_context}"
+            f"Selected nodes:\n{ctx.node_desc}\n"
+            f"Selected sections:\n{ctx.section_desc}\n"
+            f"Graph stats: nodes={node_count}, edges={edge_count}\n"
+            f"Reference materials:\n{ctx.material_context}"
         )
-        raw = self.llm.json_completion(system_prompt, user_prompt)
-        new_nodes_raw = raw.get("nodes", [])
-        new_edges_raw = raw.get("edges", [])
+        return selected_nodes, system_prompt, user_prompt
 
-        new_nodes: list[Node] = []
-        for idx, item in enumerate(new_nodes_raw):
-            nn = self.repo.create_node(
-                session_id=session_id,
-                title=str(item.get("title", "Untitled Node")),
-                content=str(item.get("content", "")),
-                x=180.0 + 80.0 * idx,
-                y=-120.0 + 120.0 * idx,
-                width=400.0,
-                node_type=self._safe_node_type(item.get("node_type", "normal")),
-            )
-            new_nodes.append(nn)
+    def _discard_on_failure(
+        self, session_id: str, gen: Generator[dict[str, Any], None, AskOut]
+    ) -> Generator[dict[str, Any], None, AskOut]:
+        """Pass `gen` through; if it raises, remove the nodes and edges its events announced."""
+        node_ids: list[str] = []
+        edge_ids: list[str] = []
+        try:
+            while True:
+                try:
+                    event = next(gen)
+                except StopIteration as stop:
+                    return stop.value
+                if event.get("node") is not None:
+                    node_ids.append(event["node"].id)
+                if event.get("edge") is not None:
+                    edge_ids.append(event["edge"].id)
+                yield event
+        except Exception as exc:
+            if not node_ids and not edge_ids:
+                raise
+            self.repo.discard_graph_items(session_id, node_ids, edge_ids)
+            metrics.incr("ask.discarded_partial_answers")
+            raise AnswerDiscardedError(exc, node_ids, edge_ids) from exc
+
+    def _write_json_answer(
+        self, session_id: str, selected_nodes: list[Node], members: Iterable[tuple[str, Any]]
+    ) -> Generator[dict[str, Any], None, AskOut]:
+        """Create the nodes and edges of a JSON-mode answer from its top-level `members`, in order.
 
+        Edges naming a new node the model has not written yet wait for it, up to the end of the
+        document.
+        """
+        new_nodes: list[Node] = []
+        new_edges: list[Edge] = []
+        pending_edges: list[dict[str, Any]] = []
+        counter_node: Node | None = None
+        redirect_hint: Any = None
         id_ref = {f"selected:{i}": n.id for i, n in enumerate(selected_nodes)}
-        id_ref.update({f"new:{i}": n.id for i, n in enumerate(new_nodes)})
 
-        new_edges: list[Edge] = []
-        for item in new_edges_raw:
+        def add_edge(item: dict[str, Any]) -> Edge | None:
             source_id = id_ref.get(str(item.get("source_ref", "")))
             target_id = id_ref.get(str(item.get("target_ref", "")))
             if not source_id or not target_id:
-                continue
+                return None
             edge = self.repo.create_edge(
                 session_id=session_id,
                 source_node_id=source_id,
@@ -265,55 +340,121 @@ class GraphService:
                 edge_type="direct",
             )
             new_edges.append(edge)
+            return edge
 
-        counter = raw.get("counterexample")
-        counter_node = None
-        if isinstance(counter, dict):
-            counter_node = self.repo.create_node(
-                session_id=session_id,
-                title=str(counter.get("title", "Counterexample")),
-                content=str(counter.get("content", "")),
-                x=220.0,
-                y=-160.0,
-                width=400.0,
-                node_type="counterexample",
-            )
-            if selected_nodes:
-                new_edges.append(
-                    self.repo.create_edge(
+        for key, value in members:
+            if key == "nodes" and isinstance(value, dict):
+                idx = len(new_nodes)
+                nn = self.repo.create_node(
+                    session_id=session_id,
+                    title=str(value.get("title", "Untitled Node")),
+                    content=str(value.get("content", "")),
+                    x=180.0 + 80.0 * idx,
+                    y=-120.0 + 120.0 * idx,
+                    width=400.0,
+                    node_type=self._safe_node_type(value.get("node_type", "normal")),
+                )
+                new_nodes.append(nn)
+                id_ref[f"new:{idx}"] = nn.id
+                yield {"type": "node", "node": nn}
+            elif key == "edges" and isinstance(value, dict):
+                edge = add_edge(value)
+                if edge is not None:
+                    yield {"type": "edge", "edge": edge}
+                else:
+                    pending_edges.append(value)
+            elif key == "counterexample" and isinstance(value, dict) and counter_node is None:
+                counter_node = self.repo.create_node(
+                    session_id=session_id,
+                    title=str(value.get("title", "Counterexample")),
+                    content=str(value.get("content", "")),
+                    x=220.0,
+                    y=-160.0,
+                    width=400.0,
+                    node_type="counterexample",
+                )
+                counter_edge = None
+                if selected_nodes:
+                    counter_edge = self.repo.create_edge(
                         session_id=session_id,
                         source_node_id=counter_node.id,
                         target_node_id=selected_nodes[0].id,
                         source_section_key=None,
                         edge_type="direct",
                     )
-                )
+                    new_edges.append(counter_edge)
+                yield {"type": "counterexample", "node": counter_node, "edge": counter_edge}
+            elif key == "redirect_hint":
+                redirect_hint = value
+                yield {"type": "redirect_hint", "redirect_hint": value}
+        for item in pending_edges:
+            edge = add_edge(item)
+            if edge is not None:
+                yield {"type": "edge", "edge": edge}
 
         return AskOut(
             new_nodes=new_nodes,
             new_edges=new_edges,
-            redirect_hint=raw.get("redirect_hint"),
+            redirect_hint=redirect_hint,
             counterexample=counter_node,
         )
 
-    def ask_stream(
+    def _json_members(
+        self, system_prompt: str, user_prompt: str, split_arrays: tuple[str, ...]
+    ) -> Generator[tuple[str, Any], None, None]:
+        parser = JsonObjectStream(split_arrays)
+        try:
+            for chunk in self.llm.stream_json_completion(system_prompt, user_prompt):
+                yield from parser.feed(chunk)
+            parser.close()
+        except ValueError as exc:
+            # Malformed or cut-off output fails like a whole-document completion that cannot parse.
+            raise LlmError(f"LLM returned invalid JSON: {exc}") from exc
+
+    def _prompt_context(
         self,
         session_id: str,
         question: str,
         node_ids: list[str],
-        selected_sections: list[dict[str, Any]] | None = None,
-    ) -> Generator[dict[str, Any], None, AskOut]:
-        selected_sections = selected_sections or []
-        selected_nodes = self.repo.get_nodes_by_ids(session_id, node_ids)
+        selected_sections: list[dict[str, Any]],
+        ancestor_depth: int = 0,
+    ) -> tuple[list[Node], PromptContext]:
+        selected_nodes = self._in_order(self.repo.get_nodes_by_ids(session_id, node_ids), node_ids)
         section_node_ids = [str(s.get("node_id", "")) for s in selected_sections if s.get("node_id")]
-        section_nodes = self.repo.get_nodes_by_ids(session_id, section_node_ids)
+        section_nodes = self._in_order(self.repo.get_nodes_by_ids(session_id, section_node_ids), section_node_ids)
         context_nodes = {n.id: n for n in selected_nodes}
         context_nodes.update({n.id: n for n in section_nodes})
-        node_desc = "\n".join([f"- {n.title}: {n.content}" for n in context_nodes.values()])
-        section_desc = "\n".join(
-            [f"- ({s.get('node_id')}) {s.get('title')}: {s.get('body')}" for s in selected_sections]
+        ancestors: list[Node] = []
+        if ancestor_depth > 0 and selected_nodes:
+            # Listed nearest first; nodes already in the context are not repeated.
+            walked = self.repo.walk_nodes(session_id, [n.id for n in selected_nodes], "ancestors", ancestor_depth)
+            ancestors = [n for n, _ in walked if n.id not in context_nodes]
+        ctx = self.context_builder.build(
+            question,
+            list(context_nodes.values()),
+            selected_sections,
+            lambda max_chars: self.repo.get_material_context(session_id, max_chars=max_chars),
+            summaries=self.repo.get_fresh_summaries([*context_nodes.values(), *ancestors]),
+            ancestors=ancestors,
+        )
+        return selected_nodes, ctx
+
+    @staticmethod
+    def _in_order(nodes: list[Node], ids: list[str]) -> list[Node]:
+        rank = {nid: idx for idx, nid in enumerate(ids)}
+        return sorted(nodes, key=lambda n: rank.get(n.id, len(rank)))
+
+    def ask_stream_prompts(
+        self,
+        session_id: str,
+        question: str,
+        node_ids: list[str],
+        selected_sections: list[dict[str, Any]],
+        ancestor_depth: int = 0,
+    ) -> tuple[list[Node], str, str]:
+        selected_nodes, ctx = self._prompt_context(
+            session_id, question, node_ids, selected_sections, ancestor_depth
         )
-        material_context = self.repo.get_material_context(session_id)
 
         system_prompt = (
             "You are a knowledge graph tutor. "
@@ -328,9 +469,24 @@ class GraphService:
         )
         user_prompt = (
             f"User question: {question}\n"
-            f"Selected nodes:\n{node_desc}\n"
-            f"Selected sections:\n{section_desc}\n"
-            f"Reference materials:\n{material_context}"
+            f"Selected nodes:\n{ctx.node_desc}\n"
+            f"Selected sections:\n{ctx.section_desc}\n"
+            f"Reference materials:\n{ctx.material_context}"
+        )
+        return selected_nodes, system_prompt, user_prompt
+
+    def ask_stream(
+        self,
+        session_id: str,
+        question: str,
+        node_ids: list[str],
+        selected_sections: list[dict[str, Any]] | None = None,
+        prefetched_answer: str | None = None,
+        ancestor_depth: int = 0,
+    ) -> Generator[dict[str, Any], None, AskOut]:
+        selected_sections = selected_sections or []
+        selected_nodes, system_prompt, user_prompt = self.ask_stream_prompts(
+            session_id, question, node_ids, selected_sections, ancestor_depth
         )
         question_title = (question.strip()[:16] or "Question").strip()
 
@@ -403,6 +559,8 @@ class GraphService:
         knowledge_edges: list[Edge] = []
         knowledge_order: list[str] = []
         knowledge_bodies: dict[str, list[str]] = {}
+        linked: set[str] = set()
+        flagged: set[str] = set()
         answer_parts: list[str] = []
         pending = ""
         current_target_node_id = answer_node.id
@@ -420,6 +578,15 @@ class GraphService:
                 buf.append(text)
             return {"type": "token", "node_id": node_id, "content": text}
 
+        def flag_duplicate(kn: Node, duplicate: tuple[Node, float]) -> dict[str, Any]:
+            # Without merging, a near-duplicate is kept and only linked to the node it repeats.
+            node, score = duplicate
+            flagged.add(kn.id)
+            edge = self._link(session_id, kn.id, node.id)
+            knowledge_edges.append(edge)
+            metrics.incr("dedupe.flagged")
+            return {"type": "knowledge_duplicate", "node_id": kn.id, "duplicate_of": node, "edge": edge, "similarity": score}
+
         def handle_line(line_text: str) -> tuple[list[dict[str, Any]], str]:
             nonlocal question_title_resolved
             events: list[dict[str, Any]] = []
@@ -444,6 +611,17 @@ class GraphService:
                 heading = stripped[3:].strip()
                 if heading.upper().startswith("[KNOWLEDGE]"):
                     ktitle = heading[len("[KNOWLEDGE]") :].strip() or f"Knowledge {len(knowledge_nodes) + 1}"
+                    existing = self._near_duplicate_title(session_id, ktitle[:60])
+                    if existing is not None and knowledge_index.merge:
+                        # Link the question to the node it would duplicate; the section's body is dropped.
+                        node, score = existing
+                        if node.id not in linked:
+                            linked.add(node.id)
+                            edge = self._link(session_id, question_node.id, node.id)
+                            knowledge_edges.append(edge)
+                            metrics.incr("dedupe.linked")
+                            events.append({"type": "knowledge_link", "node": node, "edge": edge, "similarity": score})
+                        return events, node.id
                     kn = self.repo.create_node(
                         session_id=session_id,
                         title=ktitle[:60],
@@ -466,6 +644,8 @@ class GraphService:
                     knowledge_bodies[kn.id] = []
                     print(f"[DEBUG] knowledge heading detected: node_id={kn.id}, title={ktitle}")
                     events.append({"type": "knowledge_start", "node": kn, "edge": edge})
+                    if existing is not None:
+                        events.append(flag_duplicate(kn, existing))
                     next_target = kn.id
                     token_evt = emit_token(kn.id, f"## {ktitle}\n")
                     if token_evt is not None:
@@ -477,7 +657,13 @@ class GraphService:
                 events.append(token_evt)
             return events, next_target
 
-        for chunk in self.llm.stream_text_completion(system_prompt, user_prompt):
+        # A prefetched answer was generated from the same prompts; replay it through the same parser.
+        chunks = (
+            [prefetched_answer]
+            if prefetched_answer is not None
+            else self.llm.stream_text_completion(system_prompt, user_prompt)
+        )
+        for chunk in chunks:
             pending += chunk
             while True:
                 idx = pending.find("\n")
@@ -517,10 +703,64 @@ class GraphService:
                 content=content_text,
             )
             kn.content = content_text
+            duplicate = self._near_duplicate_node(session_id, kn)
+            if duplicate is None:
+                continue
+            if not knowledge_index.merge:
+                if kn.id not in flagged:
+                    yield flag_duplicate(kn, duplicate)
+                continue
+            # The body only turned out to repeat an existing node once complete; fold the copy into it.
+            node, score = duplicate
+            self.repo.soft_delete_node(session_id, kn.id)
+            knowledge_index.remove(session_id, kn.id)
+            knowledge_nodes.remove(kn)
+            knowledge_edges = [e for e in knowledge_edges if e.target_node_id != kn.id]
+            edge = None
+            if node.id not in linked:
+                linked.add(node.id)
+                edge = self._link(session_id, question_node.id, node.id)
+                knowledge_edges.append(edge)
+            metrics.incr("dedupe.merged")
+            yield {"type": "knowledge_merged", "node_id": kn.id, "into": node, "edge": edge, "similarity": score}
         all_nodes = [question_node, answer_node, *knowledge_nodes]
         all_edges = [*edges, *knowledge_edges]
         return AskOut(new_nodes=all_nodes, new_edges=all_edges, redirect_hint=None, counterexample=None)
 
+    def _near_duplicate_title(self, session_id: str, title: str) -> tuple[Node, float] | None:
+        if not knowledge_index.enabled:
+            return None
+        self._sync_knowledge_index(session_id)
+        hit = knowledge_index.match_title(session_id, title)
+        return self._resolve_duplicate(session_id, hit)
+
+    def _near_duplicate_node(self, session_id: str, node: Node) -> tuple[Node, float] | None:
+        if not knowledge_index.enabled:
+            return None
+        self._sync_knowledge_index(session_id)
+        hit = knowledge_index.match_node(session_id, node)
+        return self._resolve_duplicate(session_id, hit)
+
+    def _sync_knowledge_index(self, session_id: str) -> None:
+        knowledge_index.sync(
+            session_id, self.repo.get_session_revision(session_id), lambda: self.repo.list_nodes(session_id)
+        )
+
+    def _resolve_duplicate(self, session_id: str, hit: tuple[str, float] | None) -> tuple[Node, float] | None:
+        if hit is None:
+            return None
+        nodes = self.repo.get_nodes_by_ids(session_id, [hit[0]])
+        return (nodes[0], hit[1]) if nodes else None
+
+    def _link(self, session_id: str, question_node_id: str, node_id: str) -> Edge:
+        return self.repo.create_edge(
+            session_id=session_id,
+            source_node_id=question_node_id,
+            target_node_id=node_id,
+            source_section_key=None,
+            edge_type="direct",
+        )
+
     @staticmethod
     def _safe_node_type(value: object) -> str:
         allowed = {"core", "normal", "counterexample", "skeleton", "question", "answer", "knowledge"}
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import ContextConfig, PrefetchConfig
+from ..db import ConnectionPool
+from ..llm_client import LlmClient
+from ..models import Node
+from ..repository import Repository, node_content_hash
+from .graph_service import GraphService
+
+
+class PrefetchService:
+    """Suggests follow-up questions after an answer and optionally pre-generates the top one.
+
+    Work is best-effort: at most `max_inflight` jobs run at once (extra requests are dropped, not
+    queued), each session may spend at most `session_budget` LLM calls per `budget_window_seconds`,
+    and a job stops as soon as its session has been idle for `idle_seconds`. A job holds a pooled
+    connection only while it reads or writes, never across an LLM call.
+    """
+
+    def __init__(
+        self,
+        cfg: PrefetchConfig,
+        llm: LlmClient,
+        pool: ConnectionPool,
+        context_cfg: ContextConfig | None = None,
+    ) -> None:
+        self.cfg = cfg
+        self.llm = llm
+        self.pool = pool
+        self.context_cfg = context_cfg
+        self._executor = ThreadPoolExecutor(max_workers=cfg.max_inflight, thread_name_prefix="graphchat-prefetch")
+        self._lock = threading.Lock()
+        self._last_seen: dict[str, float] = {}
+        # session id -> (start of its budget window, LLM calls spent in it)
+        self._spent: dict[str, tuple[float, int]] = {}
+        self._running: set[str] = set()
+        self._pruned_at = time.monotonic()
+        self._closed = threading.Event()
+
+    def touch(self, session_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._last_seen[session_id] = now
+            self._prune(now)
+
+    def schedule(self, session_id: str, question: str, answer_node: Node) -> bool:
+        if not self.cfg.enabled or self._closed.is_set():
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._last_seen[session_id] = now
+            self._prune(now)
+            if session_id in self._running or len(self._running) >= self.cfg.max_inflight:
+                return False
+            if self._spent_in_window(session_id, now) >= self.cfg.session_budget:
+                return False
+            self._running.add(session_id)
+        self._executor.submit(self._run, session_id, question, answer_node.id, answer_node.content)
+        return True
+
+    def close(self) -> None:
+        self._closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prune(self, now: float) -> None:
+        """Forget idle sessions and lapsed budget windows; call with `_lock` held."""
+        # Every request touches a session, so the sweep runs at most once per idle period.
+        if now - self._pruned_at < self.cfg.idle_seconds:
+            return
+        self._pruned_at = now
+        for session_id in [s for s, seen in self._last_seen.items() if now - seen > self.cfg.idle_seconds]:
+            if session_id not in self._running:
+                del self._last_seen[session_id]
+        for session_id in [s for s, (start, _) in self._spent.items() if now - start >= self.cfg.budget_window_seconds]:
+            if session_id not in self._running:
+                del self._spent[session_id]
+
+    def _spent_in_window(self, session_id: str, now: float) -> int:
+        start, spent = self._spent.get(session_id, (now, 0))
+        return spent if now - start < self.cfg.budget_window_seconds else 0
+
+    def _cancelled(self, session_id: str) -> bool:
+        if self._closed.is_set():
+            return True
+        with self._lock:
+            last_seen = self._last_seen.get(session_id, 0.0)
+        return time.monotonic() - last_seen > self.cfg.idle_seconds
+
+    def _charge(self, session_id: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            spent = self._spent_in_window(session_id, now)
+            if spent >= self.cfg.session_budget:
+                return False
+            start = self._spent[session_id][0] if spent else now
+            self._spent[session_id] = (start, spent + 1)
+            return True
+
+    def _run(self, session_id: str, question: str, answer_node_id: str, answer_content: str) -> None:
+        try:
+            if self._cancelled(session_id) or not self._charge(session_id):
+                return
+            questions = self._suggest(question, answer_content)
+            if not questions or self._cancelled(session_id):
+                return
+            conn = self.pool.acquire()
+            try:
+                repo = Repository(conn, self.pool.shards)
+                suggestions = repo.replace_suggestions(session_id, answer_node_id, questions)
+                if not self.cfg.pregenerate_answer or not self._charge(session_id):
+                    return
+                top = suggestions[0]
+                selected, system_prompt, user_prompt = GraphService(
+                    repo, self.llm, self.context_cfg
+                ).ask_stream_prompts(session_id, top.question, [answer_node_id], [])
+            finally:
+                self.pool.release(conn)
+            if not selected:
+                return
+            # Recorded so the answer is not served once the node it was generated from changes.
+            source_hash = node_content_hash(selected[0])
+            parts: list[str] = []
+            stream = self.llm.stream_text_completion(system_prompt, user_prompt)
+            try:
+                for chunk in stream:
+                    if self._cancelled(session_id):
+                        return
+                    parts.append(chunk)
+            finally:
+                stream.close()
+            conn = self.pool.acquire()
+            try:
+                Repository(conn, self.pool.shards).set_suggestion_answer(
+                    session_id, top.id, "".join(parts), source_hash
+                )
+            finally:
+                self.pool.release(conn)
+        except Exception as exc:  # noqa: BLE001
+            print(f"[DEBUG] prefetch failed: session_id={session_id}, error={exc}")
+        finally:
+            with self._lock:
+                self._running.discard(session_id)
+
+    def _suggest(self, question: str, answer_content: str) -> list[str]:
+        system_prompt = (
+            "You are a knowledge graph tutor. "
+            "Return JSON with a single field: questions, a list of short follow-up questions "
+            "a learner is most likely to ask next, most likely first."
+        )
+        user_prompt = (
+            f"Previous question: {question}\n"
+            f"Answer:\n{answer_content}\n"
+            f"Suggest {self.cfg.suggestions} follow-up questions."
+        )
+        raw = self.llm.json_completion(system_prompt, user_prompt)
+        out: list[str] = []
+        for item in raw.get("questions", []):
+            text = str(item).strip()[:1200]
+            if text and text not in out:
+                out.append(text)
+        return out[: self.cfg.suggestions]
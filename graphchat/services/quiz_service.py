@@ -1 +1,114 @@
-"""Quiz feature removed."""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import QuizConfig
+from ..db import ConnectionPool
+from ..llm_client import LlmClient
+from ..metrics import metrics
+from ..models import Node, NodeQuizOut, QuizGenerateOut, QuizPageOut, QuizQuestionOut
+from ..repository import Repository, node_content_hash
+
+
+class QuizService:
+    """Generates quiz questions for many nodes per LLM call, stored by node content hash.
+
+    Only nodes whose hash has no stored quiz are sent, `batch_size` per call and at most
+    `max_inflight` calls at once, so re-quizzing an unchanged session costs no LLM calls.
+    """
+
+    def __init__(self, cfg: QuizConfig, llm: LlmClient, pool: ConnectionPool) -> None:
+        self.cfg = cfg
+        self.llm = llm
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=cfg.max_inflight, thread_name_prefix="graphchat-quiz")
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def quizzable(self, nodes: list[Node]) -> list[Node]:
+        return [n for n in nodes if n.node_type != "question" and len(n.content.strip()) >= self.cfg.min_chars]
+
+    def schedule(self, repo: Repository, session_id: str) -> QuizGenerateOut:
+        by_hash: dict[str, Node] = {}
+        for node in self.quizzable(repo.list_nodes(session_id)):
+            by_hash.setdefault(node_content_hash(node), node)
+        stored = repo.get_quiz_items(list(by_hash))
+        with self._lock:
+            todo = [(h, n) for h, n in by_hash.items() if h not in stored and h not in self._pending]
+            self._pending.update(h for h, _ in todo)
+        for start in range(0, len(todo), self.cfg.batch_size):
+            self._executor.submit(self._run, todo[start : start + self.cfg.batch_size])
+        return QuizGenerateOut(scheduled=len(todo), cached=len(stored))
+
+    def page(self, repo: Repository, session_id: str, offset: int, limit: int) -> QuizPageOut:
+        nodes = self.quizzable(repo.list_nodes(session_id))
+        window = nodes[offset : offset + limit]
+        hashes = {n.id: node_content_hash(n) for n in window}
+        stored = repo.get_quiz_items(list(set(hashes.values())))
+        with self._lock:
+            pending = sum(1 for n in window if hashes[n.id] in self._pending)
+        items = [
+            NodeQuizOut(
+                node_id=n.id,
+                title=n.title,
+                questions=[QuizQuestionOut(question=q, answer=a) for q, a in stored.get(hashes[n.id], [])],
+            )
+            for n in window
+        ]
+        return QuizPageOut(items=items, total=len(nodes), offset=offset, limit=limit, pending=pending)
+
+    def _run(self, batch: list[tuple[str, Node]]) -> None:
+        try:
+            # The LLM call runs without a pooled connection; one is only taken to store the result.
+            quizzes = self._generate(batch)
+            metrics.incr("quiz.llm_calls")
+            if quizzes:
+                conn = self.pool.acquire()
+                try:
+                    Repository(conn, self.pool.shards).save_quiz_items(quizzes)
+                finally:
+                    self.pool.release(conn)
+            metrics.incr("quiz.generated", len(quizzes))
+            metrics.incr("quiz.missing", len(batch) - len(quizzes))
+        except Exception as exc:  # noqa: BLE001
+            metrics.incr("quiz.failed")
+            print(f"[DEBUG] quiz batch failed: nodes={len(batch)}, error={exc}")
+        finally:
+            with self._lock:
+                self._pending.difference_update(h for h, _ in batch)
+
+    def _generate(self, batch: list[tuple[str, Node]]) -> dict[str, list[tuple[str, str]]]:
+        n = self.cfg.questions_per_node
+        system_prompt = (
+            "You write short-answer quiz questions that check understanding of learning notes. "
+            "Return JSON with a single field: quizzes, a list of objects with fields id and questions. "
+            f"Write exactly {n} questions for every node, each an object with fields question and answer. "
+            "Answers are at most two sentences. Use the node ids exactly as given."
+        )
+        blocks = [
+            f"[n{idx}] {node.title}\n{node.content[: self.cfg.max_node_chars]}" for idx, (_, node) in enumerate(batch)
+        ]
+        user_prompt = "Nodes:\n\n" + "\n\n".join(blocks)
+        raw = self.llm.json_completion(system_prompt, user_prompt)
+        refs = {f"n{idx}": content_hash for idx, (content_hash, _) in enumerate(batch)}
+        out: dict[str, list[tuple[str, str]]] = {}
+        for item in raw.get("quizzes", []) if isinstance(raw.get("quizzes"), list) else []:
+            if not isinstance(item, dict):
+                continue
+            content_hash = refs.get(str(item.get("id", "")).strip("[] "))
+            questions = item.get("questions")
+            if content_hash is None or not isinstance(questions, list):
+                continue
+            pairs = [
+                (str(q.get("question", "")).strip(), str(q.get("answer", "")).strip())
+                for q in questions
+                if isinstance(q, dict)
+            ]
+            pairs = [(q, a) for q, a in pairs if q and a][:n]
+            if pairs:
+                out[content_hash] = pairs
+        return out
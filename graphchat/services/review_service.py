@@ -1 +1,82 @@
-"""Review feature removed."""
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from ..models import ReviewGradeIn, ReviewGradesOut, ReviewItemOut
+from ..repository import Repository
+
+DAY_SECONDS = 86400.0
+MIN_EASE = 1.3
+# Failed items come back after ten minutes, within the same study session.
+RELEARN_SECONDS = 600.0
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def next_state(state: dict[str, Any], grade: int, now: float) -> dict[str, Any]:
+    """SM-2: grades 0-5, below 3 is a lapse that restarts the item's interval sequence."""
+    ease = float(state["ease"])
+    repetitions = int(state["repetitions"])
+    lapses = int(state["lapses"])
+    if grade < 3:
+        repetitions = 0
+        lapses += 1
+        interval_days = 0.0
+        due_at = now + RELEARN_SECONDS
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1.0
+        elif repetitions == 2:
+            interval_days = 6.0
+        else:
+            interval_days = max(1.0, float(state["interval_days"]) * ease)
+        due_at = now + interval_days * DAY_SECONDS
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return {
+        "node_id": state["node_id"],
+        "session_id": state["session_id"],
+        "due_at": due_at,
+        "interval_days": interval_days,
+        "ease": ease,
+        "repetitions": repetitions,
+        "lapses": lapses,
+        "last_reviewed_at": now,
+    }
+
+
+class ReviewService:
+    """Spaced-repetition queue over `review_states`; every read and write is an index lookup."""
+
+    def __init__(self, repo: Repository) -> None:
+        self.repo = repo
+
+    def enroll(self, session_id: str, node_ids: list[str]) -> int:
+        return self.repo.enroll_reviews(session_id, node_ids, due_at=time.time())
+
+    def due(self, limit: int, session_id: str | None = None) -> list[ReviewItemOut]:
+        return [
+            ReviewItemOut(
+                node=node,
+                due_at=_iso(float(state["due_at"])),
+                interval_days=float(state["interval_days"]),
+                ease=float(state["ease"]),
+                repetitions=int(state["repetitions"]),
+                lapses=int(state["lapses"]),
+            )
+            for node, state in self.repo.due_reviews(time.time(), limit, session_id)
+        ]
+
+    def grade(self, grades: list[ReviewGradeIn]) -> ReviewGradesOut:
+        now = time.time()
+        # A node graded twice in one batch keeps its last grade.
+        latest = {g.node_id: g.grade for g in grades}
+        states = self.repo.get_review_states(list(latest))
+        updated = [next_state(dict(states[nid]), grade, now) for nid, grade in latest.items() if nid in states]
+        if updated:
+            self.repo.save_review_states(updated)
+        return ReviewGradesOut(updated=len(updated), missing=[nid for nid in latest if nid not in states])
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import html
+import re
+
+from ..models import SearchHitOut, SearchPageOut
+from ..repository import Repository
+
+# The trigram index can only look up terms of at least three characters.
+MIN_INDEXED_TERM = 3
+SNIPPET_CHARS = 96
+
+
+def _terms_pattern(terms: list[str]) -> re.Pattern[str]:
+    return re.compile("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+
+
+def _highlight(text: str, pattern: re.Pattern[str]) -> str:
+    """`text` HTML-escaped, with each term occurrence wrapped in <mark>."""
+    out: list[str] = []
+    pos = 0
+    for m in pattern.finditer(text):
+        out.append(html.escape(text[pos : m.start()], quote=False))
+        out.append(f"<mark>{html.escape(m.group(0), quote=False)}</mark>")
+        pos = m.end()
+    out.append(html.escape(text[pos:], quote=False))
+    return "".join(out)
+
+
+def _snippet(content: str, pattern: re.Pattern[str]) -> str:
+    """The highlighted part of `content` around the first term occurrence."""
+    first = pattern.search(content)
+    start = max(0, first.start() - SNIPPET_CHARS // 3) if first is not None else 0
+    end = start + SNIPPET_CHARS
+    return ("..." if start else "") + _highlight(content[start:end], pattern) + ("..." if end < len(content) else "")
+
+
+class SearchService:
+    """Full-text search over node titles and content, through the `nodes_fts` trigram index."""
+
+    def __init__(self, repo: Repository, max_candidates: int = 0) -> None:
+        self.repo = repo
+        self.max_candidates = max_candidates
+
+    def search(self, query: str, limit: int, offset: int = 0, session_id: str | None = None) -> SearchPageOut:
+        """Nodes containing every whitespace-separated term of `query`, best match first.
+
+        Terms are matched as literal substrings, case-insensitively. Shorter terms than the index
+        can look up are checked with LIKE against the indexed hits, or, when the query has no
+        longer term, against every node of `session_id`; such a query cannot be global.
+        """
+        terms = list(dict.fromkeys(query.split()))
+        if not terms:
+            raise ValueError("Empty search query.")
+        indexed = [t for t in terms if len(t) >= MIN_INDEXED_TERM]
+        short = [t for t in terms if len(t) < MIN_INDEXED_TERM]
+        if not indexed and session_id is None:
+            raise ValueError(f"Search across sessions needs a term of at least {MIN_INDEXED_TERM} characters.")
+        # Each term as an FTS5 phrase, so operators and punctuation in user input are plain text.
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in indexed) or None
+        rows = self.repo.search_nodes(match, short, limit + 1, offset, session_id, self.max_candidates, terms)
+        # Trigram matches are case-insensitive substrings, so marking the same in Python agrees
+        # with the index, and only the returned page pays for it.
+        pattern = _terms_pattern(terms)
+        items = [
+            SearchHitOut(
+                node=node,
+                title_html=_highlight(node.title, pattern),
+                snippet_html=_snippet(node.content, pattern),
+                score=score,
+            )
+            for node, score in rows[:limit]
+        ]
+        return SearchPageOut(items=items, offset=offset, limit=limit, has_more=len(rows) > limit)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..config import SummaryConfig
+from ..db import ConnectionPool
+from ..llm_client import LlmClient
+from ..metrics import metrics
+from ..models import Node
+from ..repository import Repository, node_content_hash
+
+
+class SummaryService:
+    """Generates short per-node summaries in the background, cached by content hash.
+
+    Nodes shorter than `min_chars` are never summarized; prompts use their content directly.
+    At most `max_pending` nodes wait for summarization, extra requests are dropped and retried
+    the next time the node is scheduled.
+    """
+
+    def __init__(self, cfg: SummaryConfig, llm: LlmClient, pool: ConnectionPool) -> None:
+        self.cfg = cfg
+        self.llm = llm
+        self.pool = pool
+        self._executor = ThreadPoolExecutor(max_workers=cfg.max_inflight, thread_name_prefix="graphchat-summary")
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+
+    def schedule(self, session_id: str, nodes: list[Node]) -> None:
+        if not self.cfg.enabled:
+            return
+        for node in nodes:
+            if len(node.content) < self.cfg.min_chars:
+                continue
+            with self._lock:
+                if node.id in self._pending or len(self._pending) >= self.cfg.max_pending:
+                    continue
+                self._pending.add(node.id)
+            self._executor.submit(self._run, session_id, node.id)
+
+    def schedule_ids(self, session_id: str, repo: Repository, node_ids: list[str]) -> None:
+        if self.cfg.enabled and node_ids:
+            self.schedule(session_id, repo.get_nodes_by_ids(session_id, node_ids))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, session_id: str, node_id: str) -> None:
+        try:
+            # Re-read so the summary matches the finalized content, not a streaming snapshot.
+            node = self._stale_node(session_id, node_id)
+            if node is None:
+                return
+            # No pooled connection is held while the model writes.
+            summary = self._summarize(node)
+            if not summary:
+                return
+            content_hash = node_content_hash(node)
+            conn = self.pool.acquire()
+            try:
+                repo = Repository(conn, self.pool.shards)
+                current = repo.get_nodes_by_ids(session_id, [node_id])
+                # An edit during the call would make this summary describe old content.
+                if not current or node_content_hash(current[0]) != content_hash:
+                    metrics.incr("summaries.discarded")
+                    return
+                repo.upsert_node_summary(session_id, node.id, content_hash, summary)
+            finally:
+                self.pool.release(conn)
+            metrics.incr("summaries.generated")
+        except Exception as exc:  # noqa: BLE001
+            metrics.incr("summaries.failed")
+            print(f"[DEBUG] summary failed: node_id={node_id}, error={exc}")
+        finally:
+            with self._lock:
+                self._pending.discard(node_id)
+
+    def _stale_node(self, session_id: str, node_id: str) -> Node | None:
+        """The node if it still exists and has no summary for its current content."""
+        conn = self.pool.acquire()
+        try:
+            repo = Repository(conn, self.pool.shards)
+            nodes = repo.get_nodes_by_ids(session_id, [node_id])
+            if not nodes or repo.get_fresh_summaries(nodes):
+                return None
+            return nodes[0]
+        finally:
+            self.pool.release(conn)
+
+    def _summarize(self, node: Node) -> str:
+        system_prompt = (
+            "You are a learning content summarizer. "
+            "Return JSON with a single field: summary. "
+            f"The summary must be at most {self.cfg.max_chars} characters, plain text, "
+            "and keep the key terms and formulas a learner would need to recall the node."
+        )
+        user_prompt = f"Title: {node.title}\nContent:\n{node.content}"
+        raw = self.llm.json_completion(system_prompt, user_prompt)
+        return str(raw.get("summary", "")).strip()[: self.cfg.max_chars]
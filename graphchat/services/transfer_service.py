@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import uuid
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from typing import Any
+
+from ..archive import archived_rows
+from ..db import SCHEMA_VERSION, ShardRouter
+
+EXPORT_FORMAT = "graphchat-ndjson"
+EXPORT_VERSION = 1
+
+SESSION_COLUMNS = ("id", "topic", "created_at")
+NODE_COLUMNS = ("id", "session_id", "title", "content", "x", "y", "width", "node_type", "deleted_at", "created_at")
+EDGE_COLUMNS = ("id", "session_id", "source_node_id", "target_node_id", "source_section_key", "edge_type", "created_at")
+MATERIAL_COLUMNS = ("id", "session_id", "filename", "mime_type", "content_hash", "created_at")
+
+
+def _line(kind: str, row: sqlite3.Row | dict[str, Any]) -> str:
+    return json.dumps({"type": kind, **dict(row)}, ensure_ascii=False) + "\n"
+
+
+def export_ndjson(
+    conn: sqlite3.Connection, session_ids: list[str] | None = None, shards: ShardRouter | None = None
+) -> Iterator[str]:
+    """Yield one JSON line per row; every query is consumed lazily so memory stays flat.
+
+    Per session the order is session, nodes, edges, then materials, so an importer only needs
+    that session's node ids in memory. Each material body is written once per export, right
+    before the first material that references it. `conn` is the catalog; with `shards` each
+    session's rows are read from its shard over connections owned by this export.
+    """
+    shard_conns: dict[int, sqlite3.Connection] = {}
+    try:
+        yield from _export_rows(conn, session_ids, shards, shard_conns)
+    finally:
+        for shard_conn in shard_conns.values():
+            shard_conn.close()
+
+
+def _export_rows(
+    conn: sqlite3.Connection,
+    session_ids: list[str] | None,
+    shards: ShardRouter | None,
+    shard_conns: dict[int, sqlite3.Connection],
+) -> Iterator[str]:
+    yield _line("header", {"format": EXPORT_FORMAT, "version": EXPORT_VERSION, "schema_version": SCHEMA_VERSION})
+    if session_ids is None:
+        sessions: Iterable[sqlite3.Row] = conn.execute(
+            f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions ORDER BY created_at ASC"
+        )
+    else:
+        sessions = (
+            row
+            for sid in session_ids
+            for row in conn.execute(f"SELECT {', '.join(SESSION_COLUMNS)} FROM sessions WHERE id = ?", (sid,))
+        )
+    exported_blobs: set[str] = set()
+    for session in sessions:
+        sid = session["id"]
+        db = conn
+        if shards is not None:
+            index = shards.index(sid)
+            if index not in shard_conns:
+                shard_conns[index] = shards.open(index)
+            db = shard_conns[index]
+        yield _line("session", session)
+        archived_nodes = archived_rows(db, sid, "nodes")
+        if archived_nodes is not None:
+            # Exported from the archive as is; exporting never moves a session back to the hot tables.
+            archived_nodes.sort(key=lambda r: r["created_at"])
+            for item in archived_nodes:
+                yield _line("node", {c: item.get(c) for c in NODE_COLUMNS})
+            archived_edges = archived_rows(db, sid, "edges") or []
+            archived_edges.sort(key=lambda r: r["created_at"])
+            for item in archived_edges:
+                yield _line("edge", {c: item.get(c) for c in EDGE_COLUMNS})
+        else:
+            for row in db.execute(
+                f"SELECT {', '.join(NODE_COLUMNS)} FROM nodes WHERE session_id = ? ORDER BY created_at ASC", (sid,)
+            ):
+                yield _line("node", row)
+            for row in db.execute(
+                f"SELECT {', '.join(EDGE_COLUMNS)} FROM edges WHERE session_id = ? ORDER BY created_at ASC", (sid,)
+            ):
+                yield _line("edge", row)
+        for row in db.execute(
+            f"SELECT {', '.join(MATERIAL_COLUMNS)} FROM materials WHERE session_id = ? ORDER BY created_at ASC",
+            (sid,),
+        ):
+            content_hash = row["content_hash"]
+            if content_hash not in exported_blobs:
+                exported_blobs.add(content_hash)
+                yield from _export_blob(conn, content_hash)
+            yield _line("material", row)
+
+
+def _export_blob(conn: sqlite3.Connection, content_hash: str) -> Iterator[str]:
+    blob = conn.execute(
+        "SELECT content_hash, size_bytes, created_at FROM material_blobs WHERE content_hash = ?", (content_hash,)
+    ).fetchone()
+    if blob is None:
+        return
+    yield _line("material_blob", blob)
+    for row in conn.execute(
+        "SELECT content_hash, seq, content_text FROM material_blob_chunks WHERE content_hash = ? ORDER BY seq ASC",
+        (content_hash,),
+    ):
+        yield _line("material_chunk", row)
+
+
+class NdjsonImporter:
+    """Bulk-loads an `export_ndjson` stream with fresh ids, batching rows through `executemany`.
+
+    Batches are flushed every `batch_size` rows to bound memory, but the whole import is a single
+    transaction: on any error nothing is kept. With `shards` there is one transaction per touched
+    file, committed shards first, so a failure can at worst leave rows no catalog entry lists.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = 5000, shards: ShardRouter | None = None) -> None:
+        self.conn = conn
+        self.batch_size = batch_size
+        self.shards = shards
+        self._shard_conns: dict[int, sqlite3.Connection] = {}
+        self.session_ids: dict[str, str] = {}
+        self.counts = {"sessions": 0, "nodes": 0, "edges": 0, "materials": 0, "material_blobs": 0}
+        self._node_ids: dict[str, str] = {}
+        self._current_session: str | None = None
+        self._new_blobs: set[str] = set()
+        self._known_blobs: set[str] = set()
+        self._started_at = datetime.now(timezone.utc).isoformat()
+        self._pending: dict[str, list[tuple[Any, ...]]] = {
+            "sessions": [],
+            "nodes": [],
+            "edges": [],
+            "blobs": [],
+            "chunks": [],
+            "materials": [],
+        }
+        self._buffered = 0
+
+    def run(self, lines: Iterable[str | bytes]) -> dict[str, Any]:
+        try:
+            for lineno, raw in enumerate(lines, start=1):
+                text = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                if not text.strip():
+                    continue
+                try:
+                    item = json.loads(text)
+                except json.JSONDecodeError as exc:
+                    raise ValueError(f"Line {lineno}: invalid JSON ({exc.msg}).") from exc
+                self._add(lineno, item)
+                if self._buffered >= self.batch_size:
+                    self._flush()
+            self._flush()
+            for shard_conn in self._shard_conns.values():
+                shard_conn.commit()
+            self.conn.commit()
+        except BaseException:
+            for shard_conn in self._shard_conns.values():
+                shard_conn.rollback()
+            self.conn.rollback()
+            raise
+        finally:
+            for shard_conn in self._shard_conns.values():
+                shard_conn.close()
+            self._shard_conns.clear()
+        return {**self.counts, "session_ids": self.session_ids}
+
+    def _add(self, lineno: int, item: dict[str, Any]) -> None:
+        kind = item.get("type")
+        if kind == "header":
+            if item.get("format") != EXPORT_FORMAT or int(item.get("version", 0)) > EXPORT_VERSION:
+                raise ValueError(f"Line {lineno}: unsupported export format.")
+            return
+        if kind == "session":
+            if self.shards is not None:
+                # Pending rows always belong to the current session, and so to one shard.
+                self._flush()
+            # Node ids only need to resolve within their own session.
+            new_sid = str(uuid.uuid4())
+            self.session_ids[str(item["id"])] = new_sid
+            self._current_session = new_sid
+            self._node_ids = {}
+            # An import counts as activity, so old sessions are not archived right after it.
+            self._queue("sessions", (new_sid, item["topic"], item["created_at"], self._started_at))
+            return
+        if kind == "material_blob":
+            content_hash = str(item["content_hash"])
+            if content_hash in self._known_blobs:
+                return
+            self._known_blobs.add(content_hash)
+            exists = self.conn.execute(
+                "SELECT 1 FROM material_blobs WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if exists is None:
+                self._new_blobs.add(content_hash)
+                self._queue("blobs", (content_hash, int(item["size_bytes"]), item.get("created_at") or ""))
+            return
+        if kind == "material_chunk":
+            if item["content_hash"] in self._new_blobs:
+                self._queue("chunks", (item["content_hash"], int(item["seq"]), item["content_text"]))
+            return
+        if self._current_session is None:
+            raise ValueError(f"Line {lineno}: {kind} row before any session row.")
+        sid = self._current_session
+        if kind == "node":
+            new_id = str(uuid.uuid4())
+            self._node_ids[str(item["id"])] = new_id
+            self._queue(
+                "nodes",
+                (
+                    new_id,
+                    sid,
+                    item["title"],
+                    item["content"],
+                    float(item["x"]),
+                    float(item["y"]),
+                    float(item.get("width") or 400.0),
+                    item["node_type"],
+                    item.get("deleted_at"),
+                    item["created_at"],
+                ),
+            )
+        elif kind == "edge":
+            source = self._node_ids.get(str(item["source_node_id"]))
+            target = self._node_ids.get(str(item["target_node_id"]))
+            if source is None or target is None:
+                return
+            self._queue(
+                "edges",
+                (
+                    str(uuid.uuid4()),
+                    sid,
+                    source,
+                    target,
+                    item.get("source_section_key"),
+                    item["edge_type"],
+                    item["created_at"],
+                ),
+            )
+        elif kind == "material":
+            content_hash = str(item["content_hash"])
+            if content_hash not in self._known_blobs:
+                raise ValueError(f"Line {lineno}: material references unknown body {content_hash}.")
+            self._queue(
+                "materials",
+                (str(uuid.uuid4()), sid, item["filename"], item["mime_type"], "", content_hash, item["created_at"]),
+            )
+        else:
+            raise ValueError(f"Line {lineno}: unknown row type {kind!r}.")
+
+    def _queue(self, table: str, row: tuple[Any, ...]) -> None:
+        self._pending[table].append(row)
+        self._buffered += 1
+
+    def _session_db(self) -> sqlite3.Connection:
+        if self.shards is None or self._current_session is None:
+            return self.conn
+        index = self.shards.index(self._current_session)
+        if index not in self._shard_conns:
+            self._shard_conns[index] = self.shards.open(index)
+        return self._shard_conns[index]
+
+    def _flush(self) -> None:
+        p = self._pending
+        db = self._session_db()
+        self.conn.executemany("INSERT INTO sessions(id, topic, created_at, active_at) VALUES (?, ?, ?, ?)", p["sessions"])
+        if db is not self.conn:
+            db.executemany("INSERT INTO sessions(id, topic, created_at, active_at) VALUES (?, ?, ?, ?)", p["sessions"])
+        db.executemany(
+            """
+            INSERT INTO nodes(id, session_id, title, content, x, y, width, node_type, deleted_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            p["nodes"],
+        )
+        db.executemany(
+            """
+            INSERT INTO edges(id, session_id, source_node_id, target_node_id, source_section_key, edge_type, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            p["edges"],
+        )
+        self.conn.executemany(
+            "INSERT INTO material_blobs(content_hash, size_bytes, ref_count, created_at) VALUES (?, ?, 0, ?)",
+            p["blobs"],
+        )
+        self.conn.executemany(
+            "INSERT INTO material_blob_chunks(content_hash, seq, content_text) VALUES (?, ?, ?)",
+            p["chunks"],
+        )
+        db.executemany(
+            """
+            INSERT INTO materials(id, session_id, filename, mime_type, content_text, content_hash, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            p["materials"],
+        )
+        refs: dict[str, int] = {}
+        for row in p["materials"]:
+            refs[row[5]] = refs.get(row[5], 0) + 1
+        self.conn.executemany(
+            "UPDATE material_blobs SET ref_count = ref_count + ? WHERE content_hash = ?",
+            [(n, h) for h, n in refs.items()],
+        )
+        self.counts["sessions"] += len(p["sessions"])
+        self.counts["nodes"] += len(p["nodes"])
+        self.counts["edges"] += len(p["edges"])
+        self.counts["materials"] += len(p["materials"])
+        self.counts["material_blobs"] += len(p["blobs"])
+        for rows in p.values():
+            rows.clear()
+        self._buffered = 0
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+from collections import deque
+
+from ..models import GraphOut, NodeDepthOut, PathOut
+from ..repository import Repository
+
+
+class TraversalService:
+    """Read-only walks over one session's graph; edges point from a node to what it led to."""
+
+    def __init__(self, repo: Repository) -> None:
+        self.repo = repo
+
+    def ancestors(self, session_id: str, node_id: str, max_depth: int) -> list[NodeDepthOut]:
+        return [
+            NodeDepthOut(node=node, depth=depth)
+            for node, depth in self.repo.walk_nodes(session_id, [node_id], "ancestors", max_depth)
+        ]
+
+    def descendants(self, session_id: str, node_id: str, max_depth: int) -> list[NodeDepthOut]:
+        return [
+            NodeDepthOut(node=node, depth=depth)
+            for node, depth in self.repo.walk_nodes(session_id, [node_id], "descendants", max_depth)
+        ]
+
+    def component(self, session_id: str, node_id: str) -> GraphOut | None:
+        ids = self.repo.component_node_ids(session_id, node_id)
+        if not ids:
+            return None
+        members = set(ids)
+        nodes = [n for n in self.repo.list_nodes(session_id) if n.id in members]
+        edges = [
+            e
+            for e in self.repo.list_edges(session_id)
+            if e.source_node_id in members and e.target_node_id in members
+        ]
+        return GraphOut(nodes=nodes, edges=edges)
+
+    def shortest_path(self, session_id: str, source_id: str, target_id: str, directed: bool) -> PathOut | None:
+        # Plain BFS over one adjacency load: a recursive CTE would have to carry every partial path.
+        adjacency: dict[str, list[str]] = {}
+        for src, dst in self.repo.list_edge_pairs(session_id):
+            adjacency.setdefault(src, []).append(dst)
+            if not directed:
+                adjacency.setdefault(dst, []).append(src)
+        known = {n.id for n in self.repo.get_nodes_by_ids(session_id, [source_id, target_id])}
+        if source_id not in known or target_id not in known:
+            return None
+        previous: dict[str, str | None] = {source_id: None}
+        frontier = deque([source_id])
+        while frontier and target_id not in previous:
+            current = frontier.popleft()
+            for nxt in adjacency.get(current, ()):
+                if nxt not in previous:
+                    previous[nxt] = current
+                    frontier.append(nxt)
+        if target_id not in previous:
+            return None
+        path: list[str] = []
+        step: str | None = target_id
+        while step is not None:
+            path.append(step)
+            step = previous[step]
+        path.reverse()
+        by_id = {n.id: n for n in self.repo.get_nodes_by_ids(session_id, path)}
+        hops = set(zip(path, path[1:]))
+        edges = [
+            e
+            for e in self.repo.list_edges(session_id)
+            if (e.source_node_id, e.target_node_id) in hops
+            or (not directed and (e.target_node_id, e.source_node_id) in hops)
+        ]
+        return PathOut(node_ids=path, nodes=[by_id[nid] for nid in path], edges=edges)
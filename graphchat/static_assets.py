@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import re
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from .http_cache import accepted_encodings, brotli, compress, etag_matches
+
+# Vite emits `assets/<name>-<hash>.<ext>`; those URLs change whenever the content does.
+HASHED_ASSET_RE = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+COMPRESSIBLE_SUFFIXES = {".js", ".mjs", ".css", ".html", ".json", ".map", ".svg", ".txt", ".xml", ".wasm"}
+PRECOMPRESSED_SUFFIXES = {".br": "br", ".gz": "gzip"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+@dataclass
+class Asset:
+    path: Path
+    media_type: str
+    cache_control: str
+    body: bytes | None = None
+    etag: str = ""
+    encoded: dict[str, bytes] = field(default_factory=dict)
+    loaded: bool = False
+
+
+class StaticAssets:
+    """Serves the built frontend from memory.
+
+    The directory is indexed once at startup; each file is read, hashed and compressed the first
+    time it is requested and then kept in memory. `.br`/`.gz` siblings produced by the build are
+    used as-is. Files above `max_cached_bytes` are streamed from disk uncompressed.
+    """
+
+    def __init__(self, root: Path, min_compress_bytes: int = 1024, max_cached_bytes: int = 16 * 1024 * 1024) -> None:
+        self.root = root
+        self.min_compress_bytes = min_compress_bytes
+        self.max_cached_bytes = max_cached_bytes
+        self._lock = threading.Lock()
+        self._assets: dict[str, Asset] = {}
+        if root.is_dir():
+            self._index()
+
+    def _index(self) -> None:
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file() or path.suffix in PRECOMPRESSED_SUFFIXES:
+                continue
+            rel = path.relative_to(self.root).as_posix()
+            media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            cache_control = IMMUTABLE if HASHED_ASSET_RE.match(rel) else REVALIDATE
+            self._assets[rel] = Asset(path=path, media_type=media_type, cache_control=cache_control)
+
+    @property
+    def has_index(self) -> bool:
+        return "index.html" in self._assets
+
+    def response(self, request: Request, rel_path: str) -> Response | None:
+        # Only paths found while indexing are served, so `..` tricks cannot escape the root.
+        asset = self._assets.get(rel_path)
+        if asset is None:
+            return None
+        if not asset.loaded:
+            self._load(asset)
+        headers = {"Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+        if asset.body is None:
+            return FileResponse(asset.path, media_type=asset.media_type, headers=headers)
+        headers["ETag"] = asset.etag
+        if etag_matches(request, asset.etag):
+            return Response(status_code=304, headers=headers)
+        body = asset.body
+        accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in asset.encoded:
+                body = asset.encoded[encoding]
+                headers["Content-Encoding"] = encoding
+                break
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+    def _load(self, asset: Asset) -> None:
+        with self._lock:
+            if asset.loaded:
+                return
+            if asset.path.stat().st_size <= self.max_cached_bytes:
+                body = asset.path.read_bytes()
+                asset.etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+                for suffix, encoding in PRECOMPRESSED_SUFFIXES.items():
+                    sibling = asset.path.with_name(asset.path.name + suffix)
+                    if sibling.is_file():
+                        asset.encoded[encoding] = sibling.read_bytes()
+                if asset.path.suffix in COMPRESSIBLE_SUFFIXES and len(body) >= self.min_compress_bytes:
+                    if "gzip" not in asset.encoded:
+                        asset.encoded["gzip"] = compress(body, "gzip")
+                    if "br" not in asset.encoded and brotli is not None:
+                        asset.encoded["br"] = compress(body, "br")
+                asset.body = body
+            asset.loaded = True
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from graphchat.config import SearchConfig  # noqa: E402
+
+BATCH = 10000
+WORDS_PER_NODE = 40
+# Sessions are written to a few at a time, so each session's rows sit in one stretch of the table
+# interleaved with its cohort's, rather than evenly spread over the whole table.
+ACTIVE_SESSIONS = 20
+
+
+def _vocabulary(size: int, rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {"".join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size * 2)}
+    return sorted(words)[:size]
+
+
+def _build(db_path: Path, nodes: int, sessions: int, rng: random.Random) -> list[str]:
+    from graphchat.db import connect, init_db
+
+    init_db(str(db_path))
+    vocab = _vocabulary(5000, rng)
+    # Zipf-like word frequencies, so the corpus has both very common and rare terms.
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    session_ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    conn = connect(str(db_path))
+    try:
+        conn.executemany(
+            "INSERT INTO sessions(id, topic, created_at) VALUES (?, ?, '2024-01-01T00:00:00+00:00')",
+            [(sid, f"topic {i}") for i, sid in enumerate(session_ids)],
+        )
+        cohort_nodes = max(1, nodes * ACTIVE_SESSIONS // sessions)
+        for start in range(0, nodes, BATCH):
+            rows = []
+            for i in range(start, min(start + BATCH, nodes)):
+                words = rng.choices(vocab, weights, k=WORDS_PER_NODE + 3)
+                session = min(sessions - 1, i // cohort_nodes * ACTIVE_SESSIONS + rng.randrange(ACTIVE_SESSIONS))
+                rows.append(
+                    (
+                        str(uuid.uuid4()),
+                        session_ids[session],
+                        " ".join(words[:3]),
+                        " ".join(words[3:]),
+                        f"2024-01-01T00:00:00.{i:06d}+00:00",
+                    )
+                )
+            conn.executemany(
+                """
+                INSERT INTO nodes(id, session_id, title, content, x, y, width, node_type, created_at)
+                VALUES (?, ?, ?, ?, 0, 0, 400, 'knowledge', ?)
+                """,
+                rows,
+            )
+            conn.commit()
+            print(f"\r  {min(start + BATCH, nodes):>9} nodes", end="", file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+    finally:
+        conn.close()
+    return [vocab[0], vocab[50], vocab[len(vocab) - 1], session_ids[0]]
+
+
+def _time_search(
+    db_path: Path, query: str, runs: int, max_candidates: int, **kwargs: object
+) -> tuple[list[float], int]:
+    from graphchat.db import connect
+    from graphchat.repository import Repository
+    from graphchat.services.search_service import SearchService
+
+    conn = connect(str(db_path))
+    try:
+        service = SearchService(Repository(conn), max_candidates)
+        samples: list[float] = []
+        hits = 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            hits = len(service.search(query, **kwargs).items)  # type: ignore[arg-type]
+            samples.append(time.perf_counter() - start)
+    finally:
+        conn.close()
+    return samples, hits
+
+
+def _report(label: str, samples: list[float], hits: int) -> None:
+    median_ms = statistics.median(samples) * 1000
+    best_ms = min(samples) * 1000
+    print(f"{label:<40} median={median_ms:8.1f} ms  best={best_ms:8.1f} ms  hits={hits:<3} runs={len(samples)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure full-text node search latency on a synthetic corpus.")
+    parser.add_argument("--nodes", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--max-candidates", type=int, default=SearchConfig().max_candidates)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "search.db"
+        start = time.perf_counter()
+        common, medium, rare, session_id = _build(db_path, args.nodes, args.sessions, rng)
+        print(f"{'build + index':<40} {time.perf_counter() - start:8.1f} s  size={db_path.stat().st_size / 2**20:.0f} MiB")
+        cases: list[tuple[str, str, int, dict[str, object]]] = [
+            ("global, rare term", rare, args.max_candidates, {}),
+            ("global, medium term", medium, args.max_candidates, {}),
+            ("global, most common term", common, args.max_candidates, {}),
+            ("global, most common term, all ranked", common, 0, {}),
+            ("global, two terms", f"{common} {medium}", args.max_candidates, {}),
+            ("global, page at offset 1000", common, args.max_candidates, {"offset": 1000}),
+            ("session, medium term", medium, args.max_candidates, {"session_id": session_id}),
+            ("session, most common term", common, args.max_candidates, {"session_id": session_id}),
+            ("session, 2-char term (unindexed scan)", common[:2], args.max_candidates, {"session_id": session_id}),
+        ]
+        for label, query, max_candidates, kwargs in cases:
+            samples, hits = _time_search(db_path, query, args.runs, max_candidates, limit=20, **kwargs)
+            _report(label, samples, hits)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
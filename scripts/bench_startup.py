@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_CLI = "import graphchat.cli"
+IMPORT_APP = "import graphchat.main"
+BUILD_APP = (
+    "import asyncio\n"
+    "from graphchat.main import create_app\n"
+    "app = create_app()\n"
+    "async def boot():\n"
+    "    async with app.router.lifespan_context(app):\n"
+    "        pass\n"
+    "asyncio.run(boot())\n"
+)
+CHECK = "import sys\nfrom graphchat.cli import run\nsys.exit(run(['--check']))\n"
+
+
+def _write_config(workdir: Path) -> None:
+    example = json.loads((ROOT / "graphchat" / "config.example.json").read_text(encoding="utf-8"))
+    example["llm"]["api_key"] = "bench"
+    example["db"]["path"] = str(workdir / "app.db")
+    (workdir / "config.json").write_text(json.dumps(example), encoding="utf-8")
+
+
+def _time_python(code: str, cwd: Path, runs: int) -> list[float]:
+    samples: list[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            env={"PYTHONPATH": str(ROOT), "PYTHONDONTWRITEBYTECODE": "1"},
+        )
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _time_init_db(db_path: Path, runs: int) -> tuple[float, list[float]]:
+    sys.path.insert(0, str(ROOT))
+    from graphchat.db import init_db
+
+    start = time.perf_counter()
+    init_db(str(db_path))
+    fresh = time.perf_counter() - start
+    samples: list[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        init_db(str(db_path))
+        samples.append(time.perf_counter() - start)
+    return fresh, samples
+
+
+def _report(label: str, samples: list[float]) -> None:
+    median_ms = statistics.median(samples) * 1000
+    best_ms = min(samples) * 1000
+    print(f"{label:<32} median={median_ms:8.1f} ms  best={best_ms:8.1f} ms  runs={len(samples)}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure graphchat-server cold start phases.")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        _write_config(workdir)
+        fresh, noop = _time_init_db(workdir / "app.db", args.runs)
+        print(f"{'init_db (fresh schema)':<32} {fresh * 1000:8.1f} ms")
+        _report("init_db (version matches)", noop)
+        _report("import graphchat.cli", _time_python(IMPORT_CLI, workdir, args.runs))
+        _report("graphchat-server --check", _time_python(CHECK, workdir, args.runs))
+        _report("import graphchat.main", _time_python(IMPORT_APP, workdir, args.runs))
+        _report("create_app + lifespan startup", _time_python(BUILD_APP, workdir, args.runs))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())